@@ -0,0 +1,108 @@
+"""
+アラインメント結果をAlignedMoraのリストで持つ場合と、AlignedMoraTableで持つ場合のメモリ使用量を比較する。
+
+サンプルの歌詞をアラインメントした行を、曲ごとにファイル名とline_idを変えて複製し、コーパス全体の結果に見立てる。
+tracemallocで、結果を保持した時点のメモリと、DataFrameに変換するまでのピークのメモリを測る。
+
+    python benchmarks/bench_aligned_mora_table.py -r 10000 100000 1000000
+"""
+
+import argparse
+import dataclasses
+import gc
+import sys
+import tracemalloc
+from collections.abc import Callable, Iterator
+
+import pandas as pd
+
+from soramimi_align.align_mora import align_analyzed_lyrics
+from soramimi_align.aligned_mora_table import AlignedMoraTable
+from soramimi_align.schemas import AlignedMora, AnalyzedLyrics
+
+SAMPLE_DRAFT = """
+宇佐美 小石博孝
+ウサミ コイシヒロタカ
+うさぎ 追い しか の 山
+ウサギ/p オイ/p シカ ノ ヤマ/p
+
+小塚 辻勇夫 河
+コヅカ ツジイサオ カワ
+コブナ 釣り しか の 川
+コブナ/p ツリ/p シカ ノ カワ/p
+
+シューメーカー 熊野輝光
+シューメーカー クマノヒロミツ
+夢 は 今 も めぐり て
+ユメ/p ワ イマ/p モ メグリ/p テ
+
+夏目隆司 古田 荘
+ナツメタカシ フルタ ソウ
+忘れ がたき ふるさと
+ワスレ/p ガタキ フルサト/p
+"""
+
+
+def make_rows(row_count: int) -> Iterator[AlignedMora]:
+    sample_rows = align_analyzed_lyrics(AnalyzedLyrics.from_text(SAMPLE_DRAFT))
+    for i in range(row_count):
+        song_id, row_index = divmod(i, len(sample_rows))
+        yield dataclasses.replace(
+            sample_rows[row_index],
+            input_file_path=f"data/output/draft_{song_id:06d}.txt",
+        )
+
+
+def measure(func: Callable[[], object]) -> tuple[float, float, object]:
+    """
+    funcの返り値を保持した時点のメモリと、実行中のピークのメモリをMBで返す。
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / 1024**2, peak / 1024**2, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-r", "--row_counts", type=int, nargs="+", default=[10000, 100000]
+    )
+    args = parser.parse_args()
+
+    print(
+        "rows\tlist_mb\tlist_dataframe_peak_mb\ttable_mb\ttable_dataframe_peak_mb"
+        "\tsame_output"
+    )
+    for row_count in args.row_counts:
+        # ループの変数はデフォルト引数で渡す
+        list_mb, _, rows = measure(
+            lambda row_count=row_count: list(make_rows(row_count))
+        )
+        _, list_dataframe_peak_mb, list_df = measure(
+            lambda rows=rows: pd.DataFrame(rows)
+        )
+        list_dataframe_peak_mb += list_mb
+        del rows
+
+        table_mb, table_peak_mb, table = measure(
+            lambda row_count=row_count: AlignedMoraTable.from_rows(make_rows(row_count))
+        )
+        _, table_dataframe_peak_mb, table_df = measure(
+            lambda table=table: table.to_pandas()
+        )
+        table_dataframe_peak_mb = max(table_peak_mb, table_mb + table_dataframe_peak_mb)
+        same_output = list_df.astype(str).equals(table_df.astype(str))
+        del table, list_df, table_df
+
+        print(
+            f"{row_count}\t{list_mb:.1f}\t{list_dataframe_peak_mb:.1f}\t"
+            f"{table_mb:.1f}\t{table_dataframe_peak_mb:.1f}\t{same_output}"
+        )
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
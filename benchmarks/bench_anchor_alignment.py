@@ -0,0 +1,83 @@
+"""
+似た行どうしのアラインメントで、アンカーを使う場合と使わない場合の処理時間と状態数を比較する。
+
+参照側は入力側の一部のモウラを置き換えた系列とし、替え歌と元歌詞のように長い一致区間を持たせる。
+
+    python benchmarks/bench_anchor_alignment.py -l 50 100 200 400 800 -a 4
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from soramimi_align.align_mora import (
+    eval_vowel_consonant_distance,
+    eval_vowel_consonant_prefix_distances,
+    find_correspondance,
+)
+
+MORAS = list("アイウエオカキクケコサシスセソタチツテトナニヌネノマミムメモラリルレロン")
+
+
+def make_line_pair(
+    rng: random.Random, length: int, mutation_rate: float
+) -> tuple[list[str], list[list[str]]]:
+    input_moras = [rng.choice(MORAS) for _ in range(length)]
+    reference_moras = [
+        rng.choice(MORAS) if rng.random() < mutation_rate else mora
+        for mora in input_moras
+    ]
+    return reference_moras, [[mora] for mora in input_moras]
+
+
+def measure(reference, segments, anchor_min_length: int) -> tuple[float, int, list]:
+    stats = {}
+    start = time.perf_counter()
+    _, correspondance = find_correspondance(
+        reference,
+        segments,
+        eval_vowel_consonant_distance,
+        eval_vowel_consonant_prefix_distances,
+        stats=stats,
+        anchor_min_length=anchor_min_length,
+    )
+    return time.perf_counter() - start, stats["explored_states"], correspondance
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-l", "--lengths", type=int, nargs="+", default=[50, 100, 200, 400]
+    )
+    parser.add_argument("-a", "--anchor_min_length", type=int, default=4)
+    parser.add_argument("-m", "--mutation_rate", type=float, default=0.1)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument(
+        "--skip_full", action="store_true", help="アンカーなしの計測を省略するフラグ"
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print("length\tfull_sec\tfull_states\tanchor_sec\tanchor_states\tsame_spans")
+    for length in args.lengths:
+        reference, segments = make_line_pair(rng, length, args.mutation_rate)
+        anchor_sec, anchor_states, anchor_correspondance = measure(
+            reference, segments, args.anchor_min_length
+        )
+        if args.skip_full:
+            full_sec, full_states, same_spans = float("nan"), 0, float("nan")
+        else:
+            full_sec, full_states, full_correspondance = measure(reference, segments, 0)
+            same_spans = sum(
+                a == b for a, b in zip(full_correspondance, anchor_correspondance)
+            ) / max(len(segments), 1)
+        print(
+            f"{length}\t{full_sec:.4f}\t{full_states}\t"
+            f"{anchor_sec:.4f}\t{anchor_states}\t{same_spans:.3f}"
+        )
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+選手の表からAthleteNameDetectorの辞書と部分一致の検索のインデックスを作る時間を、3つの方法で比べる。
+
+- iterrows: 以前の実装。1行ずつAthleteTableItemを作ってから辞書を作る
+- csv: 列ごとに読み込んで辞書を作る
+- index: 選手の表の横に保存したインデックスを読み込む
+
+乱数で作った選手の表を使い、表の行数を変えて測る。集合の列挙の順も含めて同じ結果になることも確かめる。
+
+    python benchmarks/bench_athlete_table.py -r 10000 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from soramimi_align.athlete_table import (
+    SubstringIndex,
+    get_athlete_table_index_path,
+    load_athlete_table,
+)
+from soramimi_align.schemas import AthleteTableItem
+
+FAMILY_NAME_CHARS = "佐藤鈴木高橋田中伊渡辺山本中村小林加吉松井清水森池谷岡野"
+GIVEN_NAME_CHARS = "翔平一郎太健介大輝直人勇気拓也和真悠斗浩二三"
+KATAKANA_CHARS = "アイウエオカキクケコサシスセソタチツテトナニヌネノ"
+
+
+def make_athlete_table(row_count: int, rng: random.Random) -> pd.DataFrame:
+    rows = []
+    athlete_id = 0
+    while len(rows) < row_count:
+        family_name = "".join(rng.choices(FAMILY_NAME_CHARS, k=rng.randint(1, 3)))
+        given_name = "".join(rng.choices(GIVEN_NAME_CHARS, k=rng.randint(1, 3)))
+        original = family_name + given_name
+        for surface in [original, family_name, given_name]:
+            pronunciation = "".join(rng.choices(KATAKANA_CHARS, k=rng.randint(2, 6)))
+            rows.append(
+                {
+                    "id": athlete_id,
+                    "original": original,
+                    "surface": surface,
+                    "pronunciation": pronunciation,
+                }
+            )
+        athlete_id += 1
+    return pd.DataFrame(rows[:row_count])
+
+
+def load_by_iterrows(athlete_table_path: str) -> tuple[dict, dict, SubstringIndex]:
+    # 以前の実装
+    athlete_table_df = pd.read_csv(athlete_table_path)
+    athlete_table_items = []
+    for index, row in athlete_table_df.iterrows():
+        pronunciation = "".join(row["pronunciation"].split()).replace("・", "")
+        athlete_table_items.append(
+            AthleteTableItem(
+                id=row["id"],
+                original=row["original"],
+                surface=row["surface"],
+                pronunciation=pronunciation,
+            )
+        )
+    surface_to_id_dict = {}
+    for item in athlete_table_items:
+        surface_to_id_dict.setdefault(item.original, set()).add(item.id)
+        surface_to_id_dict.setdefault(item.surface, set()).add(item.id)
+    id_to_pronunciation_dict = {}
+    for item in athlete_table_items:
+        id_to_pronunciation_dict.setdefault(item.id, {}).setdefault(
+            item.surface, set()
+        ).add(item.pronunciation)
+    return (
+        surface_to_id_dict,
+        id_to_pronunciation_dict,
+        SubstringIndex(surface_to_id_dict),
+    )
+
+
+def to_comparable(
+    surface_to_id_dict: dict, id_to_pronunciation_dict: dict, surface_index
+) -> tuple:
+    # 集合は列挙の順も比べる
+    return (
+        [(key, list(ids)) for key, ids in surface_to_id_dict.items()],
+        [
+            (id, [(surface, list(p)) for surface, p in surfaces.items()])
+            for id, surfaces in id_to_pronunciation_dict.items()
+        ],
+        surface_index.keys,
+        {gram: posting for gram, posting in surface_index._postings.items()},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-r", "--row_counts", type=int, nargs="+", default=[10000, 100000]
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print("rows\titerrows_sec\tcsv_sec\tindex_build_sec\tindex_sec\tsame_output")
+    for row_count in args.row_counts:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            athlete_table_path = os.path.join(tmp_dir, "athlete_table.csv")
+            make_athlete_table(row_count, rng).to_csv(athlete_table_path, index=False)
+
+            start = time.perf_counter()
+            iterrows_table = load_by_iterrows(athlete_table_path)
+            iterrows_sec = time.perf_counter() - start
+
+            start = time.perf_counter()
+            csv_table = load_athlete_table(athlete_table_path, use_index=False)
+            csv_sec = time.perf_counter() - start
+
+            # 1回目はCSVを読んでインデックスを書き込み、2回目はインデックスを読む
+            start = time.perf_counter()
+            load_athlete_table(athlete_table_path)
+            index_build_sec = time.perf_counter() - start
+            assert os.path.exists(get_athlete_table_index_path(athlete_table_path))
+            start = time.perf_counter()
+            index_table = load_athlete_table(athlete_table_path)
+            index_sec = time.perf_counter() - start
+
+        expected = to_comparable(*iterrows_table)
+        same_output = all(
+            to_comparable(
+                table.surface_to_id_dict,
+                table.id_to_pronunciation_dict,
+                table.surface_index,
+            )
+            == expected
+            for table in [csv_table, index_table]
+        )
+        print(
+            f"{row_count}\t{iterrows_sec:.3f}\t{csv_sec:.3f}\t{index_build_sec:.3f}\t"
+            f"{index_sec:.3f}\t{same_output}"
+        )
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
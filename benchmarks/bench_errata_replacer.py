@@ -0,0 +1,68 @@
+"""
+誤りを修正する辞書の項目数に対する置換の処理時間を、項目ごとにreplaceする以前の方法とErrataReplacerで比べる。
+
+乱数で作ったひらがなのキーと歌詞で測る。
+項目が多いとテキストの中でキーが重なり、以前の方法では項目の順によって結果が変わるので、
+same_outputは項目が多いとFalseになる。
+
+    python benchmarks/bench_errata_replacer.py -e 100 1000 10000
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from soramimi_align.make_draft import ErrataReplacer
+
+CHARS = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめも"
+
+
+def replace_by_loop(errata_dict: dict[str, str], text: str) -> str:
+    # 以前の実装
+    for k, v in errata_dict.items():
+        text = text.replace(k, v)
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-e", "--entry_counts", type=int, nargs="+", default=[100, 1000, 10000]
+    )
+    parser.add_argument("-l", "--text_length", type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    text = "".join(rng.choices(CHARS + "\n", k=args.text_length))
+
+    print("entries\tloop_sec\treplacer_build_sec\treplacer_sec\tsame_output")
+    for entry_count in args.entry_counts:
+        # 置換後の文字列がキーに一致しないように、値はひらがなを含めない
+        errata_dict = {}
+        while len(errata_dict) < entry_count:
+            key = "".join(rng.choices(CHARS, k=rng.randint(3, 6)))
+            errata_dict[key] = f"<{len(errata_dict)}>"
+
+        start = time.perf_counter()
+        loop_output = replace_by_loop(errata_dict, text)
+        loop_sec = time.perf_counter() - start
+
+        start = time.perf_counter()
+        errata_replacer = ErrataReplacer(errata_dict)
+        replacer_build_sec = time.perf_counter() - start
+
+        start = time.perf_counter()
+        replacer_output = errata_replacer.replace(text)
+        replacer_sec = time.perf_counter() - start
+
+        same_output = loop_output == replacer_output
+        print(
+            f"{entry_count}\t{loop_sec:.3f}\t{replacer_build_sec:.3f}\t"
+            f"{replacer_sec:.3f}\t{same_output}"
+        )
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
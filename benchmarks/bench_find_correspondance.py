@@ -0,0 +1,154 @@
+"""
+find_correspondanceの処理時間が行の長さに対してどう伸びるかを計測する。
+
+再帰版の実装(legacy)と現在の実装を同じ入力で比較し、結果が一致することも確認する。
+現在の実装はeval_funcだけを使う場合(dp)と、prefix_eval_funcで候補区間をまとめて評価する場合(dp_prefix)を計測する。
+
+    python benchmarks/bench_find_correspondance.py -l 10 20 40 80 160 320
+    python benchmarks/bench_find_correspondance.py -l 10 20 40 80 --words
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from soramimi_align.align_mora import (
+    eval_vowel_consonant_distance,
+    eval_vowel_consonant_prefix_distances,
+    find_correspondance,
+)
+
+MORAS = list(
+    "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン"
+) + [
+    "ー",
+    "ッ",
+    "シュ",
+    "リョ",
+]
+
+
+def legacy_find_correspondance(reference_text, input_segments, eval_func):
+    memo = {}
+
+    def inner_func(reference_text, input_segments):
+        memo_key = (str(reference_text), str(input_segments))
+        if memo_key in memo:
+            return memo[memo_key]
+
+        if reference_text and not input_segments:
+            dist = eval_func(reference_text, [])
+            memo[memo_key] = (dist, [])
+            return dist, []
+        elif not reference_text and input_segments:
+            flatten_input_segments = [x for row in input_segments for x in row]
+            dist = eval_func(reference_text, flatten_input_segments)
+            result = (dist, [(0, 0) for _ in range(len(input_segments))])
+            memo[memo_key] = result
+            return result
+        elif not reference_text and not input_segments:
+            return 0, []
+        elif reference_text and len(input_segments) == 1:
+            dist = eval_func(reference_text, input_segments[0])
+            memo[memo_key] = (dist, [(0, len(reference_text))])
+            return dist, [(0, len(reference_text))]
+
+        text = input_segments[0]
+        results = []
+        window_size = 5
+        for i in range(2 * window_size + 1):
+            diff = i - window_size
+            if len(text) + diff < 0:
+                continue
+            head_dist = eval_func(reference_text[0 : len(text) + diff], text)
+            tail_dist, tail_correspondance = inner_func(
+                reference_text[len(text) + diff :], input_segments[1:]
+            )
+            tail_correspondance = [
+                (s + len(text) + diff, e + len(text) + diff)
+                for s, e in tail_correspondance
+            ]
+            results.append(
+                (head_dist + tail_dist, [(0, len(text) + diff)] + tail_correspondance)
+            )
+
+        min_result = min(results, key=lambda x: x[0])
+        memo[memo_key] = min_result
+        return min_result
+
+    return inner_func(reference_text, input_segments)
+
+
+def make_line(rng: random.Random, length: int) -> list[str]:
+    return [rng.choice(MORAS) for _ in range(length)]
+
+
+def make_segments(rng: random.Random, length: int, words: bool) -> list[list[str]]:
+    moras = make_line(rng, length)
+    if not words:
+        return [[mora] for mora in moras]
+    # align_wordと同じように、1~4モウラの単語をセグメントとする
+    segments = []
+    while moras:
+        word_length = rng.randint(1, 4)
+        segments.append(moras[:word_length])
+        moras = moras[word_length:]
+    return segments
+
+
+def measure(func, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+    except RecursionError:
+        return float("nan"), None
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-l", "--lengths", type=int, nargs="+", default=[10, 20, 40, 80, 160]
+    )
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument(
+        "--skip_legacy", action="store_true", help="再帰版の計測を省略するフラグ"
+    )
+    parser.add_argument(
+        "--words", action="store_true", help="単語単位のセグメントで計測するフラグ"
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print("length\tlegacy_sec\tdp_sec\tdp_prefix_sec\tsame_output")
+    for length in args.lengths:
+        reference = make_line(rng, length)
+        segments = make_segments(rng, length, args.words)
+
+        dp_sec, dp = measure(
+            find_correspondance, reference, segments, eval_vowel_consonant_distance
+        )
+        dp_prefix_sec, dp_prefix = measure(
+            find_correspondance,
+            reference,
+            segments,
+            eval_vowel_consonant_distance,
+            eval_vowel_consonant_prefix_distances,
+        )
+        if args.skip_legacy:
+            legacy_sec, legacy = float("nan"), None
+        else:
+            legacy_sec, legacy = measure(
+                legacy_find_correspondance,
+                reference,
+                segments,
+                eval_vowel_consonant_distance,
+            )
+        same = dp == dp_prefix and (legacy is None or legacy == dp)
+        print(f"{length}\t{legacy_sec:.4f}\t{dp_sec:.4f}\t{dp_prefix_sec:.4f}\t{same}")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+AthleteNameDetector.get_ids_from_surfaceの部分一致の検索について、
+すべての表層を走査する以前の方法とSubstringIndexを使う方法の処理時間を比べる。
+
+乱数で作った選手の表を使い、表の行数を変えて測る。両方の方法で同じIDの集合が返ることも確かめる。
+
+    python benchmarks/bench_get_ids_from_surface.py -r 10000 50000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from soramimi_align.make_draft import AthleteNameDetector
+
+FAMILY_NAME_CHARS = "佐藤鈴木高橋田中伊渡辺山本中村小林加吉松井清水森池谷岡野"
+GIVEN_NAME_CHARS = "翔平一郎太健介大輝直人勇気拓也和真悠斗浩二三"
+
+
+def make_athlete_table(row_count: int, rng: random.Random) -> pd.DataFrame:
+    rows = []
+    for athlete_id in range(row_count):
+        family_name = "".join(rng.choices(FAMILY_NAME_CHARS, k=rng.randint(1, 3)))
+        given_name = "".join(rng.choices(GIVEN_NAME_CHARS, k=rng.randint(1, 3)))
+        original = family_name + given_name
+        for surface in [original, family_name, given_name]:
+            rows.append(
+                {
+                    "id": athlete_id,
+                    "original": original,
+                    "surface": surface,
+                    "pronunciation": "ア",
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+def get_ids_from_surface_by_scan(
+    detector: AthleteNameDetector, surface: str
+) -> set[int]:
+    # 以前の実装
+    ids = detector.surface_to_id_dict.get(surface, set())
+    if not ids:
+        for k, v in detector.surface_to_id_dict.items():
+            if surface in k:
+                ids.update(v)
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-r", "--row_counts", type=int, nargs="+", default=[10000, 50000]
+    )
+    parser.add_argument("-q", "--query_count", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print("rows\tqueries\tscan_sec\tindex_sec\tdetector_build_sec\tsame_output")
+    for row_count in args.row_counts:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            athlete_table_path = os.path.join(tmp_dir, "athlete_table.csv")
+            make_athlete_table(row_count, rng).to_csv(athlete_table_path, index=False)
+            start = time.perf_counter()
+            detector = AthleteNameDetector(athlete_table_path)
+            detector_build_sec = time.perf_counter() - start
+
+        # 完全一致しない部分文字列を検索する
+        surfaces = list(detector.surface_to_id_dict)
+        queries = []
+        while len(queries) < args.query_count:
+            surface = rng.choice(surfaces)
+            start = rng.randrange(len(surface))
+            query = surface[start : rng.randint(start + 1, len(surface))]
+            if query not in detector.surface_to_id_dict:
+                queries.append(query)
+
+        start = time.perf_counter()
+        scan_results = [
+            get_ids_from_surface_by_scan(detector, query) for query in queries
+        ]
+        scan_sec = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index_results = [detector.get_ids_from_surface(query) for query in queries]
+        index_sec = time.perf_counter() - start
+
+        same_output = scan_results == index_results and all(
+            list(scan_ids) == list(index_ids)
+            for scan_ids, index_ids in zip(scan_results, index_results)
+        )
+        print(
+            f"{row_count}\t{len(queries)}\t{scan_sec:.3f}\t{index_sec:.3f}\t"
+            f"{detector_build_sec:.3f}\t{same_output}"
+        )
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+ドラフトのコーパスをAnalyzedLyrics.from_textで読み込む時の処理時間とメモリ使用量を測る。
+
+サンプルのドラフトを複製して大きなドラフトに見立て、__slots__を使うAnalyzedWordItemと、
+memoの辞書を単語ごとに作るdataclassのAnalyzedWordItemで比較する。
+tracemallocで、読み込んだ結果を保持した時点のメモリを測る。
+
+    python benchmarks/bench_schemas.py -s 1000 10000
+"""
+
+import argparse
+import gc
+import re
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Any
+
+from soramimi_align import schemas
+from soramimi_align.schemas import AnalyzedLyrics
+
+SAMPLE_DRAFT = """
+宇佐美 小石博孝
+ウサミ コイシヒロタカ
+うさぎ 追い しか の 山
+ウサギ/p オイ/p シカ ノ ヤマ/p
+
+小塚 辻勇夫 河
+コヅカ ツジイサオ カワ
+コブナ 釣り しか の 川
+コブナ/p ツリ/p シカ ノ カワ/p
+
+シューメーカー 熊野輝光
+シューメーカー クマノヒロミツ
+夢 は 今 も めぐり て
+ユメ/p ワ イマ/p モ メグリ/p テ
+
+夏目隆司 古田 荘
+ナツメタカシ フルタ ソウ
+忘れ がたき ふるさと
+ワスレ/p ガタキ フルサト/p
+"""
+
+DICT_ITEM_WARNINGS: list[str] = []
+
+
+@dataclass
+class DictAnalyzedWordItem:
+    """
+    比較用の、__slots__を使わずmemoを単語ごとに作るAnalyzedWordItem。
+    """
+
+    surface: str
+    pronunciation: str
+    is_phrase_start: bool = False
+    memo: dict[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.pronunciation.count("/") > 1:
+            self.pronunciation = self.pronunciation.split("/")[0]
+        # 以前の実装と同じ検証をする。警告は表示せずにためておく
+        if not re.fullmatch(r"[ァ-ヶー]+", self.pronunciation):
+            DICT_ITEM_WARNINGS.append(f"発音にカタカナ以外の文字: {self.pronunciation}")
+        if len(self.surface) != len("".join(self.surface.split())):
+            DICT_ITEM_WARNINGS.append(f"surfaceにスペース: {self.surface}")
+
+    @classmethod
+    def trusted(cls, *args, **kwargs) -> "DictAnalyzedWordItem":
+        # 以前の実装と同じく、単語ごとに検証する
+        return cls(*args, **kwargs)
+
+
+def parse_corpus(text: str, song_count: int) -> list[AnalyzedLyrics]:
+    return [AnalyzedLyrics.from_text(text) for _ in range(song_count)]
+
+
+def measure(text: str, song_count: int) -> tuple[float, float, int]:
+    """
+    song_count曲分のドラフトを読み込む処理時間(秒)と、結果を保持した時点のメモリ(MB)、単語の数を返す。
+    """
+    gc.collect()
+    start = time.perf_counter()
+    parse_corpus(text, song_count)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    corpus = parse_corpus(text, song_count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    word_count = sum(
+        len(words) for lyrics in corpus for words in lyrics.parody + lyrics.original
+    )
+    return elapsed, current / 1024**2, word_count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-s", "--song_counts", type=int, nargs="+", default=[1000, 10000]
+    )
+    args = parser.parse_args()
+
+    print("songs\twords\tdict_sec\tdict_mb\tslots_sec\tslots_mb")
+    for song_count in args.song_counts:
+        analyzed_word_item = schemas.AnalyzedWordItem
+        schemas.AnalyzedWordItem = DictAnalyzedWordItem
+        try:
+            dict_sec, dict_mb, _ = measure(SAMPLE_DRAFT, song_count)
+        finally:
+            schemas.AnalyzedWordItem = analyzed_word_item
+        slots_sec, slots_mb, word_count = measure(SAMPLE_DRAFT, song_count)
+
+        print(
+            f"{song_count}\t{word_count}\t{dict_sec:.2f}\t{dict_mb:.1f}\t"
+            f"{slots_sec:.2f}\t{slots_mb:.1f}"
+        )
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+make_draftのTokenizerとAthleteNameDetectorを作るまでの時間と、プロセスの最大RSSを測る。
+
+以前のようにTokenizerとAthleteNameDetectorがそれぞれSudachiの辞書を読み込む場合(eager)と、
+辞書を共有して初めて使う時に読み込む場合を比べる。
+共有する場合は、辞書を使わない場合(lazy_unused)と、1行を解析して辞書を読み込んだ場合(lazy_used)を測る。
+計測はモードごとに別のプロセスで行う。
+
+    python benchmarks/bench_sudachi_dictionary.py -d full
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ["eager", "lazy_unused", "lazy_used"]
+
+ATHLETE_TABLE = """id,original,surface,pronunciation
+1,イチロー,イチロー,イチロー
+2,大谷翔平,大谷,オオタニ
+"""
+
+
+def max_rss_mb() -> float:
+    # Linuxではru_maxrssの単位はKB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(mode: str, dict_type: str, athlete_table_path: str) -> None:
+    from sudachipy import dictionary as sudachi_dictionary
+
+    from soramimi_align.make_draft import (
+        AthleteNameDetector,
+        SudachiTokenizerProvider,
+        Tokenizer,
+    )
+
+    start_rss_mb = max_rss_mb()
+    start = time.perf_counter()
+    if mode == "eager":
+        # 以前の実装と同じく、それぞれで辞書を読み込む
+        tokenizer_obj = sudachi_dictionary.Dictionary(dict=dict_type).create()
+        detector_tokenizer_obj = sudachi_dictionary.Dictionary(dict=dict_type).create()
+        tokenizer_obj.tokenize("風の中のすばる")
+        detector_tokenizer_obj.tokenize("大谷")
+    else:
+        sudachi_provider = SudachiTokenizerProvider(dict_type)
+        tokenizer = Tokenizer(sudachi_provider)
+        AthleteNameDetector(athlete_table_path, sudachi_provider)
+        if mode == "lazy_used":
+            tokenizer.parse("風の中のすばる")
+    elapsed = time.perf_counter() - start
+    print(f"{elapsed:.3f}\t{start_rss_mb:.1f}\t{max_rss_mb():.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--dict_type", type=str, default="full")
+    parser.add_argument("--mode", type=str, choices=MODES, default=None)
+    parser.add_argument("--athlete_table_path", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run_mode(args.mode, args.dict_type, args.athlete_table_path)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        athlete_table_path = os.path.join(tmp_dir, "athlete_table.csv")
+        with open(athlete_table_path, "w") as f:
+            f.write(ATHLETE_TABLE)
+
+        print("mode\tstartup_sec\tstart_rss_mb\tmax_rss_mb")
+        for mode in MODES:
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--mode",
+                    mode,
+                    "--dict_type",
+                    args.dict_type,
+                    "--athlete_table_path",
+                    athlete_table_path,
+                ],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            print(f"{mode}\t{output.strip().splitlines()[-1]}")
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
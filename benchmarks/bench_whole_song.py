@@ -0,0 +1,71 @@
+"""
+曲全体のアラインメントに使うfind_correspondance_linear_memoryの処理時間が、曲の長さとband_widthでどう変わるかを計測する。
+
+参照側は入力側の一部のモウラを置き換え、一部を削除した系列とし、替え歌と元歌詞のように対角線の近くに対応を持たせる。
+band_widthを0にすると帯で制限せずに解く。帯で制限しない場合のコスト(full_dist)と同じかどうかも確かめる。
+
+    python benchmarks/bench_whole_song.py -l 100 200 400 -b 0 30 100
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from soramimi_align.align_mora import (
+    eval_vowel_consonant_distance,
+    eval_vowel_consonant_prefix_distances,
+    find_correspondance,
+)
+
+MORAS = list(
+    "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン"
+)
+
+
+def make_song(rng: random.Random, length: int) -> tuple[list[str], list[list[str]]]:
+    reference = [rng.choice(MORAS) for _ in range(length)]
+    moras = [mora if rng.random() < 0.7 else rng.choice(MORAS) for mora in reference]
+    moras = [mora for mora in moras if rng.random() > 0.05]
+    return reference, [[mora] for mora in moras]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--lengths", type=int, nargs="+", default=[100, 200, 400])
+    parser.add_argument(
+        "-b", "--band_widths", type=int, nargs="+", default=[0, 30, 100]
+    )
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print("length\tband_width\tsec\texplored_states\tdist\tsame_dist")
+    for length in args.lengths:
+        reference, segments = make_song(rng, length)
+        full_dist = None
+        for band_width in args.band_widths:
+            stats = {}
+            start = time.perf_counter()
+            dist, _ = find_correspondance(
+                reference,
+                segments,
+                eval_vowel_consonant_distance,
+                eval_vowel_consonant_prefix_distances,
+                stats=stats,
+                linear_memory=True,
+                band_width=band_width if band_width > 0 else None,
+            )
+            elapsed = time.perf_counter() - start
+            if band_width <= 0:
+                full_dist = dist
+            same_dist = "" if full_dist is None else abs(dist - full_dist) < 1e-9
+            print(
+                f"{length}\t{band_width}\t{elapsed:.2f}\t{stats['explored_states']}\t"
+                f"{dist:.2f}\t{same_dist}"
+            )
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,43 @@
 # %%
+import bisect
+import concurrent.futures
+import contextlib
+import csv
+import difflib
+import functools
 import glob
+import heapq
+import itertools
 import os
-from typing import Callable, Tuple, TypeVar
+import warnings
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import fields
+from typing import Any, Tuple, TypeVar
 
 import editdistance as ed
 import jamorasep
-import pandas as pd
 
-from soramimi_align.schemas import AlignedMora, AnalyzedLyrics, AnalyzedWordItem
+from soramimi_align.aligned_mora_table import AlignedMoraTable, AlignedMoraTableBuilder
+from soramimi_align.cache import AlignmentCache
+from soramimi_align.draft_cache import iter_line_pairs_from_file
+from soramimi_align.mora_table import MORA_TABLE
+from soramimi_align.schemas import (
+    AlignedMora,
+    AnalyzedLyrics,
+    AnalyzedWordItem,
+    find_line_warnings,
+    format_warning_summary,
+)
 
 T = TypeVar("T")
 
 
 def split_consonant_vowel(mora: str) -> Tuple[str, str]:
-    if mora == "":
-        return "", ""
+    return MORA_TABLE.split_consonant_vowel(mora)
 
-    simpleipa = jamorasep.parse(mora, output_format="simple-ipa")[0]
-    consonant, vowel = "".join(simpleipa[:-1]), simpleipa[-1]
-    if consonant == "":
-        return "sp", vowel
-    else:
-        return consonant, vowel
+
+# コスト関数やアラインメントの出力を変えたら上げる。AlignmentCacheのキーに含める
+COST_FUNCTION_VERSION = 1
 
 
 def eval_vowel_consonant_distance(moras1: list[str], moras2: list[str]) -> float:
@@ -31,12 +47,12 @@ def eval_vowel_consonant_distance(moras1: list[str], moras2: list[str]) -> float
     # elif moras2 == [] and len(moras1) == 1 and moras1[0] in "ンーッ":
     #    return 0.5
 
-    vowels_consonants1 = [split_consonant_vowel(mora) for mora in moras1]
-    vowels_consonants2 = [split_consonant_vowel(mora) for mora in moras2]
-    vowels1 = [vowel for consonant, vowel in vowels_consonants1]
-    vowels2 = [vowel for consonant, vowel in vowels_consonants2]
-    consonants1 = [consonant for consonant, vowel in vowels_consonants1]
-    consonants2 = [consonant for consonant, vowel in vowels_consonants2]
+    mora_ids1 = MORA_TABLE.encode(moras1)
+    mora_ids2 = MORA_TABLE.encode(moras2)
+    vowels1 = [MORA_TABLE.vowels[mora_id] for mora_id in mora_ids1]
+    vowels2 = [MORA_TABLE.vowels[mora_id] for mora_id in mora_ids2]
+    consonants1 = [MORA_TABLE.consonants[mora_id] for mora_id in mora_ids1]
+    consonants2 = [MORA_TABLE.consonants[mora_id] for mora_id in mora_ids2]
 
     vowel_dist = ed.eval(vowels1, vowels2)
     consonant_dist = ed.eval(consonants1, consonants2)
@@ -44,11 +60,15 @@ def eval_vowel_consonant_distance(moras1: list[str], moras2: list[str]) -> float
     dist = vowel_dist * 2 + consonant_dist
 
     # 特殊モウラからの開始に対するペナルティ。「あーあ」と「あ」のような場合に、「あー」を「あ」に合わせるようにする。
-    if moras1 and moras2:
-        if moras1[0] not in "ンーッ" and moras2[0] and moras2[0] in "ンーッ":
-            dist += 0.01
-        elif moras1[0] and moras1[0] in "ンーッ" and moras2[0] not in "ンーッ":
-            dist += 0.01
+    # ID 0は空文字なので、どちらかの先頭が空文字の場合はペナルティをかけない。
+    if (
+        mora_ids1
+        and mora_ids2
+        and mora_ids1[0]
+        and mora_ids2[0]
+        and MORA_TABLE.is_specials[mora_ids1[0]] != MORA_TABLE.is_specials[mora_ids2[0]]
+    ):
+        dist += 0.01
     # 先頭の母音の一致を重視
     if len(vowels1) > 0 and len(vowels2) > 0:
         if vowels1[0] == vowels2[0]:
@@ -56,304 +76,1780 @@ def eval_vowel_consonant_distance(moras1: list[str], moras2: list[str]) -> float
     return dist
 
 
+def eval_vowel_consonant_prefix_distances(
+    reference_moras: list[str], start: int, moras: list[str], max_length: int
+) -> list[float]:
+    """
+    reference_moras[start:start + k]とmorasのeval_vowel_consonant_distanceを、
+    k = 0, ..., max_lengthについてまとめて求める。
+
+    参照側を1モウラずつ伸ばしながら編集距離の表を1行ずつ更新するので、
+    kごとにeval_vowel_consonant_distanceを呼ぶ場合と同じ値を1回の走査で得られる。
+    参照の末尾を越える長さは求めないので、返り値の長さはmax_length + 1より短くなることがある。
+    """
+    end = min(start + max_length, len(reference_moras))
+    reference_ids = MORA_TABLE.encode(reference_moras[start:end])
+    mora_ids = MORA_TABLE.encode(moras)
+    vowels = [MORA_TABLE.vowels[mora_id] for mora_id in mora_ids]
+    consonants = [MORA_TABLE.consonants[mora_id] for mora_id in mora_ids]
+    length = len(mora_ids)
+
+    vowel_row = list(range(length + 1))
+    consonant_row = list(range(length + 1))
+    distances: list[float] = [vowel_row[length] * 2 + consonant_row[length]]
+    for k, reference_id in enumerate(reference_ids, 1):
+        reference_vowel = MORA_TABLE.vowels[reference_id]
+        reference_consonant = MORA_TABLE.consonants[reference_id]
+        prev_vowel_row, prev_consonant_row = vowel_row, consonant_row
+        vowel_row = [k] * (length + 1)
+        consonant_row = [k] * (length + 1)
+        for i in range(1, length + 1):
+            vowel_row[i] = min(
+                prev_vowel_row[i] + 1,
+                vowel_row[i - 1] + 1,
+                prev_vowel_row[i - 1] + (reference_vowel != vowels[i - 1]),
+            )
+            consonant_row[i] = min(
+                prev_consonant_row[i] + 1,
+                consonant_row[i - 1] + 1,
+                prev_consonant_row[i - 1] + (reference_consonant != consonants[i - 1]),
+            )
+        distances.append(vowel_row[length] * 2 + consonant_row[length])
+
+    # 先頭のモウラに対する補正はeval_vowel_consonant_distanceと同じ順で加える
+    if reference_ids and mora_ids:
+        first_reference_id, first_mora_id = reference_ids[0], mora_ids[0]
+        is_special_mismatch = (
+            first_reference_id
+            and first_mora_id
+            and MORA_TABLE.is_specials[first_reference_id]
+            != MORA_TABLE.is_specials[first_mora_id]
+        )
+        is_first_vowel_match = MORA_TABLE.vowels[first_reference_id] == vowels[0]
+        for k in range(1, len(distances)):
+            if is_special_mismatch:
+                distances[k] += 0.01
+            if is_first_vowel_match:
+                distances[k] -= 0.01
+    return distances
+
+
+def vowel_consonant_distance_lower_bound(
+    reference_length: int, input_length: int, segment_count: int
+) -> float:
+    """
+    長さの合計がreference_lengthとinput_lengthであるsegment_count組の区間について、
+    eval_vowel_consonant_distanceの合計の下界を返す。
+
+    母音・子音の編集距離はそれぞれ長さの差以上であり、補正で下がるのは先頭の母音の一致による0.01だけである。
+    """
+    return 3 * abs(reference_length - input_length) - 0.01 * segment_count
+
+
+def find_anchors(
+    reference_text: list[T], input_segments: list[list[T]], min_length: int
+) -> list[tuple[int, int, int]]:
+    """
+    reference_textとinput_segmentsを連結した系列とで完全に一致する区間のうち、
+    セグメントの境界に揃っていて長さがmin_length以上のものをアンカーとして返す。
+
+    returns:
+        list[tuple[int, int, int]]: (先頭のセグメントのindex, 末尾の次のセグメントのindex, reference_textでの開始位置)
+    """
+    m = len(input_segments)
+    segment_offsets = [0]
+    for segment in input_segments:
+        segment_offsets.append(segment_offsets[-1] + len(segment))
+    flatten_input_segments = [x for row in input_segments for x in row]
+
+    matcher = difflib.SequenceMatcher(
+        None, reference_text, flatten_input_segments, autojunk=False
+    )
+    anchors = []
+    for reference_start, input_start, size in matcher.get_matching_blocks():
+        # 一致区間に完全に含まれるセグメントだけをアンカーにする
+        j_start = bisect.bisect_left(segment_offsets, input_start, hi=m)
+        j_end = j_start
+        while j_end < m and segment_offsets[j_end + 1] <= input_start + size:
+            j_end += 1
+        anchored_length = segment_offsets[j_end] - segment_offsets[j_start]
+        if j_end > j_start and anchored_length >= min_length:
+            anchors.append(
+                (
+                    j_start,
+                    j_end,
+                    reference_start + segment_offsets[j_start] - input_start,
+                )
+            )
+    return anchors
+
+
 def find_correspondance(
     reference_text: list[T],
     input_segments: list[list[T]],
     eval_func: Callable[[list[T], list[T]], float],
-):
-    memo = {}
-
-    def inner_func(reference_text, input_segments):
-        nonlocal memo
-
-        memo_key = (str(reference_text), str(input_segments))
-        if memo_key in memo:
-            return memo[memo_key]
-
-        if reference_text and not input_segments:
-            dist = eval_func(reference_text, [])
-            memo[memo_key] = (dist, [])
-            return dist, []
-        elif not reference_text and input_segments:
-            flatten_input_segments = [x for row in input_segments for x in row]
-            dist = eval_func(reference_text, flatten_input_segments)
-            result = (
-                dist,
-                [(0, 0) for _ in range(len(input_segments))],
+    prefix_eval_func: Callable[[list[T], int, list[T], int], list[float]] | None = None,
+    window_size: int = 5,
+    lower_bound_func: Callable[[int, int, int], float] | None = None,
+    stats: dict[str, Any] | None = None,
+    anchor_min_length: int = 0,
+    linear_memory: bool = False,
+    band_width: int | None = None,
+) -> tuple[float, list[tuple[int, int]]]:
+    """
+    input_segmentsの各セグメントに対応するreference_textの区間を求める。
+
+    状態を(セグメントのindex, reference_textのoffset)とした動的計画法を、
+    再帰を使わずに末尾の状態から順に解く。各セグメントには自身の長さ±window_sizeの区間を割り当て、
+    eval_funcの合計が最小となる対応を返す。
+
+    args:
+        reference_text (list[T]): 参照側の系列
+        input_segments (list[list[T]]): 入力側のセグメントの列
+        eval_func (Callable[[list[T], list[T]], float]): 参照区間とセグメントの距離関数
+        prefix_eval_func (Callable[[list[T], int, list[T], int], list[float]] | None):
+            (reference_text, start, segment, max_length)を受け取り、
+            reference_text[start:start + k]とsegmentのeval_funcの値をk = 0, ..., max_lengthについて返す関数。
+            指定すると、各状態で候補の区間の距離を1回の呼び出しでまとめて求める。
+        window_size (int): 各セグメントに割り当てる区間の長さの、セグメントの長さからの最大のずれ
+        lower_bound_func (Callable[[int, int, int], float] | None):
+            (参照側の長さの合計, 入力側の長さの合計, 区間の組の数)から、eval_funcの合計の下界を返す関数。
+            指定すると、先頭からの下界と末尾までの下界の和が、
+            各セグメントに同じ長さの区間を割り当てた場合のコストを超える状態を探索しない。
+        stats (dict[str, Any] | None): 指定すると、探索した状態数を"explored_states"に書き込む
+        anchor_min_length (int):
+            1以上なら、長さがこの値以上の完全一致区間をアンカーとして対応を固定し、
+            アンカーの間だけを動的計画法で解く。長い行でも状態数がほぼ線形に収まる。
+        linear_memory (bool):
+            Trueならfind_correspondance_linear_memoryで解き、メモリを参照の長さに比例する量に抑える。
+            この場合lower_bound_funcは使わない。
+        band_width (int | None):
+            linear_memoryの場合に、各セグメントでのoffsetを対角線からband_width以内に制限する。
+            Noneなら制限しない。
+
+    returns:
+        tuple[float, list[tuple[int, int]]]: 距離の合計と、各セグメントに対応するreference_textの(start, end)
+    """
+    if anchor_min_length > 0:
+        return find_correspondance_between_anchors(
+            reference_text,
+            input_segments,
+            eval_func,
+            prefix_eval_func,
+            window_size,
+            lower_bound_func,
+            stats,
+            anchor_min_length,
+            linear_memory,
+            band_width,
+        )
+    if linear_memory:
+        return find_correspondance_linear_memory(
+            reference_text,
+            input_segments,
+            eval_func,
+            prefix_eval_func,
+            window_size,
+            stats,
+            band_width,
+        )
+
+    return find_n_best_correspondances(
+        reference_text,
+        input_segments,
+        eval_func,
+        prefix_eval_func,
+        1,
+        window_size,
+        lower_bound_func,
+        stats,
+    )[0]
+
+
+def find_n_best_correspondances(
+    reference_text: list[T],
+    input_segments: list[list[T]],
+    eval_func: Callable[[list[T], list[T]], float],
+    prefix_eval_func: Callable[[list[T], int, list[T], int], list[float]] | None = None,
+    n_best: int = 1,
+    window_size: int = 5,
+    lower_bound_func: Callable[[int, int, int], float] | None = None,
+    stats: dict[str, Any] | None = None,
+) -> list[tuple[float, list[tuple[int, int]]]]:
+    """
+    find_correspondanceの動的計画法で、コストの小さい順に上位n_best個の対応を求める。
+
+    各状態でコストの小さい順にn_best個の(コスト, 区間の長さ, 次の状態での順位)を保持するので、
+    動的計画法を1回解くだけで上位の対応がすべて得られる。
+    1位の対応はfind_correspondanceの結果と一致する。
+    参照の末尾を越える区間は、末尾を越えない最短のものだけを候補にするので、同じ対応が重複することはない。
+    lower_bound_funcによる枝刈りは1位の対応だけを保証するので、n_bestが2以上の場合は使わない。
+    その他の引数はfind_correspondanceと同じ。
+
+    returns:
+        list[tuple[float, list[tuple[int, int]]]]: コストの小さい順に並べた(距離の合計, 対応)
+    """
+    if n_best > 1:
+        lower_bound_func = None
+
+    n = len(reference_text)
+    m = len(input_segments)
+    segment_lengths = [len(segment) for segment in input_segments]
+    # セグメントの長さの累積和
+    segment_offsets = [0]
+    for length in segment_lengths:
+        segment_offsets.append(segment_offsets[-1] + length)
+
+    def is_terminal(j: int, p: int) -> bool:
+        return p >= n or j >= m - 1
+
+    def spans(j: int) -> range:
+        return range(
+            max(segment_lengths[j] - window_size, 0),
+            segment_lengths[j] + window_size + 1,
+        )
+
+    def terminal_cost(j: int, p: int) -> float:
+        if p < n and j == m:
+            return eval_func(reference_text[p:], [])
+        elif p >= n and j < m:
+            flatten_input_segments = [x for row in input_segments[j:] for x in row]
+            return eval_func(reference_text[p:], flatten_input_segments)
+        elif p >= n and j >= m:
+            return 0
+        else:
+            return eval_func(reference_text[p:], input_segments[j])
+
+    is_pruned = None
+    if lower_bound_func is not None:
+        # 各セグメントに同じ長さの区間を割り当てた場合のコストを上界とする
+        upper_bound = 0.0
+        j, p = 0, 0
+        while not is_terminal(j, p):
+            upper_bound += eval_func(
+                reference_text[p : p + segment_lengths[j]], input_segments[j]
             )
-            memo[memo_key] = result
-            return result
-        elif not reference_text and not input_segments:
-            return 0, []
-        elif reference_text and len(input_segments) == 1:
-            # dist = ed.eval(reference_text, input_segments[0])
-            dist = eval_func(reference_text, input_segments[0])
-            memo[memo_key] = (dist, [(0, len(reference_text))])
-            return dist, [(0, len(reference_text))]
-
-        flatten_input_segments = tuple(x for row in input_segments for x in row)
-        if reference_text == flatten_input_segments:
-            correspondance = []
-            cnt = 0
-            for seg in input_segments:
-                correspondance.append((cnt, cnt + len(seg)))
-                cnt += len(seg)
-            memo[memo_key] = (0, correspondance)
-            return 0, correspondance
-
-        text = input_segments[0]
-        results = []
-        window_size = 5
-        for i in range(2 * window_size + 1):
-            diff = i - window_size
-            if len(text) + diff < 0:
+            p = min(p + segment_lengths[j], n)
+            j += 1
+        upper_bound += terminal_cost(j, p) + 1e-9
+
+        def is_pruned(j: int, p: int) -> bool:
+            head_lower_bound = lower_bound_func(p, segment_offsets[j], j)
+            tail_lower_bound = lower_bound_func(
+                n - p, segment_offsets[m] - segment_offsets[j], m - j + 1
+            )
+            return head_lower_bound + tail_lower_bound > upper_bound
+
+    # 開始状態から到達可能なoffsetを前向きに列挙する
+    reachable: list[list[int]] = [[] for _ in range(m + 1)]
+    reachable[0] = [0]
+    for j in range(m):
+        next_offsets = set()
+        for p in reachable[j]:
+            if is_terminal(j, p):
+                continue
+            for k in spans(j):
+                next_offsets.add(min(p + k, n))
+        if is_pruned is not None:
+            next_offsets = {p for p in next_offsets if not is_pruned(j + 1, p)}
+        reachable[j + 1] = sorted(next_offsets)
+
+    # 末尾の状態から順に、コストの小さい順にn_best個の(コスト, 区間の長さ, 次の状態での順位)を求める
+    costs: list[dict[int, list[tuple[float, int, int]]]] = [{} for _ in range(m + 1)]
+    for j in range(m, -1, -1):
+        for p in reachable[j]:
+            if is_terminal(j, p):
+                costs[j][p] = [(terminal_cost(j, p), 0, 0)]
                 continue
-            head_dist = eval_func(reference_text[0 : len(text) + diff], text)
-            head_correspondance = [(0, len(text) + diff)]
-            tail_dist, tail_correspondance = inner_func(
-                reference_text[len(text) + diff :], input_segments[1:]
+
+            if prefix_eval_func is not None:
+                prefix_costs = prefix_eval_func(
+                    reference_text, p, input_segments[j], spans(j)[-1]
+                )
+            candidates = []
+            for k in spans(j):
+                if k > max(n - p, spans(j)[0]):
+                    # 参照の末尾を越える区間は、末尾を越えない最短のものと同じ対応になる
+                    break
+                tails = costs[j + 1].get(min(p + k, n))
+                if tails is None:
+                    # 枝刈りされた状態
+                    continue
+                if prefix_eval_func is not None:
+                    head_cost = prefix_costs[min(k, n - p)]
+                else:
+                    head_cost = eval_func(reference_text[p : p + k], input_segments[j])
+                for rank, (tail_cost, _, _) in enumerate(tails):
+                    candidates.append((head_cost + tail_cost, k, rank))
+            if candidates:
+                # 同じコストの候補は区間の短い順に並ぶ
+                costs[j][p] = heapq.nsmallest(
+                    n_best, candidates, key=lambda candidate: candidate[0]
+                )
+
+    if stats is not None:
+        stats["explored_states"] = sum(len(offsets) for offsets in reachable)
+
+    # 先頭から各順位の区間を復元する。参照の末尾を越えた区間はそのままの位置で残す
+    results = []
+    for top_rank, (dist, _, _) in enumerate(costs[0][0]):
+        correspondance = []
+        j, p, position, rank = 0, 0, 0, top_rank
+        while j < m:
+            if p >= n:
+                correspondance.append((position, position))
+                j += 1
+            elif j == m - 1:
+                correspondance.append((position, position + n - p))
+                j += 1
+            else:
+                _, k, rank = costs[j][p][rank]
+                correspondance.append((position, position + k))
+                position += k
+                p = min(p + k, n)
+                j += 1
+        results.append((dist, correspondance))
+    return results
+
+
+def find_correspondance_between_anchors(
+    reference_text: list[T],
+    input_segments: list[list[T]],
+    eval_func: Callable[[list[T], list[T]], float],
+    prefix_eval_func: Callable[[list[T], int, list[T], int], list[float]] | None = None,
+    window_size: int = 5,
+    lower_bound_func: Callable[[int, int, int], float] | None = None,
+    stats: dict[str, Any] | None = None,
+    anchor_min_length: int = 4,
+    linear_memory: bool = False,
+    band_width: int | None = None,
+) -> tuple[float, list[tuple[int, int]]]:
+    """
+    find_anchorsで見つけたアンカーの対応を固定し、アンカーの間の区間ごとにfind_correspondanceを解く。
+    引数と返り値はfind_correspondanceと同じ。
+
+    セグメントのない区間(先頭のアンカーの前、末尾のアンカーの後ろ、隣り合うアンカーの間)の参照は、
+    直前のアンカーのセグメント(先頭なら直後のアンカーのセグメント)の区間に含める。
+    """
+    n = len(reference_text)
+    m = len(input_segments)
+    anchors = find_anchors(reference_text, input_segments, anchor_min_length)
+
+    total_dist = 0
+    correspondance = []
+    explored_states = 0
+    j, p = 0, 0
+    # 直前のアンカーのセグメントの距離。セグメントのない区間を含める時に距離を計算し直す
+    last_anchor_dist = 0
+    # 先頭のアンカーの前のセグメントのない区間の開始位置
+    leading_gap_start = None
+    # 末尾のアンカーの後ろの区間も同じように解くために、長さ0のアンカーを番兵として加える
+    for j_start, j_end, reference_start in anchors + [(m, m, n)]:
+        if j_start == j and reference_start > p and m > 0:
+            # セグメントのない区間の参照が失われないように、隣のアンカーのセグメントの区間に含める
+            if correspondance:
+                segment_start, _ = correspondance[-1]
+                total_dist -= last_anchor_dist
+                last_anchor_dist = eval_func(
+                    reference_text[segment_start:reference_start],
+                    input_segments[j - 1],
+                )
+                total_dist += last_anchor_dist
+                correspondance[-1] = (segment_start, reference_start)
+            else:
+                leading_gap_start = p
+            p = reference_start
+        gap_stats = {}
+        gap_dist, gap_correspondance = find_correspondance(
+            reference_text[p:reference_start],
+            input_segments[j:j_start],
+            eval_func,
+            prefix_eval_func,
+            window_size,
+            lower_bound_func,
+            gap_stats,
+            linear_memory=linear_memory,
+            band_width=band_width,
+        )
+        total_dist += gap_dist
+        explored_states += gap_stats["explored_states"]
+        # 区間の末尾を越えた位置は、次のアンカーと重ならないように区間の末尾に揃える
+        gap_length = reference_start - p
+        correspondance += [
+            (p + min(start, gap_length), p + min(end, gap_length))
+            for start, end in gap_correspondance
+        ]
+
+        start = reference_start
+        for segment in input_segments[j_start:j_end]:
+            end = start + len(segment)
+            if leading_gap_start is not None:
+                start, leading_gap_start = leading_gap_start, None
+            last_anchor_dist = eval_func(reference_text[start:end], segment)
+            total_dist += last_anchor_dist
+            correspondance.append((start, end))
+            start = end
+        j, p = j_end, start
+
+    if stats is not None:
+        stats["explored_states"] = explored_states
+    return total_dist, correspondance
+
+
+def find_correspondance_linear_memory(
+    reference_text: list[T],
+    input_segments: list[list[T]],
+    eval_func: Callable[[list[T], list[T]], float],
+    prefix_eval_func: Callable[[list[T], int, list[T], int], list[float]] | None = None,
+    window_size: int = 5,
+    stats: dict[str, Any] | None = None,
+    band_width: int | None = None,
+) -> tuple[float, list[tuple[int, int]]]:
+    """
+    find_correspondanceと同じ問題を、状態数に比例するメモリを使わずに解く。
+
+    先頭からの最小コストをセグメント1つ分ずつ更新して最適な終端の状態を求め、
+    経路はHirschbergの方法と同様に中央のセグメントでの通過位置を求めて分割しながら復元する。
+    保持するのは常に1セグメント分の状態だけなので、曲全体のような長い系列でもメモリは参照の長さに比例する。
+    最小コストはfind_correspondanceと一致するが、同じコストの対応が複数ある場合は異なる対応を返すことがある。
+
+    処理時間はband_widthを指定しなければ参照の長さとセグメントの数の積に比例し、数百モウラで数秒から数十秒かかる。
+    band_widthを指定すると、セグメントjでのoffsetを(0, 0)と(セグメントの数, 参照の長さ)を結ぶ対角線から
+    band_width以内に制限する。状態の数がセグメントの数とband_widthの積に比例するので、
+    経路は分割せずに各状態の直前のoffsetから復元し、処理時間もセグメントの数とband_widthの積に比例する。
+    対角線から離れた対応は求められないので、帯の中に終端に至る経路がなければ制限せずに解き直す。
+    その他の引数と返り値はfind_correspondanceと同じ。
+    """
+    n = len(reference_text)
+    m = len(input_segments)
+    segment_lengths = [len(segment) for segment in input_segments]
+    explored_states = 0
+
+    segment_offsets = [0]
+    for length in segment_lengths:
+        segment_offsets.append(segment_offsets[-1] + length)
+
+    def in_band(j: int, p: int) -> bool:
+        if band_width is None:
+            return True
+        center = segment_offsets[j] * n / max(segment_offsets[m], 1)
+        return abs(p - center) <= band_width
+
+    def is_terminal(j: int, p: int) -> bool:
+        return p >= n or j >= m - 1
+
+    def spans(j: int) -> range:
+        return range(
+            max(segment_lengths[j] - window_size, 0),
+            segment_lengths[j] + window_size + 1,
+        )
+
+    def terminal_cost(j: int, p: int) -> float:
+        if p < n and j == m:
+            return eval_func(reference_text[p:], [])
+        elif p >= n and j < m:
+            flatten_input_segments = [x for row in input_segments[j:] for x in row]
+            return eval_func(reference_text[p:], flatten_input_segments)
+        elif p >= n and j >= m:
+            return 0
+        else:
+            return eval_func(reference_text[p:], input_segments[j])
+
+    def head_costs(j: int, p: int) -> list[tuple[int, float]]:
+        nonlocal explored_states
+        explored_states += 1
+        if prefix_eval_func is not None:
+            prefix_costs = prefix_eval_func(
+                reference_text, p, input_segments[j], spans(j)[-1]
             )
-            tail_correspondance = [
-                (s + len(text) + diff, e + len(text) + diff)
-                for s, e in tail_correspondance
-            ]
+            return [(k, prefix_costs[min(k, n - p)]) for k in spans(j)]
+        return [
+            (k, eval_func(reference_text[p : p + k], input_segments[j]))
+            for k in spans(j)
+        ]
 
-            dist = head_dist + tail_dist
-            correspondance = head_correspondance + tail_correspondance
-            results.append((dist, correspondance))
+    def forward(j0: int, p0: int, j1: int) -> dict[int, float]:
+        """(j0, p0)から終端でない状態だけを通ってセグメントj1に至る最小コスト"""
+        layer = {p0: 0.0}
+        for j in range(j0, j1):
+            next_layer: dict[int, float] = {}
+            for p, cost in layer.items():
+                if is_terminal(j, p):
+                    continue
+                for k, head_cost in head_costs(j, p):
+                    q = min(p + k, n)
+                    if not in_band(j + 1, q):
+                        continue
+                    if q not in next_layer or cost + head_cost < next_layer[q]:
+                        next_layer[q] = cost + head_cost
+            layer = next_layer
+        return layer
 
-        min_result = min(results, key=lambda x: x[0])
-        memo[memo_key] = min_result
-        return min_result
+    def backward(j0: int, p0: int, j1: int, p1: int, jm: int) -> dict[int, float]:
+        """セグメントjmの各状態から、終端でない状態だけを通って(j1, p1)に至る最小コスト"""
+        # (j0, p0)から到達しうるoffsetの範囲
+        lows, highs = [p0], [p0]
+        for j in range(j0, j1):
+            lows.append(lows[-1] + spans(j)[0])
+            highs.append(min(highs[-1] + spans(j)[-1], n))
+        layer = {p1: 0.0}
+        for j in range(j1 - 1, jm - 1, -1):
+            prev_layer: dict[int, float] = {}
+            for p in range(lows[j - j0], min(highs[j - j0], n - 1) + 1):
+                if is_terminal(j, p) or not in_band(j, p):
+                    continue
+                best_cost = None
+                for k, head_cost in head_costs(j, p):
+                    tail_cost = layer.get(min(p + k, n))
+                    if tail_cost is None:
+                        continue
+                    if best_cost is None or head_cost + tail_cost < best_cost:
+                        best_cost = head_cost + tail_cost
+                if best_cost is not None:
+                    prev_layer[p] = best_cost
+            layer = prev_layer
+        return layer
 
-    # if isinstance(reference_text, str):
-    #    reference_text = tuple(reference_text)
-    return inner_func(reference_text, input_segments)
+    def trace(j0: int, p0: int, j1: int, p1: int) -> list[int]:
+        """(j0, p0)から(j1, p1)までの最小コストの経路で、各セグメントに割り当てる区間の長さ"""
+        if j1 == j0:
+            return []
+        if j1 == j0 + 1:
+            if p1 < n:
+                return [p1 - p0]
+            # 参照の末尾に達する区間は、末尾を越えない最短のものにそろえる
+            return [max(n - p0, spans(j0)[0])]
+        jm = (j0 + j1) // 2
+        forward_layer = forward(j0, p0, jm)
+        backward_layer = backward(j0, p0, j1, p1, jm)
+        pm = min(
+            (p for p in forward_layer if p in backward_layer),
+            key=lambda p: (forward_layer[p] + backward_layer[p], p),
+        )
+        return trace(j0, p0, jm, pm) + trace(jm, pm, j1, p1)
 
+    # 先頭から1セグメントずつ進めて、終端の状態までのコストが最小になるものを求める
+    # 帯で制限する場合は、状態の数がセグメントの数に比例するので、各状態の直前のoffsetを保持して経路を復元する
+    previous_offsets: list[dict[int, int]] | None = (
+        [] if band_width is not None else None
+    )
+    best_dist, best_state = None, (0, 0)
+    layer = {0: 0.0}
+    for j in range(m + 1):
+        next_layer: dict[int, float] = {}
+        next_previous_offsets: dict[int, int] = {}
+        for p, cost in sorted(layer.items()):
+            if is_terminal(j, p):
+                dist = cost + terminal_cost(j, p)
+                if best_dist is None or dist < best_dist:
+                    best_dist, best_state = dist, (j, p)
+                continue
+            for k, head_cost in head_costs(j, p):
+                q = min(p + k, n)
+                if not in_band(j + 1, q):
+                    continue
+                if q not in next_layer or cost + head_cost < next_layer[q]:
+                    next_layer[q] = cost + head_cost
+                    next_previous_offsets[q] = p
+        layer = next_layer
+        if previous_offsets is not None:
+            previous_offsets.append(next_previous_offsets)
+    if best_dist is None:
+        # 帯の中に終端に至る経路がない
+        return find_correspondance_linear_memory(
+            reference_text,
+            input_segments,
+            eval_func,
+            prefix_eval_func,
+            window_size,
+            stats,
+        )
 
-def align_original_to_parody(
-    parody_line: list[AnalyzedWordItem], original_line: list[AnalyzedWordItem]
-) -> list[AlignedMora]:
-    parody_moras = []
-    is_parody_word_starts = []
-    is_parody_word_ends = []
-    parody_word_surfaces = []
-    for word in parody_line:
-        moras = jamorasep.parse(word.pronunciation)
-        parody_moras += moras
-        is_parody_word_starts += [True] + [False] * (len(moras) - 1)
-        is_parody_word_ends += [False] * (len(moras) - 1) + [True]
-        parody_word_surfaces += [word.surface] * len(moras)
+    # 終端の状態までの経路を復元し、find_correspondanceと同じ形の区間にする
+    terminal_j, terminal_p = best_state
+    if previous_offsets is None:
+        lengths = trace(0, 0, terminal_j, terminal_p)
+    else:
+        lengths = []
+        q = terminal_p
+        for j in range(terminal_j - 1, -1, -1):
+            p = previous_offsets[j][q]
+            if q < n:
+                lengths.append(q - p)
+            else:
+                # 参照の末尾に達する区間は、末尾を越えない最短のものにそろえる
+                lengths.append(max(n - p, spans(j)[0]))
+            q = p
+        lengths.reverse()
+    correspondance = []
+    position = 0
+    for k in lengths:
+        correspondance.append((position, position + k))
+        position += k
+    for j in range(terminal_j, m):
+        if terminal_p >= n:
+            correspondance.append((position, position))
+        else:
+            correspondance.append((position, position + n - terminal_p))
+
+    if stats is not None:
+        stats["explored_states"] = explored_states
+    return best_dist, correspondance
+
+
+def build_candidate_lattice(
+    word_candidates: list[list[list[T]]],
+) -> tuple[list[list[tuple[T, int]]], list[int]]:
+    """
+    単語ごとの発音候補から、モウラを辺とする有向非巡回グラフを作る。
+
+    各単語の候補は共通の接頭辞を共有するトライにまとめ、候補の末尾のモウラの辺は単語の終端の節点に合流させる。
+    節点の番号は辺の向きに沿って増えるので、番号の順が位相順になる。
+    空の候補は辺で表せないので、空でない候補がある単語では無視する。
+
+    args:
+        word_candidates (list[list[list[T]]]): 単語ごとの発音候補のモウラ列
+
+    returns:
+        tuple[list[list[tuple[T, int]]], list[int]]:
+            節点ごとの(モウラ, 行き先の節点)の列と、各単語の境界の節点。
+            i番目の単語は境界のi番目の節点からi + 1番目の節点までの経路になる。
+    """
+    edges: list[list[tuple[T, int]]] = [[]]
+    word_boundaries = [0]
+    for candidates in word_candidates:
+        start = word_boundaries[-1]
+        trie_nodes: dict[tuple[T, ...], int] = {(): start}
+        final_edges: list[tuple[int, int]] = []
+        for moras in candidates:
+            if not moras:
+                continue
+            for i in range(1, len(moras)):
+                prefix = tuple(moras[:i])
+                if prefix not in trie_nodes:
+                    trie_nodes[prefix] = len(edges)
+                    edges.append([])
+                    edges[trie_nodes[prefix[:-1]]].append(
+                        (moras[i - 1], len(edges) - 1)
+                    )
+            parent = trie_nodes[tuple(moras[:-1])]
+            if (moras[-1], -1) not in edges[parent]:
+                # 終端の節点は単語のトライを作り終えてから割り当てる
+                edges[parent].append((moras[-1], -1))
+                final_edges.append((parent, len(edges[parent]) - 1))
+        if not final_edges:
+            # 発音のない単語
+            word_boundaries.append(start)
+            continue
+        end = len(edges)
+        edges.append([])
+        for node, index in final_edges:
+            edges[node][index] = (edges[node][index][0], end)
+        word_boundaries.append(end)
+    return edges, word_boundaries
+
+
+def _split_lattice_path(
+    steps: list[tuple[T, int]], word_boundaries: list[int]
+) -> list[list[T]]:
+    """
+    格子の経路の(モウラ, 節点)の列を、単語ごとのモウラ列に分ける。
+    """
+    word_moras: list[list[T]] = [[] for _ in range(len(word_boundaries) - 1)]
+    w = 0
+    for mora, node in steps:
+        while word_boundaries[w + 1] == word_boundaries[w]:
+            # 発音のない単語
+            w += 1
+        word_moras[w].append(mora)
+        if node == word_boundaries[w + 1]:
+            w += 1
+    return word_moras
+
+
+def _lattice_paths_to_end(
+    edges: list[list[tuple[T, int]]], start: int, end: int
+) -> list[list[tuple[T, int]]]:
+    """
+    格子のstartからendまでの経路を、辺の順に列挙する。
+    """
+    paths = []
+
+    def extend(node: int, steps: list[tuple[T, int]]) -> None:
+        if node == end:
+            paths.append(steps)
+            return
+        for mora, next_node in edges[node]:
+            extend(next_node, steps + [(mora, next_node)])
+
+    extend(start, [])
+    return paths
+
+
+def find_correspondance_with_reference_candidates(
+    reference_candidates: list[list[list[T]]],
+    input_segments: list[list[T]],
+    eval_func: Callable[[list[T], list[T]], float],
+    prefix_eval_func: Callable[[list[T], int, list[T], int], list[float]] | None = None,
+    window_size: int = 5,
+    stats: dict[str, Any] | None = None,
+) -> tuple[float, list[tuple[int, int]], list[list[T]]]:
+    """
+    参照側の各単語に複数の発音候補がある場合に、候補の選択と対応をまとめて求める。
+
+    build_candidate_latticeで作った格子の節点を参照側のoffsetの代わりに使い、
+    状態を(セグメントのindex, 格子の節点)とした動的計画法を1回だけ解く。
+    候補の組み合わせごとに対応を求める場合と違い、状態数は候補の数の和に比例し、共通の接頭辞の状態は1度だけ計算する。
+    各状態では長さが区間の候補に入る経路を列挙し、prefix_eval_funcを指定した場合は経路の末端ごとに1回だけ呼ぶ。
+    最後のセグメントには格子の終端までの残りの経路のうち最もコストの小さいものを割り当てる。
+    候補が1つずつの場合はfind_correspondanceと同じ結果を返す。
+    その他の引数はfind_correspondanceと同じ。
+
+    args:
+        reference_candidates (list[list[list[T]]]): 参照側の単語ごとの発音候補のモウラ列
+
+    returns:
+        tuple[float, list[tuple[int, int]], list[list[T]]]:
+            距離の合計、選んだ発音を連結した参照側の系列での各セグメントの(start, end)、単語ごとに選んだ発音のモウラ列
+    """
+    edges, word_boundaries = build_candidate_lattice(reference_candidates)
+    end_node = word_boundaries[-1]
+    m = len(input_segments)
+    segment_lengths = [len(segment) for segment in input_segments]
+
+    def is_terminal(j: int, v: int) -> bool:
+        return v == end_node or j >= m - 1
+
+    def spans(j: int) -> range:
+        return range(
+            max(segment_lengths[j] - window_size, 0),
+            segment_lengths[j] + window_size + 1,
+        )
+
+    def span_paths(j: int, v: int) -> list[tuple[int, float, list[tuple[T, int]]]]:
+        """
+        節点vから始まり、長さがspans(j)に入る経路を(区間の長さ, 距離, 経路)として区間の短い順に返す。
+        終端に達した経路は、find_correspondanceと同じく最短の区間の長さに切り上げる。
+        """
+        min_length, max_length = spans(j)[0], spans(j)[-1]
+        paths: list[list[Any]] = []
+
+        def extend(node: int, steps: list[tuple[T, int]], pending: list[int]) -> None:
+            length = len(steps)
+            is_leaf = node == end_node or length == max_length
+            if node == end_node or length >= min_length:
+                pending = pending + [len(paths)]
+                paths.append([max(length, min_length), None, steps])
+            if not is_leaf:
+                for mora, next_node in edges[node]:
+                    extend(next_node, steps + [(mora, next_node)], pending)
+                return
+            # 経路の末端で、まだ距離を求めていない接頭辞の経路の距離をまとめて求める
+            moras = [mora for mora, _ in steps]
+            if prefix_eval_func is not None:
+                prefix_costs = prefix_eval_func(moras, 0, input_segments[j], max_length)
+            for index in pending:
+                if paths[index][1] is None:
+                    prefix_length = len(paths[index][2])
+                    if prefix_eval_func is not None:
+                        paths[index][1] = prefix_costs[prefix_length]
+                    else:
+                        paths[index][1] = eval_func(
+                            moras[:prefix_length], input_segments[j]
+                        )
+
+        extend(v, [], [])
+        return sorted((tuple(path) for path in paths), key=lambda path: path[0])
+
+    def terminal_cost(j: int, v: int) -> tuple[float, list[tuple[T, int]]]:
+        if v == end_node:
+            if j >= m:
+                return 0, []
+            flatten_input_segments = [x for row in input_segments[j:] for x in row]
+            return eval_func([], flatten_input_segments), []
+        segment = input_segments[j] if j < m else []
+        best = None
+        for steps in _lattice_paths_to_end(edges, v, end_node):
+            cost = eval_func([mora for mora, _ in steps], segment)
+            if best is None or cost < best[0]:
+                best = (cost, steps)
+        return best
+
+    # 開始状態から到達可能な節点を前向きに列挙する
+    reachable: list[list[int]] = [[] for _ in range(m + 1)]
+    reachable[0] = [0]
+    paths_cache: dict[
+        tuple[int, int], list[tuple[int, float, list[tuple[T, int]]]]
+    ] = {}
+    for j in range(m):
+        next_nodes = set()
+        for v in reachable[j]:
+            if is_terminal(j, v):
+                continue
+            paths_cache[(j, v)] = span_paths(j, v)
+            for _, _, steps in paths_cache[(j, v)]:
+                next_nodes.add(steps[-1][1] if steps else v)
+        reachable[j + 1] = sorted(next_nodes)
+
+    # 末尾の状態から順に、(コスト, 区間の長さ, 経路)の最小のものを求める
+    costs: list[dict[int, tuple[float, int, list[tuple[T, int]]]]] = [
+        {} for _ in range(m + 1)
+    ]
+    for j in range(m, -1, -1):
+        for v in reachable[j]:
+            if is_terminal(j, v):
+                cost, steps = terminal_cost(j, v)
+                costs[j][v] = (cost, len(steps), steps)
+                continue
+            best = None
+            for k, head_cost, steps in paths_cache[(j, v)]:
+                cost = head_cost + costs[j + 1][steps[-1][1] if steps else v][0]
+                if best is None or cost < best[0]:
+                    best = (cost, k, steps)
+            costs[j][v] = best
+
+    if stats is not None:
+        stats["explored_states"] = sum(len(nodes) for nodes in reachable)
+
+    # 先頭から区間と経路を復元する。格子の終端を越えた区間はそのままの位置で残す
+    correspondance = []
+    path_steps: list[tuple[T, int]] = []
+    j, v, position = 0, 0, 0
+    while j < m:
+        if v == end_node:
+            correspondance.append((position, position))
+        else:
+            _, k, steps = costs[j][v]
+            correspondance.append((position, position + k))
+            path_steps += steps
+            position += k
+            v = steps[-1][1] if steps else v
+        j += 1
+    if m == 0:
+        path_steps = costs[0][0][2]
+    return (
+        costs[0][0][0],
+        correspondance,
+        _split_lattice_path(path_steps, word_boundaries),
+    )
+
+
+def find_correspondance_with_segment_candidates(
+    reference_text: list[T],
+    segment_candidates: list[list[list[T]]],
+    eval_func: Callable[[list[T], list[T]], float],
+    prefix_eval_func: Callable[[list[T], int, list[T], int], list[float]] | None = None,
+    window_size: int = 5,
+    stats: dict[str, Any] | None = None,
+) -> tuple[float, list[tuple[int, int]], list[list[T]]]:
+    """
+    入力側の各単語に複数の発音候補がある場合に、候補の選択と対応をまとめて求める。
+
+    入力側の1モウラを1セグメントとし、build_candidate_latticeで作った格子の節点をセグメントのindexの代わりに使って、
+    状態を(格子の節点, reference_textのoffset)とした動的計画法を1回だけ解く。
+    格子の終端に向かう辺のセグメントを最後のセグメントとして、reference_textの残りをすべて割り当てる。
+    候補が1つずつの場合はfind_correspondanceと同じ結果を返す。
+    その他の引数はfind_correspondanceと同じ。
+
+    args:
+        segment_candidates (list[list[list[T]]]): 入力側の単語ごとの発音候補のモウラ列
+
+    returns:
+        tuple[float, list[tuple[int, int]], list[list[T]]]:
+            距離の合計、選んだ発音の各モウラに対応するreference_textの(start, end)、単語ごとに選んだ発音のモウラ列
+    """
+    edges, word_boundaries = build_candidate_lattice(segment_candidates)
+    end_node = word_boundaries[-1]
+    n = len(reference_text)
+    spans = range(max(1 - window_size, 0), 1 + window_size + 1)
+
+    def is_terminal(u: int, p: int) -> bool:
+        return p >= n or u == end_node
+
+    def terminal_cost(u: int, p: int) -> tuple[float, list[tuple[T, int]]]:
+        if u == end_node:
+            return eval_func(reference_text[p:], []), []
+        # 参照の末尾に達したら、残りのセグメントには空の区間を割り当てる
+        best = None
+        for steps in _lattice_paths_to_end(edges, u, end_node):
+            cost = eval_func([], [mora for mora, _ in steps])
+            if best is None or cost < best[0]:
+                best = (cost, steps)
+        return best
+
+    # 開始状態から到達可能なoffsetを、節点の番号の順に前向きに列挙する
+    reachable: list[set[int]] = [set() for _ in edges]
+    reachable[0].add(0)
+    for u in range(len(edges)):
+        for p in reachable[u]:
+            if is_terminal(u, p):
+                continue
+            for _, next_node in edges[u]:
+                if next_node == end_node:
+                    continue
+                for k in spans:
+                    reachable[next_node].add(min(p + k, n))
+
+    # 末尾の状態から順に、(コスト, 区間の長さ, 辺)の最小のものを求める
+    costs: list[dict[int, tuple[float, int, list[tuple[T, int]]]]] = [{} for _ in edges]
+    for u in range(len(edges) - 1, -1, -1):
+        for p in sorted(reachable[u]):
+            if is_terminal(u, p):
+                cost, steps = terminal_cost(u, p)
+                costs[u][p] = (cost, 0, steps)
+                continue
+            best = None
+            for mora, next_node in edges[u]:
+                if next_node == end_node:
+                    # 最後のセグメントには残りをすべて割り当てる
+                    cost = eval_func(reference_text[p:], [mora])
+                    if best is None or cost < best[0]:
+                        best = (cost, n - p, [(mora, next_node)])
+                    continue
+                if prefix_eval_func is not None:
+                    prefix_costs = prefix_eval_func(
+                        reference_text, p, [mora], spans[-1]
+                    )
+                for k in spans:
+                    if k > max(n - p, spans[0]):
+                        # 参照の末尾を越える区間は、末尾を越えない最短のものと同じ対応になる
+                        break
+                    if prefix_eval_func is not None:
+                        head_cost = prefix_costs[min(k, n - p)]
+                    else:
+                        head_cost = eval_func(reference_text[p : p + k], [mora])
+                    cost = head_cost + costs[next_node][min(p + k, n)][0]
+                    if best is None or cost < best[0]:
+                        best = (cost, k, [(mora, next_node)])
+            costs[u][p] = best
+
+    if stats is not None:
+        stats["explored_states"] = sum(len(offsets) for offsets in reachable)
+
+    # 先頭から区間と経路を復元する。参照の末尾を越えた区間はそのままの位置で残す
+    correspondance = []
+    path_steps: list[tuple[T, int]] = []
+    u, p, position = 0, 0, 0
+    while u != end_node:
+        _, k, steps = costs[u][p]
+        if p >= n:
+            correspondance += [(position, position)] * len(steps)
+            path_steps += steps
+            break
+        correspondance.append((position, position + k))
+        path_steps += steps
+        position += k
+        p = min(p + k, n)
+        u = steps[-1][1]
+    return (
+        costs[0][0][0],
+        correspondance,
+        _split_lattice_path(path_steps, word_boundaries),
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def _analyze_original_words(
+    words: tuple[tuple[str, str, bool], ...],
+) -> tuple[tuple[Any, ...], ...]:
     original_moras = []
     is_original_phrase_starts = []
     is_original_phrase_ends = []
     is_original_word_starts = []
     is_original_word_ends = []
     original_word_surfaces = []
-    for word in original_line:
-        moras = jamorasep.parse(word.pronunciation)
+    for surface, pronunciation, is_phrase_start in words:
+        moras = jamorasep.parse(pronunciation)
         original_moras += moras
-        original_word_surfaces += [word.surface] * len(moras)
-        if word.is_phrase_start:
+        original_word_surfaces += [surface] * len(moras)
+        if is_phrase_start:
             is_original_phrase_starts += [True] + [False] * (len(moras) - 1)
         else:
             is_original_phrase_starts += [False] * len(moras)
 
         # 基本的に単語の末尾をphraseの末尾としておいて、直後がphraseの始まりでないならFalseに修正する。
-        if not word.is_phrase_start and len(is_original_phrase_starts) > 0:
+        if not is_phrase_start and len(is_original_phrase_starts) > 0:
             is_original_phrase_ends[-1] = False
         is_original_phrase_ends += [False] * (len(moras) - 1) + [True]
 
         is_original_word_starts += [True] + [False] * (len(moras) - 1)
         is_original_word_ends += [False] * (len(moras) - 1) + [True]
+    return (
+        tuple(original_moras),
+        tuple(is_original_phrase_starts),
+        tuple(is_original_phrase_ends),
+        tuple(is_original_word_starts),
+        tuple(is_original_word_ends),
+        tuple(original_word_surfaces),
+    )
+
 
-    dist, correspondance = find_correspondance(
-        original_moras, [[mora] for mora in parody_moras], eval_vowel_consonant_distance
+def analyze_original_line(
+    original_line: list[AnalyzedWordItem],
+) -> tuple[list[str], list[bool], list[bool], list[bool], list[bool], list[str]]:
+    """
+    originalの行をモウラに分解し、モウラごとの
+    (モウラ, 文節の先頭か, 文節の末尾か, 単語の先頭か, 単語の末尾か, 単語の表層)を返す。
+
+    同じ原曲は何度も替え歌にされるので、分解の結果は行の内容ごとにキャッシュして曲をまたいで再利用する。
+    キャッシュの利用状況はoriginal_line_cache_infoで得られる。
+    """
+    words = tuple(
+        (word.surface, word.pronunciation, word.is_phrase_start)
+        for word in original_line
     )
-    results = []
-    for i, (start, end) in enumerate(correspondance):
-        parody_mora = parody_moras[i]
-        is_parody_word_start = is_parody_word_starts[i]
-        is_parody_word_end = is_parody_word_ends[i]
-        parody_word_surface = ""
-        if is_parody_word_start and parody_mora:
-            parody_word_surface = parody_word_surfaces[i]
-        original_mora = original_moras[start:end]
-        if start == end:
-            is_original_phrase_start = False
-            is_original_phrase_end = False
-            is_original_word_start = False
-            is_original_word_end = False
-        else:
-            is_original_phrase_start = is_original_phrase_starts[start]
-            is_original_phrase_end = is_original_phrase_ends[end - 1]
-            is_original_word_start = is_original_word_starts[start]
-            is_original_word_end = is_original_word_ends[end - 1]
-
-        original_word_surface = ""
-        if is_original_word_start and original_mora:
-            original_word_surface = original_word_surfaces[start]
-
-        obj = AlignedMora(
-            parody_mora=parody_mora,
-            is_parody_word_start=is_parody_word_start,
-            is_parody_word_end=is_parody_word_end,
-            original_mora="".join(original_mora),
-            is_original_phrase_start=is_original_phrase_start,
-            is_original_phrase_end=is_original_phrase_end,
-            is_original_word_start=is_original_word_start,
-            is_original_word_end=is_original_word_end,
-            original_word_surface=original_word_surface,
-            parody_word_surface=parody_word_surface,
+    return tuple(list(values) for values in _analyze_original_words(words))
+
+
+def original_line_cache_info() -> functools._CacheInfo:
+    return _analyze_original_words.cache_info()
+
+
+def summarize_original_line_cache(before: functools._CacheInfo) -> str:
+    """
+    beforeを取得してから、このプロセスでoriginalの行の分解の結果を再利用した数(hits)と分解した数(misses)をまとめる。
+    workersが2以上の時は各ワーカーのプロセスで分解するので、ここには数えられない。
+    """
+    after = original_line_cache_info()
+    return (
+        f"original line cache: {after.hits - before.hits} hits,"
+        f" {after.misses - before.misses} misses"
+    )
+
+
+def get_pronunciation_candidates(word: AnalyzedWordItem) -> list[list[str]]:
+    """
+    単語の発音と、memoの"pronunciation_candidates"にある発音候補を重複なくモウラ列にして返す。
+    先頭は単語の発音。
+    """
+    pronunciations = [word.pronunciation] + list(
+        word.get_memo("pronunciation_candidates", [])
+    )
+    return [
+        jamorasep.parse(pronunciation)
+        for pronunciation in dict.fromkeys(pronunciations)
+    ]
+
+
+def _warn_unused_search_options(prune: bool, anchor_min_length: int) -> None:
+    """
+    発音候補から選ぶ動的計画法では枝刈りとアンカーを使わないので、指定されていれば警告する。
+    """
+    if prune or anchor_min_length > 0:
+        warnings.warn(
+            "発音候補のある行では--pruneと--anchor_min_lengthは使われません",
+            stacklevel=3,
         )
-        results.append(obj)
-
-    # 空文字の修正
-    # startは直後の情報と同じにする。
-    for i in range(len(results) - 2, -1, -1):
-        if results[i].original_mora == "":
-            results[i].is_original_phrase_start = results[
-                i + 1
-            ].is_original_phrase_start
-            results[i].is_original_word_start = results[i + 1].is_original_word_start
-    # endは直前の情報と同じにする
-    for i in range(1, len(results)):
-        if results[i].original_mora == "":
-            results[i].is_original_phrase_end = results[i - 1].is_original_phrase_end
-            results[i].is_original_word_end = results[i - 1].is_original_word_end
-    return results
 
 
-def align_parody_to_original(
-    parody_line: list[AnalyzedWordItem], original_line: list[AnalyzedWordItem]
-) -> list[AlignedMora]:
+def _parody_mora_attributes(
+    parody_line: list[AnalyzedWordItem], parody_word_moras: list[list[str]]
+) -> tuple[list[str], list[bool], list[bool], list[str]]:
     parody_moras = []
     is_parody_word_starts = []
     is_parody_word_ends = []
     parody_word_surfaces = []
-    for word in parody_line:
-        moras = jamorasep.parse(word.pronunciation)
+    for word, moras in zip(parody_line, parody_word_moras):
         parody_moras += moras
         is_parody_word_starts += [True] + [False] * (len(moras) - 1)
         is_parody_word_ends += [False] * (len(moras) - 1) + [True]
         parody_word_surfaces += [word.surface] * len(moras)
-    original_moras = []
-    is_original_phrase_starts = []
-    is_original_phrase_ends = []
-    is_original_word_starts = []
-    is_original_word_ends = []
-    original_word_surfaces = []
-    for word in original_line:
-        moras = jamorasep.parse(word.pronunciation)
-        original_moras += moras
-        original_word_surfaces += [word.surface] * len(moras)
-        if word.is_phrase_start:
-            is_original_phrase_starts += [True] + [False] * (len(moras) - 1)
-        else:
-            is_original_phrase_starts += [False] * len(moras)
+    return (
+        parody_moras,
+        is_parody_word_starts,
+        is_parody_word_ends,
+        parody_word_surfaces,
+    )
 
-        # 基本的に単語の末尾をphraseの末尾としておいて、直後がphraseの始まりでないならFalseに修正する。
-        if not word.is_phrase_start and len(is_original_phrase_starts) > 0:
-            is_original_phrase_ends[-1] = False
-        is_original_phrase_ends += [False] * (len(moras) - 1) + [True]
 
-        is_original_word_starts += [True] + [False] * (len(moras) - 1)
-        is_original_word_ends += [False] * (len(moras) - 1) + [True]
+def align_original_to_parody(
+    parody_line: list[AnalyzedWordItem],
+    original_line: list[AnalyzedWordItem],
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
+    linear_memory: bool = False,
+    n_best: int = 1,
+    band_width: int | None = None,
+) -> list[AlignedMora]:
+    parody_candidates = [get_pronunciation_candidates(word) for word in parody_line]
+    parody_word_moras = [candidates[0] for candidates in parody_candidates]
+    (
+        original_moras,
+        is_original_phrase_starts,
+        is_original_phrase_ends,
+        is_original_word_starts,
+        is_original_word_ends,
+        original_word_surfaces,
+    ) = analyze_original_line(original_line)
 
-    dist, correspondance = find_correspondance(
-        parody_moras, [[mora] for mora in original_moras], eval_vowel_consonant_distance
+    stats = {}
+    # 発音候補のある単語があれば、候補の選択と対応を1回の動的計画法でまとめて求める。
+    # この場合は枝刈りとアンカーは使わない。
+    use_candidates = (
+        n_best == 1
+        and not linear_memory
+        and any(len(candidates) > 1 for candidates in parody_candidates)
     )
-    results = []
-    for i, (start, end) in enumerate(correspondance):
-        original_mora = original_moras[i]
-        is_original_word_start = is_original_word_starts[i]
-        is_original_word_end = is_original_word_ends[i]
-        is_original_phrase_start = is_original_phrase_starts[i]
-        is_original_phrase_end = is_original_phrase_ends[i]
-        original_word_surface = ""
-        if is_original_word_start and original_mora:
-            original_word_surface = original_word_surfaces[i]
-
-        parody_mora = parody_moras[start:end]
-        if start == end:
-            is_parody_word_start = False
-            is_parody_word_end = False
-        else:
-            is_parody_word_start = is_parody_word_starts[start]
-            is_parody_word_end = is_parody_word_ends[end - 1]
-
-        parody_word_surface = ""
-        if is_parody_word_start and parody_mora:
-            parody_word_surface = parody_word_surfaces[start]
-
-        obj = AlignedMora(
-            parody_mora="".join(parody_mora),
-            is_parody_word_start=is_parody_word_start,
-            is_parody_word_end=is_parody_word_end,
-            original_mora=original_mora,
-            is_original_phrase_start=is_original_phrase_start,
-            is_original_phrase_end=is_original_phrase_end,
-            is_original_word_start=is_original_word_start,
-            is_original_word_end=is_original_word_end,
-            original_word_surface=original_word_surface,
-            parody_word_surface=parody_word_surface,
+    if use_candidates:
+        _warn_unused_search_options(prune, anchor_min_length)
+        dist, correspondance, parody_word_moras = (
+            find_correspondance_with_segment_candidates(
+                original_moras,
+                parody_candidates,
+                eval_vowel_consonant_distance,
+                eval_vowel_consonant_prefix_distances,
+                window_size,
+                stats,
+            )
         )
-        results.append(obj)
-
-    # 空文字の修正
-    # startは直後の情報と同じにする。
-    for i in range(len(results) - 2, -1, -1):
-        if results[i].parody_mora == "":
-            results[i].is_parody_word_start = results[i + 1].is_parody_word_start
-    # endは直前の情報と同じにする
-    for i in range(1, len(results)):
-        if results[i].parody_mora == "":
-            results[i].is_parody_word_end = results[i - 1].is_parody_word_end
-    return results
+    (
+        parody_moras,
+        is_parody_word_starts,
+        is_parody_word_ends,
+        parody_word_surfaces,
+    ) = _parody_mora_attributes(parody_line, parody_word_moras)
+    if use_candidates:
+        alignments = [(dist, correspondance)]
+    elif n_best > 1:
+        alignments = find_n_best_correspondances(
+            original_moras,
+            [[mora] for mora in parody_moras],
+            eval_vowel_consonant_distance,
+            eval_vowel_consonant_prefix_distances,
+            n_best,
+            window_size,
+            stats=stats,
+        )
+    else:
+        alignments = [
+            find_correspondance(
+                original_moras,
+                [[mora] for mora in parody_moras],
+                eval_vowel_consonant_distance,
+                eval_vowel_consonant_prefix_distances,
+                window_size=window_size,
+                lower_bound_func=vowel_consonant_distance_lower_bound
+                if prune
+                else None,
+                stats=stats,
+                anchor_min_length=anchor_min_length,
+                linear_memory=linear_memory,
+                band_width=band_width,
+            )
+        ]
+    # n_bestが2以上なら、コストの小さい順に各対応の結果を並べる
+    all_results = []
+    for alignment_rank, (dist, correspondance) in enumerate(alignments):
+        results = []
+        for i, (start, end) in enumerate(correspondance):
+            parody_mora = parody_moras[i]
+            is_parody_word_start = is_parody_word_starts[i]
+            is_parody_word_end = is_parody_word_ends[i]
+            parody_word_surface = ""
+            if is_parody_word_start and parody_mora:
+                parody_word_surface = parody_word_surfaces[i]
+            original_mora = original_moras[start:end]
+            if start == end:
+                is_original_phrase_start = False
+                is_original_phrase_end = False
+                is_original_word_start = False
+                is_original_word_end = False
+            else:
+                is_original_phrase_start = is_original_phrase_starts[start]
+                is_original_phrase_end = is_original_phrase_ends[end - 1]
+                is_original_word_start = is_original_word_starts[start]
+                is_original_word_end = is_original_word_ends[end - 1]
 
+            original_word_surface = ""
+            if is_original_word_start and original_mora:
+                original_word_surface = original_word_surfaces[start]
 
-def align_analyzed_lyrics(
-    analyzed_lyrics: AnalyzedLyrics, parody_as_referrence: bool = True
+            obj = AlignedMora(
+                parody_mora=parody_mora,
+                is_parody_word_start=is_parody_word_start,
+                is_parody_word_end=is_parody_word_end,
+                original_mora="".join(original_mora),
+                is_original_phrase_start=is_original_phrase_start,
+                is_original_phrase_end=is_original_phrase_end,
+                is_original_word_start=is_original_word_start,
+                is_original_word_end=is_original_word_end,
+                original_word_surface=original_word_surface,
+                parody_word_surface=parody_word_surface,
+                explored_states=stats["explored_states"],
+                alignment_rank=alignment_rank,
+                alignment_cost=dist,
+            )
+            results.append(obj)
+
+        # 空文字の修正
+        # startは直後の情報と同じにする。
+        for i in range(len(results) - 2, -1, -1):
+            if results[i].original_mora == "":
+                results[i].is_original_phrase_start = results[
+                    i + 1
+                ].is_original_phrase_start
+                results[i].is_original_word_start = results[
+                    i + 1
+                ].is_original_word_start
+        # endは直前の情報と同じにする
+        for i in range(1, len(results)):
+            if results[i].original_mora == "":
+                results[i].is_original_phrase_end = results[
+                    i - 1
+                ].is_original_phrase_end
+                results[i].is_original_word_end = results[i - 1].is_original_word_end
+        all_results.extend(results)
+    return all_results
+
+
+def align_parody_to_original(
+    parody_line: list[AnalyzedWordItem],
+    original_line: list[AnalyzedWordItem],
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
+    linear_memory: bool = False,
+    n_best: int = 1,
+    band_width: int | None = None,
 ) -> list[AlignedMora]:
+    parody_candidates = [get_pronunciation_candidates(word) for word in parody_line]
+    parody_word_moras = [candidates[0] for candidates in parody_candidates]
+    (
+        original_moras,
+        is_original_phrase_starts,
+        is_original_phrase_ends,
+        is_original_word_starts,
+        is_original_word_ends,
+        original_word_surfaces,
+    ) = analyze_original_line(original_line)
+
+    stats = {}
+    # 発音候補のある単語があれば、候補の選択と対応を1回の動的計画法でまとめて求める。
+    # この場合は枝刈りとアンカーは使わない。
+    use_candidates = (
+        n_best == 1
+        and not linear_memory
+        and any(len(candidates) > 1 for candidates in parody_candidates)
+    )
+    if use_candidates:
+        _warn_unused_search_options(prune, anchor_min_length)
+        dist, correspondance, parody_word_moras = (
+            find_correspondance_with_reference_candidates(
+                parody_candidates,
+                [[mora] for mora in original_moras],
+                eval_vowel_consonant_distance,
+                eval_vowel_consonant_prefix_distances,
+                window_size,
+                stats,
+            )
+        )
+    (
+        parody_moras,
+        is_parody_word_starts,
+        is_parody_word_ends,
+        parody_word_surfaces,
+    ) = _parody_mora_attributes(parody_line, parody_word_moras)
+    if use_candidates:
+        alignments = [(dist, correspondance)]
+    elif n_best > 1:
+        alignments = find_n_best_correspondances(
+            parody_moras,
+            [[mora] for mora in original_moras],
+            eval_vowel_consonant_distance,
+            eval_vowel_consonant_prefix_distances,
+            n_best,
+            window_size,
+            stats=stats,
+        )
+    else:
+        alignments = [
+            find_correspondance(
+                parody_moras,
+                [[mora] for mora in original_moras],
+                eval_vowel_consonant_distance,
+                eval_vowel_consonant_prefix_distances,
+                window_size=window_size,
+                lower_bound_func=vowel_consonant_distance_lower_bound
+                if prune
+                else None,
+                stats=stats,
+                anchor_min_length=anchor_min_length,
+                linear_memory=linear_memory,
+                band_width=band_width,
+            )
+        ]
+    # n_bestが2以上なら、コストの小さい順に各対応の結果を並べる
     all_results = []
-    for line_id, (parody_line, original_line) in enumerate(
+    for alignment_rank, (dist, correspondance) in enumerate(alignments):
+        results = []
+        for i, (start, end) in enumerate(correspondance):
+            original_mora = original_moras[i]
+            is_original_word_start = is_original_word_starts[i]
+            is_original_word_end = is_original_word_ends[i]
+            is_original_phrase_start = is_original_phrase_starts[i]
+            is_original_phrase_end = is_original_phrase_ends[i]
+            original_word_surface = ""
+            if is_original_word_start and original_mora:
+                original_word_surface = original_word_surfaces[i]
+
+            parody_mora = parody_moras[start:end]
+            if start == end:
+                is_parody_word_start = False
+                is_parody_word_end = False
+            else:
+                is_parody_word_start = is_parody_word_starts[start]
+                is_parody_word_end = is_parody_word_ends[end - 1]
+
+            parody_word_surface = ""
+            if is_parody_word_start and parody_mora:
+                parody_word_surface = parody_word_surfaces[start]
+
+            obj = AlignedMora(
+                parody_mora="".join(parody_mora),
+                is_parody_word_start=is_parody_word_start,
+                is_parody_word_end=is_parody_word_end,
+                original_mora=original_mora,
+                is_original_phrase_start=is_original_phrase_start,
+                is_original_phrase_end=is_original_phrase_end,
+                is_original_word_start=is_original_word_start,
+                is_original_word_end=is_original_word_end,
+                original_word_surface=original_word_surface,
+                parody_word_surface=parody_word_surface,
+                explored_states=stats["explored_states"],
+                alignment_rank=alignment_rank,
+                alignment_cost=dist,
+            )
+            results.append(obj)
+
+        # 空文字の修正
+        # startは直後の情報と同じにする。
+        for i in range(len(results) - 2, -1, -1):
+            if results[i].parody_mora == "":
+                results[i].is_parody_word_start = results[i + 1].is_parody_word_start
+        # endは直前の情報と同じにする
+        for i in range(1, len(results)):
+            if results[i].parody_mora == "":
+                results[i].is_parody_word_end = results[i - 1].is_parody_word_end
+        all_results.extend(results)
+    return all_results
+
+
+def set_vowel_consonant(results: list[AlignedMora]) -> None:
+    for result in results:
+        parody_consonant, parody_vowel = split_consonant_vowel(result.parody_mora)
+        original_consonant, original_vowel = split_consonant_vowel(result.original_mora)
+        result.parody_vowel = parody_vowel
+        result.parody_consonant = parody_consonant
+        result.original_vowel = original_vowel
+        result.original_consonant = original_consonant
+
+
+# align_whole_songで、曲全体の対角線から各モウラの対応がずれてよい最大のモウラ数
+WHOLE_SONG_BAND_WIDTH = 50
+
+
+def align_whole_song(
+    analyzed_lyrics: AnalyzedLyrics,
+    parody_as_referrence: bool = True,
+    window_size: int = 5,
+    anchor_min_length: int = 0,
+    band_width: int | None = WHOLE_SONG_BAND_WIDTH,
+) -> list[AlignedMora]:
+    """
+    行の区切りを使わずに、曲全体のモウラ列をまとめてアラインメントする。
+
+    行の区切りが信頼できない入力のためのモード。対応の探索にはfind_correspondance_linear_memoryを使うので、
+    数千モウラの曲でもメモリは曲の長さに比例する量で済む。
+    処理時間は、band_widthを指定すれば曲のモウラ数とband_widthの積に比例する。
+    Noneなら曲のモウラ数の2乗に比例し、数百モウラで数秒から数十秒かかる。
+    line_idは、各行に対応する入力側(parody_as_referrenceならoriginal、そうでなければparody)の元の行の区切りから復元する。
+    """
+    parody_song = [word for line in analyzed_lyrics.parody for word in line]
+    original_song = [word for line in analyzed_lyrics.original for word in line]
+    if parody_as_referrence:
+        results = align_parody_to_original(
+            parody_song,
+            original_song,
+            window_size,
+            anchor_min_length=anchor_min_length,
+            linear_memory=True,
+            band_width=band_width,
+        )
+        segment_lines = analyzed_lyrics.original
+    else:
+        results = align_original_to_parody(
+            parody_song,
+            original_song,
+            window_size,
+            anchor_min_length=anchor_min_length,
+            linear_memory=True,
+            band_width=band_width,
+        )
+        segment_lines = analyzed_lyrics.parody
+
+    line_ids = [
+        str(line_id)
+        for line_id, line in enumerate(segment_lines)
+        for word in line
+        for _ in jamorasep.parse(word.pronunciation)
+    ]
+    for result, line_id in zip(results, line_ids):
+        result.line_id = line_id
+    set_vowel_consonant(results)
+    return results
+
+
+def align_line_pair(
+    line_pair: tuple[list[AnalyzedWordItem], list[AnalyzedWordItem]],
+    parody_as_referrence: bool = True,
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
+    n_best: int = 1,
+) -> list[AlignedMora]:
+    """
+    1行分の(parody, original)をアラインメントする。プロセスプールに渡せるようにモジュールの関数にしている。
+    """
+    parody_line, original_line = line_pair
+    if parody_as_referrence:
+        results = align_parody_to_original(
+            parody_line,
+            original_line,
+            window_size,
+            prune,
+            anchor_min_length,
+            n_best=n_best,
+        )
+    else:
+        results = align_original_to_parody(
+            parody_line,
+            original_line,
+            window_size,
+            prune,
+            anchor_min_length,
+            n_best=n_best,
+        )
+    set_vowel_consonant(results)
+    return results
+
+
+def _iter_analyzed_lyrics_results(
+    analyzed_lyrics: AnalyzedLyrics,
+    parody_as_referrence: bool,
+    window_size: int,
+    prune: bool,
+    anchor_min_length: int,
+    whole_song: bool,
+    n_best: int,
+    band_width: int | None,
+) -> Iterator[list[AlignedMora]]:
+    # 曲全体、または行の組ごとのアラインメント結果を順に返す
+    if whole_song:
+        yield align_whole_song(
+            analyzed_lyrics,
+            parody_as_referrence,
+            window_size,
+            anchor_min_length,
+            band_width,
+        )
+        return
+
+    for line_id, line_pair in enumerate(
         zip(analyzed_lyrics.parody, analyzed_lyrics.original)
     ):
-        if parody_as_referrence:
-            results = align_parody_to_original(parody_line, original_line)
-        else:
-            results = align_original_to_parody(parody_line, original_line)
+        results = align_line_pair(
+            line_pair,
+            parody_as_referrence,
+            window_size,
+            prune,
+            anchor_min_length,
+            n_best,
+        )
         for result in results:
             result.line_id = str(line_id)
+        yield results
 
-            parody_consonant, parody_vowel = split_consonant_vowel(result.parody_mora)
-            original_consonant, original_vowel = split_consonant_vowel(
-                result.original_mora
-            )
-            result.parody_vowel = parody_vowel
-            result.parody_consonant = parody_consonant
-            result.original_vowel = original_vowel
-            result.original_consonant = original_consonant
+
+def align_analyzed_lyrics(
+    analyzed_lyrics: AnalyzedLyrics,
+    parody_as_referrence: bool = True,
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
+    whole_song: bool = False,
+    n_best: int = 1,
+    band_width: int | None = WHOLE_SONG_BAND_WIDTH,
+) -> list[AlignedMora]:
+    all_results = []
+    for results in _iter_analyzed_lyrics_results(
+        analyzed_lyrics,
+        parody_as_referrence,
+        window_size,
+        prune,
+        anchor_min_length,
+        whole_song,
+        n_best,
+        band_width,
+    ):
         all_results.extend(results)
     return all_results
 
 
-def align_files(input_dir: str, parody_as_referrence: bool = True):
-    all_results = []
+def align_analyzed_lyrics_table(
+    analyzed_lyrics: AnalyzedLyrics,
+    parody_as_referrence: bool = True,
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
+    whole_song: bool = False,
+    n_best: int = 1,
+    band_width: int | None = WHOLE_SONG_BAND_WIDTH,
+) -> AlignedMoraTable:
+    """
+    align_analyzed_lyricsと同じ結果をAlignedMoraTableで返す。
+    行ごとに表に詰めていくので、曲全体のAlignedMoraのリストは作らない。
+    """
+    builder = AlignedMoraTableBuilder()
+    for results in _iter_analyzed_lyrics_results(
+        analyzed_lyrics,
+        parody_as_referrence,
+        window_size,
+        prune,
+        anchor_min_length,
+        whole_song,
+        n_best,
+        band_width,
+    ):
+        builder.extend(results)
+    return builder.build()
+
+
+# 一度にアラインメントに渡す行の組(whole_songなら曲)の数。ドラフトはこの数ずつ読みながら処理する
+ALIGN_BATCH_SIZE = 1024
+
+
+def iter_draft_line_pairs(
+    input_file_paths: Iterable[str], use_draft_cache: bool = False
+) -> Iterator[tuple[str, int, tuple[list[AnalyzedWordItem], list[AnalyzedWordItem]]]]:
+    """
+    ドラフトのファイルを順に少しずつ読み、(ファイル, 行の組の番号, 行の組)を返す。
+    警告はファイルごとにまとめて表示する。形式の誤りはファイル名と行番号を含めたValueErrorにする。
+    use_draft_cacheなら、ドラフトの横のキャッシュが新しければ解析せずに読み込む。
+    """
+    for input_file_path in input_file_paths:
+        print(input_file_path)
+        line_warnings = []
+        try:
+            for line_id, line_pair in enumerate(
+                iter_line_pairs_from_file(input_file_path, use_draft_cache)
+            ):
+                line_warnings.extend(find_line_warnings(line_pair[0]))
+                line_warnings.extend(find_line_warnings(line_pair[1]))
+                yield input_file_path, line_id, line_pair
+        except ValueError as e:
+            raise ValueError(f"{input_file_path}: {e}") from e
+        warning_summary = format_warning_summary(input_file_path, line_warnings)
+        if warning_summary:
+            print(warning_summary)
+
+
+def iter_batches(iterable: Iterable[T], batch_size: int) -> Iterator[list[T]]:
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+def map_in_batches(
+    align_func: functools.partial,
+    line_ids_and_tasks: Iterable[tuple[tuple[str, str | None], Any]],
+    workers: int = 1,
+    cache: AlignmentCache | None = None,
+    batch_size: int = ALIGN_BATCH_SIZE,
+) -> Iterator[list[AlignedMora]]:
+    """
+    ((ファイル, line_id), 入力)の列をbatch_sizeずつ読みながらアラインメントし、結果を入力の順に返す。
+
+    workersが2以上なら、入力をプロセスプールで並列にアラインメントする。
+    cacheを指定すると、キャッシュにある入力はアラインメントせずに保存した結果を返す。
+    """
+    with contextlib.ExitStack() as stack:
+        map_func = map
+        if workers > 1:
+            executor = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            )
+            map_func = functools.partial(executor.map, chunksize=16)
+        for batch in iter_batches(line_ids_and_tasks, batch_size):
+            line_ids = [line_id for line_id, _ in batch]
+            tasks = [task for _, task in batch]
+            if cache is None:
+                task_results = map_func(align_func, tasks)
+            else:
+                task_results = cache.map(
+                    align_func, tasks, map_func, COST_FUNCTION_VERSION
+                )
+            yield from _assign_line_ids(line_ids, task_results)
+
+
+def iter_align_files(
+    input_dir: str,
+    parody_as_referrence: bool = True,
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
+    whole_song: bool = False,
+    n_best: int = 1,
+    workers: int = 1,
+    cache: AlignmentCache | None = None,
+    use_draft_cache: bool = False,
+    band_width: int | None = WHOLE_SONG_BAND_WIDTH,
+) -> Iterator[list[AlignedMora]]:
+    """
+    input_dirの*.txtをすべてアラインメントし、行の組(whole_songなら曲)ごとの結果を入力の順に返す。
+
+    ドラフトは少しずつ読みながらアラインメントするので、曲を連結した大きなドラフトでもメモリは一定で済む。
+    workersが2以上なら、行の組をプロセスプールで並列にアラインメントする。
+    結果は入力の順に返すので、出力はworkersによらず同じになる。
+    cacheを指定すると、キャッシュにある行の組はアラインメントせずに保存した結果を返す。
+    use_draft_cacheなら、解析したドラフトをバイナリで保存し、ドラフトが変わっていなければ解析せずに読み込む。
+    band_widthはwhole_songの場合だけ使う。align_whole_songを参照。
+    """
     if os.path.isdir(input_dir):
         files = sorted(glob.glob(os.path.join(input_dir, "*.txt")))
     else:
         files = [input_dir]
-    for input_file_path in files:
-        print(input_file_path)
-        with open(input_file_path, "r") as f:
-            input_text = f.read()
-        analyzed_lyrics = AnalyzedLyrics.from_text(input_text)
-        results = align_analyzed_lyrics(analyzed_lyrics, parody_as_referrence)
+    line_pairs = iter_draft_line_pairs(files, use_draft_cache)
+
+    if whole_song:
+        align_func = functools.partial(
+            align_whole_song,
+            parody_as_referrence=parody_as_referrence,
+            window_size=window_size,
+            anchor_min_length=anchor_min_length,
+            band_width=band_width,
+        )
+        line_ids_and_tasks = _iter_song_tasks(line_pairs)
+        yield from map_in_batches(align_func, line_ids_and_tasks, workers, cache)
+        return
+
+    align_func = functools.partial(
+        align_line_pair,
+        parody_as_referrence=parody_as_referrence,
+        window_size=window_size,
+        prune=prune,
+        anchor_min_length=anchor_min_length,
+        n_best=n_best,
+    )
+    cache_info = original_line_cache_info()
+    line_ids_and_tasks = iter_line_pair_tasks(line_pairs)
+    yield from map_in_batches(align_func, line_ids_and_tasks, workers, cache)
+    if workers == 1:
+        print(summarize_original_line_cache(cache_info))
+
+
+def _iter_song_tasks(
+    line_pairs: Iterable[
+        tuple[str, int, tuple[list[AnalyzedWordItem], list[AnalyzedWordItem]]]
+    ],
+) -> Iterator[tuple[tuple[str, None], AnalyzedLyrics]]:
+    # 曲ごとに(ファイル, None)と入力を並べる
+    for input_file_path, song_line_pairs in itertools.groupby(
+        line_pairs, key=lambda item: item[0]
+    ):
+        analyzed_lyrics = AnalyzedLyrics(parody=[], original=[])
+        for _, _, (parody_line, original_line) in song_line_pairs:
+            analyzed_lyrics.parody.append(parody_line)
+            analyzed_lyrics.original.append(original_line)
+        yield (input_file_path, None), analyzed_lyrics
+
+
+def iter_line_pair_tasks(
+    line_pairs: Iterable[
+        tuple[str, int, tuple[list[AnalyzedWordItem], list[AnalyzedWordItem]]]
+    ],
+) -> Iterator[
+    tuple[tuple[str, str], tuple[list[AnalyzedWordItem], list[AnalyzedWordItem]]]
+]:
+    # 行の組ごとに(ファイル, line_id)と入力を並べる
+    for input_file_path, line_id, line_pair in line_pairs:
+        yield (input_file_path, str(line_id)), line_pair
+
+
+def _assign_line_ids(
+    line_ids: list[tuple[str, str | None]],
+    task_results: Iterable[list[AlignedMora]],
+) -> Iterator[list[AlignedMora]]:
+    for (input_file_path, line_id), results in zip(line_ids, task_results):
         for result in results:
+            if line_id is not None:
+                result.line_id = line_id
             result.input_file_path = input_file_path
-        all_results.extend(results)
-    return all_results
+        yield results
+
+
+def align_files(
+    input_dir: str,
+    parody_as_referrence: bool = True,
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
+    whole_song: bool = False,
+    n_best: int = 1,
+    workers: int = 1,
+    cache: AlignmentCache | None = None,
+    use_draft_cache: bool = False,
+    band_width: int | None = WHOLE_SONG_BAND_WIDTH,
+) -> list[AlignedMora]:
+    return [
+        result
+        for results in iter_align_files(
+            input_dir,
+            parody_as_referrence,
+            window_size,
+            prune,
+            anchor_min_length,
+            whole_song,
+            n_best,
+            workers,
+            cache,
+            use_draft_cache,
+            band_width,
+        )
+        for result in results
+    ]
+
+
+# AlignedMoraのフィールドのうち、write_aligned_morasで指定した時だけ書き込む列
+OPTIONAL_COLUMNS = ["explored_states", "alignment_rank", "alignment_cost"]
+
+
+def write_aligned_moras(
+    output_file_path: str,
+    results_iter: Iterable[list[AlignedMora]],
+    optional_columns: Iterable[str] = (),
+) -> None:
+    """
+    AlignedMoraの列を、受け取った順にCSVへ書き込む。
+
+    全体をDataFrameにまとめずに行の組ごとに書き込むので、メモリは出力の大きさによらない。
+    列はOPTIONAL_COLUMNSを除いたフィールドで、以前のpd.DataFrame(results).to_csv(index=False)と同じ。
+    optional_columnsに指定したOPTIONAL_COLUMNSの列は、フィールドの順で後ろに加える。
+    """
+    optional_columns = set(optional_columns)
+    columns = [
+        aligned_mora_field.name
+        for aligned_mora_field in fields(AlignedMora)
+        if aligned_mora_field.name not in OPTIONAL_COLUMNS
+        or aligned_mora_field.name in optional_columns
+    ]
+    with open(output_file_path, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(columns)
+        for results in results_iter:
+            writer.writerows(
+                [getattr(result, column) for column in columns] for result in results
+            )
 
 
 def main():
@@ -363,10 +1859,101 @@ def main():
     parser.add_argument("-i", "--input_dir", type=str, default="data/lyrics")
     parser.add_argument("-o", "--output_file_path", type=str, default="output.csv")
     parser.add_argument("-p", "--parody_as_referrence", action="store_true")
+    parser.add_argument(
+        "-ws",
+        "--window_size",
+        type=int,
+        default=5,
+        help="各モウラに割り当てる区間の長さの最大のずれ",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="コストの下界を使って最適になりえない状態を探索しないフラグ。"
+        "発音候補のある行では使わない",
+    )
+    parser.add_argument(
+        "-a",
+        "--anchor_min_length",
+        type=int,
+        default=0,
+        help="この長さ以上の完全一致区間の対応を固定する。0なら固定しない。"
+        "発音候補のある行では使わない",
+    )
+    parser.add_argument(
+        "--whole_song",
+        action="store_true",
+        help="行の区切りを使わずに曲全体をまとめてアラインメントするフラグ。"
+        "処理時間は曲のモウラ数と--band_widthの積に比例する",
+    )
+    parser.add_argument(
+        "--band_width",
+        type=int,
+        default=WHOLE_SONG_BAND_WIDTH,
+        help="--whole_songで、曲全体の対角線から対応がずれてよい最大のモウラ数。"
+        "0なら制限しないが、処理時間が曲のモウラ数の2乗に比例し、数百モウラで数十秒かかる",
+    )
+    parser.add_argument(
+        "-n",
+        "--n_best",
+        type=int,
+        default=1,
+        help="各行についてコストの小さい順に出力する対応の数。"
+        "2以上なら順位とコストをalignment_rank、alignment_costの列に書き込む",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="並列にアラインメントするプロセス数",
+    )
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=None,
+        help="行の組ごとの結果を保存するキャッシュのファイル。指定しなければキャッシュを使わない",
+    )
+    parser.add_argument(
+        "--cache_max_mb",
+        type=int,
+        default=256,
+        help="キャッシュの最大サイズ(MB)。超えたら最後に使ったのが古いものから削除する",
+    )
+    parser.add_argument(
+        "--draft_cache",
+        action="store_true",
+        help="解析したドラフトをドラフトの横にバイナリで保存し、次から解析せずに読み込むフラグ",
+    )
+    parser.add_argument(
+        "--explored_states",
+        action="store_true",
+        help="行の組ごとに探索した状態の数をexplored_statesの列に書き込むフラグ",
+    )
     args = parser.parse_args()
-    all_results = align_files(args.input_dir, args.parody_as_referrence)
-    df = pd.DataFrame(all_results)
-    df.to_csv(args.output_file_path, index=False)
+    cache = None
+    if args.cache_path is not None:
+        cache = AlignmentCache(args.cache_path, args.cache_max_mb * 1024 * 1024)
+    results_iter = iter_align_files(
+        args.input_dir,
+        args.parody_as_referrence,
+        args.window_size,
+        args.prune,
+        args.anchor_min_length,
+        args.whole_song,
+        args.n_best,
+        args.workers,
+        cache,
+        args.draft_cache,
+        args.band_width if args.band_width > 0 else None,
+    )
+    optional_columns = ["explored_states"] if args.explored_states else []
+    if args.n_best > 1:
+        optional_columns += ["alignment_rank", "alignment_cost"]
+    write_aligned_moras(args.output_file_path, results_iter, optional_columns)
+    if cache is not None:
+        cache.close()
+        print(cache.summary())
 
 
 if __name__ == "__main__":
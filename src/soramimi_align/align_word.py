@@ -1,52 +1,78 @@
 # %%
+import functools
 import glob
+import itertools
+import math
 import os
+from collections.abc import Iterator
 
-import jamorasep
-import pandas as pd
-
-from soramimi_align.align_mora import eval_vowel_consonant_distance, find_correspondance
+from soramimi_align.align_mora import (
+    analyze_original_line,
+    eval_vowel_consonant_distance,
+    eval_vowel_consonant_prefix_distances,
+    find_correspondance,
+    get_pronunciation_candidates,
+    iter_draft_line_pairs,
+    iter_line_pair_tasks,
+    map_in_batches,
+    original_line_cache_info,
+    summarize_original_line_cache,
+    vowel_consonant_distance_lower_bound,
+    write_aligned_moras,
+)
+from soramimi_align.aligned_mora_table import AlignedMoraTable, AlignedMoraTableBuilder
+from soramimi_align.cache import AlignmentCache
 from soramimi_align.schemas import AlignedMora, AnalyzedLyrics, AnalyzedWordItem
 
+# 1行で試す発音候補の組み合わせの最大数
+MAX_PRONUNCIATION_COMBINATIONS = 256
+
 
 def align_parody_word_to_original(
-    parody_line: list[AnalyzedWordItem], original_line: list[AnalyzedWordItem]
+    parody_line: list[AnalyzedWordItem],
+    original_line: list[AnalyzedWordItem],
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
 ) -> list[AlignedMora]:
-    parody_word_pronunciations = []
-    parody_word_surfaces = []
-    for word in parody_line:
-        moras = jamorasep.parse(word.pronunciation)
-        parody_word_pronunciations.append(moras)
-        parody_word_surfaces.append(word.surface)
-
-    original_moras = []
-    is_original_phrase_starts = []
-    is_original_phrase_ends = []
-    is_original_word_starts = []
-    is_original_word_ends = []
-    original_word_surfaces = []
-    for word in original_line:
-        moras = jamorasep.parse(word.pronunciation)
-        original_moras += moras
-        original_word_surfaces += [word.surface] * len(moras)
-        if word.is_phrase_start:
-            is_original_phrase_starts += [True] + [False] * (len(moras) - 1)
-        else:
-            is_original_phrase_starts += [False] * len(moras)
-
-        # 基本的に単語の末尾をphraseの末尾としておいて、直後がphraseの始まりでないならFalseに修正する。
-        if not word.is_phrase_start and len(is_original_phrase_starts) > 0:
-            is_original_phrase_ends[-1] = False
-        is_original_phrase_ends += [False] * (len(moras) - 1) + [True]
-
-        is_original_word_starts += [True] + [False] * (len(moras) - 1)
-        is_original_word_ends += [False] * (len(moras) - 1) + [True]
+    parody_candidates = [get_pronunciation_candidates(word) for word in parody_line]
+    parody_word_surfaces = [word.surface for word in parody_line]
+    combination_num = math.prod(len(candidates) for candidates in parody_candidates)
+    if combination_num > MAX_PRONUNCIATION_COMBINATIONS:
+        raise ValueError(
+            f"発音候補の組み合わせが多すぎます({combination_num}通り)。"
+            f"{MAX_PRONUNCIATION_COMBINATIONS}通り以下にしてください"
+        )
 
-    dist, correspondance = find_correspondance(
+    (
         original_moras,
-        parody_word_pronunciations,
-        eval_vowel_consonant_distance,
-    )
+        is_original_phrase_starts,
+        is_original_phrase_ends,
+        is_original_word_starts,
+        is_original_word_ends,
+        original_word_surfaces,
+    ) = analyze_original_line(original_line)
+
+    # 発音候補のある単語があれば、候補の組み合わせごとに対応を求め、コストの最も小さいものを選ぶ。
+    # コストが同じなら先頭の候補を優先する
+    stats = {}
+    explored_states = 0
+    best = None
+    for pronunciations in itertools.product(*parody_candidates):
+        dist, correspondance = find_correspondance(
+            original_moras,
+            list(pronunciations),
+            eval_vowel_consonant_distance,
+            eval_vowel_consonant_prefix_distances,
+            window_size=window_size,
+            lower_bound_func=vowel_consonant_distance_lower_bound if prune else None,
+            stats=stats,
+            anchor_min_length=anchor_min_length,
+        )
+        explored_states += stats["explored_states"]
+        if best is None or dist < best[0]:
+            best = (dist, correspondance, pronunciations)
+    _, correspondance, parody_word_pronunciations = best
     results = []
     for i, (start, end) in enumerate(correspondance):
         parody_word_pronunciation = parody_word_pronunciations[i]
@@ -81,6 +107,7 @@ def align_parody_word_to_original(
             is_original_word_end=is_original_word_end,
             original_word_surface=original_word_surface,
             parody_word_surface=parody_word_surface,
+            explored_states=explored_states,
         )
         results.append(obj)
 
@@ -100,39 +127,135 @@ def align_parody_word_to_original(
     return results
 
 
-def align_analyzed_lyrics(analyzed_lyrics: AnalyzedLyrics) -> list[AlignedMora]:
-    all_results = []
-    for line_id, (parody_line, original_line) in enumerate(
+def align_line_pair(
+    line_pair: tuple[list[AnalyzedWordItem], list[AnalyzedWordItem]],
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
+) -> list[AlignedMora]:
+    """
+    1行分の(parody, original)を単語単位でアラインメントする。プロセスプールに渡せるようにモジュールの関数にしている。
+    """
+    parody_line, original_line = line_pair
+    results = align_parody_word_to_original(
+        parody_line, original_line, window_size, prune, anchor_min_length
+    )
+    for result in results:
+        result.parody_vowel = ""
+        result.parody_consonant = ""
+        result.original_vowel = ""
+        result.original_consonant = ""
+    return results
+
+
+def _iter_analyzed_lyrics_results(
+    analyzed_lyrics: AnalyzedLyrics,
+    window_size: int,
+    prune: bool,
+    anchor_min_length: int,
+) -> Iterator[list[AlignedMora]]:
+    # 行の組ごとのアラインメント結果を順に返す
+    for line_id, line_pair in enumerate(
         zip(analyzed_lyrics.parody, analyzed_lyrics.original)
     ):
-        results = align_parody_word_to_original(parody_line, original_line)
+        results = align_line_pair(line_pair, window_size, prune, anchor_min_length)
         for result in results:
             result.line_id = str(line_id)
+        yield results
+
 
-            result.parody_vowel = ""
-            result.parody_consonant = ""
-            result.original_vowel = ""
-            result.original_consonant = ""
+def align_analyzed_lyrics(
+    analyzed_lyrics: AnalyzedLyrics,
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
+) -> list[AlignedMora]:
+    all_results = []
+    for results in _iter_analyzed_lyrics_results(
+        analyzed_lyrics, window_size, prune, anchor_min_length
+    ):
         all_results.extend(results)
     return all_results
 
 
-def align_files(input_dir: str):
-    all_results = []
+def align_analyzed_lyrics_table(
+    analyzed_lyrics: AnalyzedLyrics,
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
+) -> AlignedMoraTable:
+    """
+    align_analyzed_lyricsと同じ結果をAlignedMoraTableで返す。
+    行ごとに表に詰めていくので、曲全体のAlignedMoraのリストは作らない。
+    """
+    builder = AlignedMoraTableBuilder()
+    for results in _iter_analyzed_lyrics_results(
+        analyzed_lyrics, window_size, prune, anchor_min_length
+    ):
+        builder.extend(results)
+    return builder.build()
+
+
+def iter_align_files(
+    input_dir: str,
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
+    workers: int = 1,
+    cache: AlignmentCache | None = None,
+    use_draft_cache: bool = False,
+) -> Iterator[list[AlignedMora]]:
+    """
+    input_dirの*.txtをすべてアラインメントし、行の組ごとの結果を入力の順に返す。
+
+    ドラフトは少しずつ読みながらアラインメントするので、曲を連結した大きなドラフトでもメモリは一定で済む。
+    workersが2以上なら、行の組をプロセスプールで並列にアラインメントする。
+    結果は入力の順に返すので、出力はworkersによらず同じになる。
+    cacheを指定すると、キャッシュにある行の組はアラインメントせずに保存した結果を返す。
+    use_draft_cacheなら、解析したドラフトをバイナリで保存し、ドラフトが変わっていなければ解析せずに読み込む。
+    """
     if os.path.isdir(input_dir):
         files = sorted(glob.glob(os.path.join(input_dir, "*.txt")))
     else:
         files = [input_dir]
-    for input_file_path in files:
-        print(input_file_path)
-        with open(input_file_path, "r") as f:
-            input_text = f.read()
-        analyzed_lyrics = AnalyzedLyrics.from_text(input_text)
-        results = align_analyzed_lyrics(analyzed_lyrics)
-        for result in results:
-            result.input_file_path = input_file_path
-        all_results.extend(results)
-    return all_results
+
+    align_func = functools.partial(
+        align_line_pair,
+        window_size=window_size,
+        prune=prune,
+        anchor_min_length=anchor_min_length,
+    )
+    cache_info = original_line_cache_info()
+    line_ids_and_tasks = iter_line_pair_tasks(
+        iter_draft_line_pairs(files, use_draft_cache)
+    )
+    yield from map_in_batches(align_func, line_ids_and_tasks, workers, cache)
+    if workers == 1:
+        print(summarize_original_line_cache(cache_info))
+
+
+def align_files(
+    input_dir: str,
+    window_size: int = 5,
+    prune: bool = False,
+    anchor_min_length: int = 0,
+    workers: int = 1,
+    cache: AlignmentCache | None = None,
+    use_draft_cache: bool = False,
+) -> list[AlignedMora]:
+    return [
+        result
+        for results in iter_align_files(
+            input_dir,
+            window_size,
+            prune,
+            anchor_min_length,
+            workers,
+            cache,
+            use_draft_cache,
+        )
+        for result in results
+    ]
 
 
 def main():
@@ -141,10 +264,73 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--input_dir", type=str, default="data/lyrics")
     parser.add_argument("-o", "--output_file_path", type=str, default="output.csv")
+    parser.add_argument(
+        "-ws",
+        "--window_size",
+        type=int,
+        default=5,
+        help="各単語に割り当てる区間の長さの最大のずれ",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="コストの下界を使って最適になりえない状態を探索しないフラグ",
+    )
+    parser.add_argument(
+        "-a",
+        "--anchor_min_length",
+        type=int,
+        default=0,
+        help="この長さ以上の完全一致区間の対応を固定する。0なら固定しない",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="並列にアラインメントするプロセス数",
+    )
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=None,
+        help="行の組ごとの結果を保存するキャッシュのファイル。指定しなければキャッシュを使わない",
+    )
+    parser.add_argument(
+        "--cache_max_mb",
+        type=int,
+        default=256,
+        help="キャッシュの最大サイズ(MB)。超えたら最後に使ったのが古いものから削除する",
+    )
+    parser.add_argument(
+        "--draft_cache",
+        action="store_true",
+        help="解析したドラフトをドラフトの横にバイナリで保存し、次から解析せずに読み込むフラグ",
+    )
+    parser.add_argument(
+        "--explored_states",
+        action="store_true",
+        help="行の組ごとに探索した状態の数をexplored_statesの列に書き込むフラグ。"
+        "単語と区間の対応の探索で数えるので、align_mora.pyの値とは比べられない",
+    )
     args = parser.parse_args()
-    all_results = align_files(args.input_dir)
-    df = pd.DataFrame(all_results)
-    df.to_csv(args.output_file_path, index=False)
+    cache = None
+    if args.cache_path is not None:
+        cache = AlignmentCache(args.cache_path, args.cache_max_mb * 1024 * 1024)
+    results_iter = iter_align_files(
+        args.input_dir,
+        args.window_size,
+        args.prune,
+        args.anchor_min_length,
+        args.workers,
+        cache,
+        args.draft_cache,
+    )
+    optional_columns = ["explored_states"] if args.explored_states else []
+    write_aligned_moras(args.output_file_path, results_iter, optional_columns)
+    if cache is not None:
+        cache.close()
+        print(cache.summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+import array
+from collections.abc import Iterable, Iterator
+from dataclasses import fields
+
+import numpy as np
+import pandas as pd
+
+from soramimi_align.schemas import AlignedMora
+
+# AlignedMoraのフィールドを型ごとに分ける
+FIELD_NAMES = [aligned_mora_field.name for aligned_mora_field in fields(AlignedMora)]
+STRING_FIELDS = [f.name for f in fields(AlignedMora) if f.type is str]
+BOOL_FIELDS = [f.name for f in fields(AlignedMora) if f.type is bool]
+INT_FIELDS = [f.name for f in fields(AlignedMora) if f.type is int]
+FLOAT_FIELDS = [f.name for f in fields(AlignedMora) if f.type is float]
+
+# array.arrayの型コードとnumpyのdtype。真偽値はnp.packbitsで8個ずつ1バイトに詰める
+_ARRAY_TYPECODES = {"string": "i", "bool": "b", "int": "q", "float": "d"}
+_NUMPY_DTYPES = {
+    "string": np.int32,
+    "bool": np.uint8,
+    "int": np.int64,
+    "float": np.float64,
+}
+
+
+def _field_kind(name: str) -> str:
+    if name in STRING_FIELDS:
+        return "string"
+    elif name in BOOL_FIELDS:
+        return "bool"
+    elif name in INT_FIELDS:
+        return "int"
+    else:
+        return "float"
+
+
+class AlignedMoraTable:
+    """
+    AlignedMoraの列を、フィールドごとの配列として保持する表。
+
+    真偽値はnp.packbitsで8個ずつ1バイトに詰めたuint8の配列、整数と小数はnumpyの配列で持ち、
+    モウラや表層などの文字列はフィールドごとに重複を除いた文字列の表と、その表への整数のコードで持つ。
+    AlignedMoraのリストと違い、行ごとにオブジェクトを作らないので、コーパス全体でもメモリが小さく済む。
+    インデックスで参照するとAlignedMoraを作って返すので、AlignedMoraのリストと同じように読み出せる。
+    ただし返すAlignedMoraはその都度作る複製なので、フィールドを書き換えても表には反映されない。
+    """
+
+    def __init__(
+        self,
+        columns: dict[str, np.ndarray],
+        categories: dict[str, list[str]],
+        length: int,
+    ):
+        self.columns = columns
+        self.categories = categories
+        self._length = length
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[AlignedMora]) -> "AlignedMoraTable":
+        builder = AlignedMoraTableBuilder()
+        builder.extend(rows)
+        return builder.build()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int | slice) -> "AlignedMora | AlignedMoraTable":
+        if isinstance(index, slice):
+            columns = {
+                name: np.packbits(self._unpack_bits(name)[index])
+                if name in BOOL_FIELDS
+                else values[index]
+                for name, values in self.columns.items()
+            }
+            return AlignedMoraTable(
+                columns, self.categories, len(range(self._length)[index])
+            )
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("AlignedMoraTableのインデックスが範囲外です")
+        return AlignedMora(**{name: self._value(name, index) for name in FIELD_NAMES})
+
+    def __iter__(self) -> Iterator[AlignedMora]:
+        for index in range(self._length):
+            yield self[index]
+
+    def _value(self, name: str, index: int) -> str | bool | int | float:
+        if name in BOOL_FIELDS:
+            return bool(self.columns[name][index >> 3] >> (7 - (index & 7)) & 1)
+        value = self.columns[name][index]
+        if name in STRING_FIELDS:
+            return self.categories[name][value]
+        return value.item()
+
+    def _unpack_bits(self, name: str) -> np.ndarray:
+        return np.unpackbits(self.columns[name], count=self._length).view(np.bool_)
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        フィールドの値をnumpyの配列で返す。整数と小数のフィールドは複製せずに保持している配列をそのまま返す。
+        文字列のフィールドはコードから文字列の配列を、真偽値のフィールドは詰めたビットを展開したbool配列を作って返す。
+        """
+        if name in STRING_FIELDS:
+            return np.asarray(self.categories[name], dtype=object)[self.columns[name]]
+        if name in BOOL_FIELDS:
+            return self._unpack_bits(name)
+        return self.columns[name]
+
+    def to_numpy(self) -> dict[str, np.ndarray]:
+        """
+        フィールドごとの配列を返す。文字列のフィールドはcategoriesへのコードの配列になる。
+        真偽値のフィールドは展開したbool配列を作って返し、それ以外は複製せずに返す。
+        """
+        return {
+            name: self._unpack_bits(name) if name in BOOL_FIELDS else values
+            for name, values in self.columns.items()
+        }
+
+    def to_pandas(self) -> pd.DataFrame:
+        """
+        AlignedMoraのリストから作るDataFrameと同じ列のDataFrameを返す。
+        文字列のフィールドはコードをそのまま使ったCategoricalにする。
+        """
+        data = {}
+        for name in FIELD_NAMES:
+            if name in STRING_FIELDS:
+                data[name] = pd.Categorical.from_codes(
+                    self.columns[name], categories=self.categories[name]
+                )
+            else:
+                data[name] = self.column(name)
+        return pd.DataFrame(data, copy=False)
+
+    def to_rows(self) -> list[AlignedMora]:
+        return list(self)
+
+
+class AlignedMoraTableBuilder:
+    """
+    AlignedMoraを1つずつ追加してAlignedMoraTableを作る。
+
+    追加した値はarray.arrayに詰めていくので、AlignedMoraのオブジェクトは追加した後に捨てられる。
+    真偽値はbuildの時にビットに詰める。
+    """
+
+    def __init__(self):
+        self._values = {
+            name: array.array(_ARRAY_TYPECODES[_field_kind(name)])
+            for name in FIELD_NAMES
+        }
+        self._codes: dict[str, dict[str, int]] = {name: {} for name in STRING_FIELDS}
+
+    def append(self, row: AlignedMora) -> None:
+        for name in FIELD_NAMES:
+            value = getattr(row, name)
+            if name in self._codes:
+                codes = self._codes[name]
+                code = codes.get(value)
+                if code is None:
+                    code = len(codes)
+                    codes[value] = code
+                value = code
+            self._values[name].append(value)
+
+    def extend(self, rows: Iterable[AlignedMora]) -> None:
+        for row in rows:
+            self.append(row)
+
+    def build(self) -> AlignedMoraTable:
+        columns = {}
+        for name, values in self._values.items():
+            if len(values) == 0:
+                columns[name] = np.empty(0, dtype=_NUMPY_DTYPES[_field_kind(name)])
+            elif name in BOOL_FIELDS:
+                columns[name] = np.packbits(np.frombuffer(values, dtype=np.bool_))
+            else:
+                columns[name] = np.frombuffer(
+                    values, dtype=_NUMPY_DTYPES[_field_kind(name)]
+                )
+        categories = {name: list(codes) for name, codes in self._codes.items()}
+        return AlignedMoraTable(columns, categories, len(self._values[FIELD_NAMES[0]]))
@@ -0,0 +1,507 @@
+import array
+import hashlib
+import mmap
+import os
+import struct
+from collections.abc import Callable, Hashable, Iterable, Iterator, Mapping
+from dataclasses import dataclass
+from typing import Any
+
+import pandas as pd
+
+# 選手の表の横に置くインデックスのファイル名の接尾辞
+ATHLETE_TABLE_INDEX_SUFFIX = ".index"
+# 形式や選手の表の読み込み方を変えたら上げる
+ATHLETE_TABLE_INDEX_VERSION = 1
+
+_MAGIC = b"SAAT"
+# magic, version, 選手の表のmtime_ns, 選手の表のサイズ, 選手の表のsha256,
+# n-gramのn, IDの種類, 選手の数, 表層の数, 表層のIDの数, 選手ごとの表層の数, 読みの数,
+# n-gramの数, n-gramを含む表層の数, 文字列の数
+_HEADER = struct.Struct("=4sIqq32sIIIIIIIIII")
+_INT_ID = 0
+_STR_ID = 1
+
+
+class SubstringIndex:
+    """
+    文字列の集合から、ある文字列を部分文字列として含むものを探すための文字n-gramの転置インデックス。
+
+    n文字以下のすべての部分文字列について、それを含む文字列の番号を追加した順に持つ。
+    n文字より長い文字列を探す時は、n-gramの番号の積集合を候補として、実際に含むかを確かめる。
+    """
+
+    def __init__(self, keys: Iterable[str], n: int = 2):
+        self.keys = list(keys)
+        self.n = n
+        self._postings: dict[str, list[int]] = {}
+        for key_index, key in enumerate(self.keys):
+            grams = {
+                key[start : start + length]
+                for length in range(1, n + 1)
+                for start in range(len(key) - length + 1)
+            }
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(key_index)
+
+    @classmethod
+    def from_postings(
+        cls, keys: list[str], n: int, postings: Mapping[str, list[int]]
+    ) -> "SubstringIndex":
+        """
+        保存しておいた転置インデックスから作る。n-gramを数え直さない。
+        """
+        substring_index = cls.__new__(cls)
+        substring_index.keys = keys
+        substring_index.n = n
+        substring_index._postings = postings
+        return substring_index
+
+    def find(self, substring: str) -> list[str]:
+        """
+        substringを含む文字列を、追加した順に返す。
+        """
+        if not substring:
+            return list(self.keys)
+        if len(substring) <= self.n:
+            return [self.keys[i] for i in self._postings.get(substring, [])]
+
+        postings = []
+        for start in range(len(substring) - self.n + 1):
+            posting = self._postings.get(substring[start : start + self.n])
+            if posting is None:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+        return [self.keys[i] for i in sorted(candidates) if substring in self.keys[i]]
+
+
+@dataclass
+class AthleteTable:
+    """
+    AthleteNameDetectorが使う、選手の表から作る辞書と部分一致の検索のインデックス。
+
+    surface_to_id_dict: 選手の名前(original)と表層から、選手のIDの集合への辞書
+    id_to_pronunciation_dict: 選手のIDから、表層ごとの読みの集合への辞書
+    surface_index: surface_to_id_dictのキーの部分一致の検索に使うインデックス
+    """
+
+    surface_to_id_dict: Mapping[str, set[Hashable]]
+    id_to_pronunciation_dict: Mapping[Hashable, dict[str, set[str]]]
+    surface_index: SubstringIndex
+
+
+@dataclass
+class _AthleteTableEntries:
+    """
+    AthleteTableの集合を、選手の表に出てきた順のリストで持つ。インデックスのファイルにはこの形で保存する。
+
+    ids: 選手のID。出てきた順
+    keys: surface_to_id_dictのキー
+    key_athletes: キーごとの選手のidsでの番号
+    athlete_pronunciations: 選手ごとの(表層, 読みのリスト)のリスト
+    """
+
+    ids: list[Hashable]
+    keys: list[str]
+    key_athletes: list[list[int]]
+    athlete_pronunciations: list[list[tuple[str, list[str]]]]
+    surface_index: SubstringIndex
+
+    def to_athlete_table(self) -> AthleteTable:
+        ids = self.ids
+        # 集合に出てきた順に追加するので、選手の表から1行ずつ作った場合と同じ順に列挙される
+        surface_to_id_dict = {
+            key: {ids[athlete] for athlete in athletes}
+            for key, athletes in zip(self.keys, self.key_athletes)
+        }
+        id_to_pronunciation_dict = {
+            id: {
+                surface: set(pronunciations)
+                for surface, pronunciations in surface_pronunciations
+            }
+            for id, surface_pronunciations in zip(ids, self.athlete_pronunciations)
+        }
+        return AthleteTable(
+            surface_to_id_dict=surface_to_id_dict,
+            id_to_pronunciation_dict=id_to_pronunciation_dict,
+            surface_index=self.surface_index,
+        )
+
+
+def get_athlete_table_index_path(athlete_table_path: str) -> str:
+    return athlete_table_path + ATHLETE_TABLE_INDEX_SUFFIX
+
+
+def load_athlete_table(
+    athlete_table_path: str, use_index: bool = True, n: int = 2
+) -> AthleteTable:
+    """
+    選手の表を読み込む。
+
+    use_indexなら、選手の表の横のインデックスが新しい時はmmapで読み、CSVを読まずn-gramも数えない。
+    インデックスが古いかない時はCSVを読み、インデックスを書き込む。
+    インデックスはmtimeとサイズが同じなら新しいとみなし、違う時は選手の表のsha256で確かめる。
+    """
+    if not use_index:
+        return _read_athlete_table_csv(athlete_table_path, n).to_athlete_table()
+
+    index_path = get_athlete_table_index_path(athlete_table_path)
+    stat = os.stat(athlete_table_path)
+    sha256: bytes | None = None
+    if os.path.exists(index_path):
+        is_fresh, sha256 = _check_freshness(index_path, athlete_table_path, stat, n)
+        if is_fresh:
+            return _read_athlete_table_index(index_path)
+    if sha256 is None:
+        sha256 = _file_sha256(athlete_table_path)
+
+    entries = _read_athlete_table_csv(athlete_table_path, n)
+    try:
+        _write_athlete_table_index(index_path, entries, stat, sha256)
+    except (OSError, ValueError) as e:
+        # 書き込めなくても選手の表は使えるので、インデックスを諦める
+        print(f"警告: 選手の表のインデックスを書き込めませんでした: {index_path} {e}")
+    return entries.to_athlete_table()
+
+
+def _read_athlete_table_csv(athlete_table_path: str, n: int) -> _AthleteTableEntries:
+    athlete_table_df = pd.read_csv(athlete_table_path)
+    # pronunciationはカタカナのみにする
+    pronunciations = (
+        athlete_table_df["pronunciation"]
+        .str.replace(r"\s+", "", regex=True)
+        .str.replace("・", "", regex=False)
+    )
+
+    athlete_indexes: dict[Hashable, int] = {}
+    key_athletes: dict[str, dict[int, None]] = {}
+    athlete_pronunciations: list[dict[str, dict[str, None]]] = []
+    for id, original, surface, pronunciation in zip(
+        athlete_table_df["id"].tolist(),
+        athlete_table_df["original"].tolist(),
+        athlete_table_df["surface"].tolist(),
+        pronunciations.tolist(),
+    ):
+        athlete = athlete_indexes.get(id)
+        if athlete is None:
+            athlete = len(athlete_indexes)
+            athlete_indexes[id] = athlete
+            athlete_pronunciations.append({})
+        key_athletes.setdefault(original, {})[athlete] = None
+        key_athletes.setdefault(surface, {})[athlete] = None
+        athlete_pronunciations[athlete].setdefault(surface, {})[pronunciation] = None
+
+    return _AthleteTableEntries(
+        ids=list(athlete_indexes),
+        keys=list(key_athletes),
+        key_athletes=[list(athletes) for athletes in key_athletes.values()],
+        athlete_pronunciations=[
+            [
+                (surface, list(surface_pronunciations))
+                for surface, surface_pronunciations in athlete_surfaces.items()
+            ]
+            for athlete_surfaces in athlete_pronunciations
+        ],
+        surface_index=SubstringIndex(key_athletes, n),
+    )
+
+
+def _file_sha256(path: str) -> bytes:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.digest()
+
+
+def _check_freshness(
+    index_path: str, athlete_table_path: str, stat: os.stat_result, n: int
+) -> tuple[bool, bytes | None]:
+    """
+    インデックスが新しいかと、確かめるために計算した選手の表のsha256(計算していなければNone)を返す。
+    """
+    with open(index_path, "rb") as f:
+        header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return False, None
+    magic, version, mtime_ns, size, cached_sha256, index_n, *counts = _HEADER.unpack(
+        header
+    )
+    if (
+        magic != _MAGIC
+        or version != ATHLETE_TABLE_INDEX_VERSION
+        or size != stat.st_size
+        or index_n != n
+    ):
+        return False, None
+    if mtime_ns == stat.st_mtime_ns:
+        return True, None
+
+    sha256 = _file_sha256(athlete_table_path)
+    if sha256 != cached_sha256:
+        return False, sha256
+    # 内容が同じなら、次からはsha256を計算せずに済むようにmtimeを更新する
+    try:
+        with open(index_path, "r+b") as f:
+            f.write(
+                _HEADER.pack(
+                    magic, version, stat.st_mtime_ns, size, sha256, index_n, *counts
+                )
+            )
+    except OSError:
+        pass
+    return True, sha256
+
+
+def _offsets(lists: Iterable[list]) -> array.array:
+    offsets = array.array("i", [0])
+    for values in lists:
+        offsets.append(offsets[-1] + len(values))
+    return offsets
+
+
+def _write_athlete_table_index(
+    index_path: str,
+    entries: _AthleteTableEntries,
+    stat: os.stat_result,
+    sha256: bytes,
+) -> None:
+    string_ids: dict[str, int] = {}
+
+    def get_string_id(string: str) -> int:
+        string_id = string_ids.get(string)
+        if string_id is None:
+            string_id = len(string_ids)
+            string_ids[string] = string_id
+        return string_id
+
+    # IDは整数か文字列の場合だけ保存できる。bool型は整数として扱わない
+    if all(type(id) is int for id in entries.ids):
+        id_kind = _INT_ID
+        ids = array.array("q", entries.ids)
+    elif all(isinstance(id, str) for id in entries.ids):
+        id_kind = _STR_ID
+        ids = array.array("q", [get_string_id(id) for id in entries.ids])
+    else:
+        raise ValueError("選手のIDが整数か文字列ではありません")
+
+    keys = array.array("i", [get_string_id(key) for key in entries.keys])
+    key_athlete_offsets = _offsets(entries.key_athletes)
+    key_athletes = array.array(
+        "i", [athlete for athletes in entries.key_athletes for athlete in athletes]
+    )
+    surface_offsets = _offsets(entries.athlete_pronunciations)
+    surface_pronunciations = [
+        surface_pronunciation
+        for athlete_surfaces in entries.athlete_pronunciations
+        for surface_pronunciation in athlete_surfaces
+    ]
+    surfaces = array.array(
+        "i", [get_string_id(surface) for surface, _ in surface_pronunciations]
+    )
+    pronunciation_offsets = _offsets(
+        pronunciations for _, pronunciations in surface_pronunciations
+    )
+    pronunciations = array.array(
+        "i",
+        [
+            get_string_id(pronunciation)
+            for _, surface_pronunciations in surface_pronunciations
+            for pronunciation in surface_pronunciations
+        ],
+    )
+    postings = entries.surface_index._postings
+    grams = array.array("i", [get_string_id(gram) for gram in postings])
+    posting_offsets = _offsets(postings.values())
+    posting_keys = array.array(
+        "i", [key for posting in postings.values() for key in posting]
+    )
+
+    encoded_strings = [string.encode("utf-8") for string in string_ids]
+    string_offsets = _offsets(encoded_strings)
+
+    # 他のプロセスが読んでいても壊れないように、一時ファイルに書いてから置き換える
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            _HEADER.pack(
+                _MAGIC,
+                ATHLETE_TABLE_INDEX_VERSION,
+                stat.st_mtime_ns,
+                stat.st_size,
+                sha256,
+                entries.surface_index.n,
+                id_kind,
+                len(ids),
+                len(keys),
+                len(key_athletes),
+                len(surfaces),
+                len(pronunciations),
+                len(grams),
+                len(posting_keys),
+                len(encoded_strings),
+            )
+        )
+        # 8バイトの整数を先に置いて、ヘッダの後ろで揃うようにする
+        for values in [
+            ids,
+            keys,
+            key_athlete_offsets,
+            key_athletes,
+            surface_offsets,
+            surfaces,
+            pronunciation_offsets,
+            pronunciations,
+            grams,
+            posting_offsets,
+            posting_keys,
+            string_offsets,
+        ]:
+            values.tofile(f)
+        f.write(b"".join(encoded_strings))
+    os.replace(tmp_path, index_path)
+
+
+class _LazyMapping(Mapping):
+    """
+    キーから番号への辞書だけを持ち、値は初めて参照した時にインデックスのファイルから作る読み取り専用の辞書。
+    作った値は保持するので、同じキーには同じオブジェクトを返す。
+    """
+
+    def __init__(self, key_to_index: dict[Hashable, int], load_value: Callable):
+        self._key_to_index = key_to_index
+        self._load_value = load_value
+        self._values: dict[Hashable, Any] = {}
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self._values.get(key)
+        if value is None:
+            value = self._load_value(self._key_to_index[key])
+            self._values[key] = value
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._key_to_index
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._key_to_index)
+
+    def __len__(self) -> int:
+        return len(self._key_to_index)
+
+
+class _AthleteTableIndexFile:
+    """
+    インデックスのファイルをmmapで開き、配列をmemoryviewとして参照する。
+    AthleteTableの値が参照している間は開いたままにする。
+    """
+
+    def __init__(self, index_path: str):
+        with open(index_path, "rb") as f:
+            self._mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            _,
+            _,
+            _,
+            _,
+            _,
+            self.n,
+            self.id_kind,
+            athlete_num,
+            key_num,
+            key_athlete_num,
+            surface_num,
+            pronunciation_num,
+            gram_num,
+            posting_key_num,
+            string_num,
+        ) = _HEADER.unpack_from(self._mapped)
+        buffer = memoryview(self._mapped)
+        offset = _HEADER.size
+
+        def take(count: int, format: str) -> memoryview:
+            nonlocal offset
+            size = struct.calcsize(format) * count
+            view = buffer[offset : offset + size].cast(format)
+            offset += size
+            return view
+
+        self.ids = take(athlete_num, "q")
+        self.keys = take(key_num, "i")
+        self.key_athlete_offsets = take(key_num + 1, "i")
+        self.key_athletes = take(key_athlete_num, "i")
+        self.surface_offsets = take(athlete_num + 1, "i")
+        self.surfaces = take(surface_num, "i")
+        self.pronunciation_offsets = take(surface_num + 1, "i")
+        self.pronunciations = take(pronunciation_num, "i")
+        self.grams = take(gram_num, "i")
+        self.posting_offsets = take(gram_num + 1, "i")
+        self.posting_keys = take(posting_key_num, "i")
+        self.string_offsets = take(string_num + 1, "i")
+        self._string_blob = buffer[offset:]
+
+    def get_string(self, string_id: int) -> str:
+        start = self.string_offsets[string_id]
+        end = self.string_offsets[string_id + 1]
+        return str(self._string_blob[start:end], "utf-8")
+
+    def get_strings(self, string_ids: memoryview) -> list[str]:
+        return [self.get_string(string_id) for string_id in string_ids]
+
+
+def _read_athlete_table_index(index_path: str) -> AthleteTable:
+    """
+    インデックスのファイルから、選手の表の表層とIDとn-gramへの辞書だけを作ってAthleteTableを返す。
+    IDの集合や読みは、そのキーを初めて参照した時に作る。
+    """
+    index_file = _AthleteTableIndexFile(index_path)
+    if index_file.id_kind == _STR_ID:
+        ids = index_file.get_strings(index_file.ids)
+    else:
+        ids = index_file.ids.tolist()
+    keys = index_file.get_strings(index_file.keys)
+
+    def get_ids(key_index: int) -> set[Hashable]:
+        start = index_file.key_athlete_offsets[key_index]
+        end = index_file.key_athlete_offsets[key_index + 1]
+        return {ids[athlete] for athlete in index_file.key_athletes[start:end]}
+
+    def get_pronunciations(athlete: int) -> dict[str, set[str]]:
+        surface_pronunciations = {}
+        for surface in range(
+            index_file.surface_offsets[athlete], index_file.surface_offsets[athlete + 1]
+        ):
+            start = index_file.pronunciation_offsets[surface]
+            end = index_file.pronunciation_offsets[surface + 1]
+            surface_pronunciations[
+                index_file.get_string(index_file.surfaces[surface])
+            ] = set(index_file.get_strings(index_file.pronunciations[start:end]))
+        return surface_pronunciations
+
+    def get_posting(gram_index: int) -> list[int]:
+        start = index_file.posting_offsets[gram_index]
+        end = index_file.posting_offsets[gram_index + 1]
+        return index_file.posting_keys[start:end].tolist()
+
+    postings = _LazyMapping(
+        {
+            gram: gram_index
+            for gram_index, gram in enumerate(index_file.get_strings(index_file.grams))
+        },
+        get_posting,
+    )
+    return AthleteTable(
+        surface_to_id_dict=_LazyMapping(
+            {key: key_index for key_index, key in enumerate(keys)}, get_ids
+        ),
+        id_to_pronunciation_dict=_LazyMapping(
+            {id: athlete for athlete, id in enumerate(ids)}, get_pronunciations
+        ),
+        surface_index=SubstringIndex.from_postings(keys, index_file.n, postings),
+    )
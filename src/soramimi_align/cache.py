@@ -0,0 +1,221 @@
+import functools
+import hashlib
+import json
+import pickle
+import sqlite3
+import time
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any, Self
+
+# AlignmentCacheで1回の問い合わせに含めるキーの数
+LOOKUP_CHUNK_SIZE = 500
+
+
+class AlignmentCache:
+    """
+    行の組ごとのアラインメント結果をSQLiteに保存するキャッシュ。
+
+    キーはアラインメント関数とその引数、コスト関数のversion、入力の行の組から作るハッシュなので、
+    読みを直したドラフトを再実行しても、変わっていない行の組は保存した結果を読み込むだけで済む。
+    保存した結果の合計がmax_bytesを超えたら、最後に使ってから時間が経ったものから削除する。
+    結果はmapの呼び出しごと(map_in_batchesのバッチごと)と、commit_interval回保存するごとにコミットするので、
+    途中で止めてもそれまでの結果は残る。
+    """
+
+    def __init__(
+        self, path: str, max_bytes: int = 256 * 1024 * 1024, commit_interval: int = 1000
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.commit_interval = commit_interval
+        self.hits = 0
+        self.misses = 0
+        self._uncommitted_puts = 0
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS alignments"
+            " (key TEXT PRIMARY KEY, value BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @staticmethod
+    def make_key(align_func: functools.partial, task: Any, version: int) -> str:
+        """
+        functools.partialで引数を固定したアラインメント関数と入力から、キーを作る。
+        入力のreprを使うので、dataclassの入力ならすべてのフィールドがキーに含まれる。
+        """
+        content = repr(
+            (
+                version,
+                align_func.func.__module__,
+                align_func.func.__qualname__,
+                sorted(align_func.keywords.items()),
+                task,
+            )
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key: str) -> Any:
+        value = self._get_values([key]).get(key)
+        if value is None:
+            return None
+        return pickle.loads(value)
+
+    def _get_values(self, keys: list[str]) -> dict[str, bytes]:
+        """
+        keysのうちキャッシュにあるものを、pickleしたままの値で返し、最後に使った時刻を更新する。
+        SQLiteの変数の数の上限を超えないように、LOOKUP_CHUNK_SIZE個ずつ問い合わせる。
+        """
+        values = {}
+        for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+            chunk = keys[start : start + LOOKUP_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            values.update(
+                self._connection.execute(
+                    f"SELECT key, value FROM alignments WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+            )
+        now = time.time()
+        self._connection.executemany(
+            "UPDATE alignments SET last_used = ? WHERE key = ?",
+            [(now, key) for key in values],
+        )
+        return values
+
+    def put(self, key: str, value: Any) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO alignments (key, value, last_used) VALUES (?, ?, ?)",
+            (key, pickle.dumps(value), time.time()),
+        )
+        self._uncommitted_puts += 1
+        if self._uncommitted_puts >= self.commit_interval:
+            self.commit()
+
+    def map(
+        self,
+        align_func: functools.partial,
+        tasks: list[Any],
+        map_func: Callable[[Callable, Iterable], Iterable] = map,
+        version: int = 0,
+    ) -> Iterator[Any]:
+        """
+        map_func(align_func, tasks)と同じ結果を入力の順に返す。
+        キャッシュにない入力だけをmap_funcに渡し、その結果はキャッシュに保存する。
+        キャッシュにある結果はアラインメントを始める前にまとめて読み込むので、
+        途中のcommitで古い結果が削除されても影響しない。
+        """
+        keys = [self.make_key(align_func, task, version) for task in tasks]
+        hit_values = self._get_values(keys)
+        missed_results = iter(
+            map_func(
+                align_func,
+                [task for task, key in zip(tasks, keys) if key not in hit_values],
+            )
+        )
+        for key in keys:
+            value = hit_values.get(key)
+            if value is not None:
+                self.hits += 1
+                yield pickle.loads(value)
+            else:
+                self.misses += 1
+                result = next(missed_results)
+                self.put(key, result)
+                yield result
+        self.commit()
+
+    def evict(self) -> None:
+        """
+        保存した結果の合計がmax_bytesに収まるように、最後に使った時刻が古いものから削除する。
+        """
+        self._connection.execute(
+            "DELETE FROM alignments WHERE key IN ("
+            " SELECT key FROM ("
+            "  SELECT key, SUM(LENGTH(value)) OVER"
+            "   (ORDER BY last_used DESC, rowid DESC) AS total_bytes"
+            "  FROM alignments"
+            " ) WHERE total_bytes > ?"
+            ")",
+            (self.max_bytes,),
+        )
+
+    def commit(self) -> None:
+        """
+        古い結果を削除してから、保存した結果と最後に使った時刻をコミットする。
+        """
+        with self._connection:
+            self.evict()
+        self._uncommitted_puts = 0
+
+    def close(self) -> None:
+        self.commit()
+        self._connection.close()
+
+    def summary(self) -> str:
+        return f"alignment cache: {self.hits} hits, {self.misses} misses ({self.path})"
+
+
+class TokenizationCache:
+    """
+    整形した行ごとのTokenizer.parseの結果を(表層, 発音, 文節の先頭か)のリストとしてSQLiteに保存するキャッシュ。
+
+    キーには辞書やライブラリのバージョンから作るfingerprintを含めるので、辞書を更新すると使われなくなる。
+    WALモードで開くので、make_draftの--workersの各プロセスが同じファイルを同時に読み書きできる。
+    """
+
+    def __init__(self, path: str, fingerprint: str):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS tokenizations"
+            " (fingerprint TEXT NOT NULL, text TEXT NOT NULL, words TEXT NOT NULL,"
+            " PRIMARY KEY (fingerprint, text))"
+        )
+        self._connection.commit()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def get(self, text: str) -> list[tuple[str, str, bool]] | None:
+        row = self._connection.execute(
+            "SELECT words FROM tokenizations WHERE fingerprint = ? AND text = ?",
+            (self.fingerprint, text),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [
+            (surface, pronunciation, is_phrase_start)
+            for surface, pronunciation, is_phrase_start in json.loads(row[0])
+        ]
+
+    def put(self, text: str, words: list[tuple[str, str, bool]]) -> None:
+        # 他のプロセスが同じ行を先に保存していても、結果は同じなので無視する
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO tokenizations (fingerprint, text, words)"
+                " VALUES (?, ?, ?)",
+                (self.fingerprint, text, json.dumps(words, ensure_ascii=False)),
+            )
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def summary(self) -> str:
+        return (
+            f"tokenization cache: {self.hits} hits, {self.misses} misses ({self.path})"
+        )
@@ -38,6 +38,8 @@ def load_aligned_words(aligned_words_path: str) -> list[AlignedMora]:
             parody_mora=row["parody_mora"],
             is_parody_word_start=True,
             is_parody_word_end=True,
+            # n_best付きで出力したファイルでは2位以下の対応も含まれる
+            alignment_rank=row.get("alignment_rank", 0),
         )
         aligned_words.append(aligned_word)
     return aligned_words
@@ -45,9 +47,19 @@ def load_aligned_words(aligned_words_path: str) -> list[AlignedMora]:
 
 # 全体出力の確認用。あまり使わない。
 def count_conversion(aligned_words: list[AlignedMora]) -> dict[tuple, Counter]:
+    """
+    元歌詞のモウラごとに、対応する替え歌のモウラを数える。
+
+    n_best付きで出力したファイルの2位以下の対応(alignment_rank > 0)は数えずに捨てる。
+    順位やコストで重み付けはしないので、n_bestを指定しても数は最良の対応だけの時と同じになる。
+    create_phonetic_search_queriesの出現回数のしきい値も、最良の対応の回数として扱う。
+    """
     count_dict = defaultdict(Counter)
 
     for aligned_word in aligned_words:
+        # 最良の対応のみを数える
+        if aligned_word.alignment_rank > 0:
+            continue
         k = (
             aligned_word.original_mora,
             aligned_word.is_original_word_start,
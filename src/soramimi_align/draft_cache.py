@@ -0,0 +1,267 @@
+import array
+import hashlib
+import itertools
+import mmap
+import os
+import struct
+from collections.abc import Iterator
+
+from soramimi_align.schemas import AnalyzedLyrics, AnalyzedWordItem
+
+# ドラフトの横に置くキャッシュのファイル名の接尾辞
+DRAFT_CACHE_SUFFIX = ".analyzed"
+# 形式やドラフトの解析の結果を変えたら上げる
+DRAFT_CACHE_VERSION = 1
+
+_MAGIC = b"SADC"
+# magic, version, ドラフトのmtime_ns, ドラフトのサイズ, ドラフトのsha256,
+# 行の組の数, 単語の数, 発音候補の数, 文字列の数
+_HEADER = struct.Struct("=4sIqq32sIIII")
+# 単語ごとの(表層, 発音, フラグ, 発音候補の数)。表層と発音は文字列の表の番号
+_WORD_FIELD_NUM = 4
+_PHRASE_START_FLAG = 1
+
+LinePair = tuple[list[AnalyzedWordItem], list[AnalyzedWordItem]]
+
+
+def get_draft_cache_path(draft_path: str) -> str:
+    return draft_path + DRAFT_CACHE_SUFFIX
+
+
+def iter_line_pairs_from_file(
+    draft_path: str, use_cache: bool = True
+) -> Iterator[LinePair]:
+    """
+    ドラフトの(parodyの単語のリスト, originalの単語のリスト)を1組ずつ返す。
+
+    use_cacheなら、ドラフトの横のキャッシュが新しい時はmmapで読み、テキストを解析しない。
+    キャッシュが古いかない時はテキストを解析し、最後まで読んだらキャッシュを書き込む。
+    キャッシュはmtimeとサイズが同じなら新しいとみなし、違う時はドラフトのsha256で確かめる。
+    """
+    if not use_cache:
+        with open(draft_path, "r") as f:
+            yield from AnalyzedLyrics.iter_from_file(f)
+        return
+
+    cache_path = get_draft_cache_path(draft_path)
+    stat = os.stat(draft_path)
+    sha256: bytes | None = None
+    if os.path.exists(cache_path):
+        is_fresh, sha256 = _check_freshness(cache_path, draft_path, stat)
+        if is_fresh:
+            yield from _iter_cached_line_pairs(cache_path)
+            return
+    if sha256 is None:
+        sha256 = _file_sha256(draft_path)
+
+    builder = _DraftCacheBuilder()
+    with open(draft_path, "r") as f:
+        for line_pair in AnalyzedLyrics.iter_from_file(f):
+            builder.add_line_pair(*line_pair)
+            yield line_pair
+    try:
+        builder.write(cache_path, stat, sha256)
+    except OSError as e:
+        # 書き込めないディレクトリでも解析の結果は返せるので、キャッシュを諦める
+        print(f"警告: ドラフトのキャッシュを書き込めませんでした: {cache_path} {e}")
+
+
+def load_analyzed_lyrics(draft_path: str, use_cache: bool = True) -> AnalyzedLyrics:
+    """
+    ドラフトを読み込む。AnalyzedLyrics.from_textと同じ結果を、キャッシュが新しければ解析せずに返す。
+    """
+    analyzed_lyrics = AnalyzedLyrics(parody=[], original=[])
+    for parody_words, original_words in iter_line_pairs_from_file(
+        draft_path, use_cache
+    ):
+        analyzed_lyrics.parody.append(parody_words)
+        analyzed_lyrics.original.append(original_words)
+    return analyzed_lyrics
+
+
+def _file_sha256(path: str) -> bytes:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.digest()
+
+
+def _check_freshness(
+    cache_path: str, draft_path: str, stat: os.stat_result
+) -> tuple[bool, bytes | None]:
+    """
+    キャッシュが新しいかと、確かめるために計算したドラフトのsha256(計算していなければNone)を返す。
+    """
+    with open(cache_path, "rb") as f:
+        header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return False, None
+    magic, version, mtime_ns, size, cached_sha256, *counts = _HEADER.unpack(header)
+    if magic != _MAGIC or version != DRAFT_CACHE_VERSION or size != stat.st_size:
+        return False, None
+    if mtime_ns == stat.st_mtime_ns:
+        return True, None
+
+    sha256 = _file_sha256(draft_path)
+    if sha256 != cached_sha256:
+        return False, sha256
+    # 内容が同じなら、次からはsha256を計算せずに済むようにmtimeを更新する
+    try:
+        with open(cache_path, "r+b") as f:
+            f.write(
+                _HEADER.pack(magic, version, stat.st_mtime_ns, size, sha256, *counts)
+            )
+    except OSError:
+        pass
+    return True, sha256
+
+
+def _iter_cached_line_pairs(cache_path: str) -> Iterator[LinePair]:
+    with open(cache_path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    views = []
+    try:
+        (_, _, _, _, _, line_num, word_num, candidate_num, string_num) = (
+            _HEADER.unpack_from(mapped)
+        )
+        buffer = memoryview(mapped)
+        views.append(buffer)
+        offset = _HEADER.size
+
+        def take_int32(count: int) -> memoryview:
+            nonlocal offset
+            view = buffer[offset : offset + 4 * count].cast("i")
+            views.append(view)
+            offset += 4 * count
+            return view
+
+        line_word_nums = take_int32(2 * line_num)
+        words = take_int32(_WORD_FIELD_NUM * word_num)
+        candidates = take_int32(candidate_num)
+        string_offsets = take_int32(string_num + 1)
+        # 文字列の表はドラフトの単語の種類の数なので、まとめてデコードしておく
+        string_blob = bytes(buffer[offset:])
+        string_offsets = string_offsets.tolist()
+        strings = [
+            string_blob[start:end].decode("utf-8")
+            for start, end in itertools.pairwise(string_offsets)
+        ]
+
+        word_index = 0
+        candidate_index = 0
+        new_word = AnalyzedWordItem.__new__
+
+        def read_words(count: int) -> list[AnalyzedWordItem]:
+            nonlocal word_index, candidate_index
+            line_words = words[
+                _WORD_FIELD_NUM * word_index : _WORD_FIELD_NUM * (word_index + count)
+            ].tolist()
+            word_index += count
+            analyzed_words = []
+            for base in range(0, len(line_words), _WORD_FIELD_NUM):
+                surface_id, pronunciation_id, flags, word_candidate_num = line_words[
+                    base : base + _WORD_FIELD_NUM
+                ]
+                memo = None
+                if word_candidate_num > 0:
+                    memo = {
+                        "pronunciation_candidate_num": word_candidate_num,
+                        "pronunciation_candidates": [
+                            strings[string_id]
+                            for string_id in candidates[
+                                candidate_index : candidate_index + word_candidate_num
+                            ].tolist()
+                        ],
+                    }
+                    candidate_index += word_candidate_num
+                # 保存した発音は正規化済みなので、trustedの処理も省いて属性を直接設定する
+                word = new_word(AnalyzedWordItem)
+                word.surface = strings[surface_id]
+                word.pronunciation = strings[pronunciation_id]
+                word.is_phrase_start = bool(flags & _PHRASE_START_FLAG)
+                word._memo = memo
+                analyzed_words.append(word)
+            return analyzed_words
+
+        for line_index in range(line_num):
+            parody_words = read_words(line_word_nums[2 * line_index])
+            original_words = read_words(line_word_nums[2 * line_index + 1])
+            yield parody_words, original_words
+    finally:
+        # mmapを閉じる前に、mmapを参照しているmemoryviewを解放する
+        for view in reversed(views):
+            view.release()
+        mapped.close()
+
+
+class _DraftCacheBuilder:
+    """
+    解析した行の組を、文字列の表への番号とint32の配列に詰めていき、キャッシュのファイルに書き込む。
+    """
+
+    def __init__(self):
+        self._string_ids: dict[str, int] = {}
+        self._line_word_nums = array.array("i")
+        self._words = array.array("i")
+        self._candidates = array.array("i")
+
+    def _get_string_id(self, string: str) -> int:
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = len(self._string_ids)
+            self._string_ids[string] = string_id
+        return string_id
+
+    def _add_words(self, analyzed_words: list[AnalyzedWordItem]) -> None:
+        for word in analyzed_words:
+            candidates = word.get_memo("pronunciation_candidates", [])
+            self._words.extend(
+                [
+                    self._get_string_id(word.surface),
+                    self._get_string_id(word.pronunciation),
+                    _PHRASE_START_FLAG if word.is_phrase_start else 0,
+                    len(candidates),
+                ]
+            )
+            self._candidates.extend(
+                self._get_string_id(candidate) for candidate in candidates
+            )
+
+    def add_line_pair(
+        self,
+        parody_words: list[AnalyzedWordItem],
+        original_words: list[AnalyzedWordItem],
+    ) -> None:
+        self._line_word_nums.extend([len(parody_words), len(original_words)])
+        self._add_words(parody_words)
+        self._add_words(original_words)
+
+    def write(self, cache_path: str, stat: os.stat_result, sha256: bytes) -> None:
+        encoded_strings = [string.encode("utf-8") for string in self._string_ids]
+        string_offsets = array.array("i", [0])
+        for encoded_string in encoded_strings:
+            string_offsets.append(string_offsets[-1] + len(encoded_string))
+
+        # 他のプロセスが読んでいても壊れないように、一時ファイルに書いてから置き換える
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(
+                _HEADER.pack(
+                    _MAGIC,
+                    DRAFT_CACHE_VERSION,
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                    sha256,
+                    len(self._line_word_nums) // 2,
+                    len(self._words) // _WORD_FIELD_NUM,
+                    len(self._candidates),
+                    len(encoded_strings),
+                )
+            )
+            self._line_word_nums.tofile(f)
+            self._words.tofile(f)
+            self._candidates.tofile(f)
+            string_offsets.tofile(f)
+            f.write(b"".join(encoded_strings))
+        os.replace(tmp_path, cache_path)
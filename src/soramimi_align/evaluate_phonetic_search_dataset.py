@@ -13,6 +13,7 @@ from litellm import batch_completion
 from pydantic import BaseModel
 from tqdm import tqdm
 
+from soramimi_align.mora_table import MORA_TABLE
 from soramimi_align.schemas import PhoneticSearchDataset
 
 dotenv.load_dotenv()
@@ -47,19 +48,17 @@ def rank_by_mora_editdistance(
 def rank_by_vowel_consonant_editdistance(
     query_texts: list[str], wordlist_texts: list[str], vowel_ratio: float = 0.5
 ) -> list[list[str]]:
-    query_moras = [
-        jamorasep.parse(text, output_format="simple-ipa") for text in query_texts
-    ]
-    query_vowels = [[m[-1] for m in mora] for mora in query_moras]
+    query_mora_ids = [MORA_TABLE.encode(jamorasep.parse(text)) for text in query_texts]
+    query_vowels = [[MORA_TABLE.vowels[i] for i in ids] for ids in query_mora_ids]
     query_consonants = [
-        [m[:-1] if m[:-1] else "sp" for m in mora] for mora in query_moras
+        [MORA_TABLE.consonants[i] for i in ids] for ids in query_mora_ids
     ]
-    wordlist_moras = [
-        jamorasep.parse(text, output_format="simple-ipa") for text in wordlist_texts
+    wordlist_mora_ids = [
+        MORA_TABLE.encode(jamorasep.parse(text)) for text in wordlist_texts
     ]
-    wordlist_vowels = [[m[-1] for m in mora] for mora in wordlist_moras]
+    wordlist_vowels = [[MORA_TABLE.vowels[i] for i in ids] for ids in wordlist_mora_ids]
     wordlist_consonants = [
-        [m[:-1] if m[:-1] else "sp" for m in mora] for mora in wordlist_moras
+        [MORA_TABLE.consonants[i] for i in ids] for ids in wordlist_mora_ids
     ]
 
     filnal_results = []
@@ -1,35 +1,127 @@
+import concurrent.futures
+import contextlib
+import copy
 import glob
+import hashlib
+import importlib.metadata
+import io
 import json
 import os
 import re
+import sys
+import time
 import traceback
-from typing import Hashable
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import Any
 
 import alkana
 import jaconv
 import neologdn
-import pandas as pd
 import sudachipy
 from sudachipy import dictionary as sudachi_dictionary
 from sudachipy import tokenizer as sudachi_tokenizer
 
+from soramimi_align.athlete_table import load_athlete_table
+from soramimi_align.cache import TokenizationCache
 from soramimi_align.schemas import (
     AnalyzedLyrics,
     AnalyzedWordItem,
     AthleteName,
     AthleteParodyLyrics,
-    AthleteTableItem,
 )
 
 
+class SudachiTokenizerProvider:
+    """
+    SudachiのTokenizerを、初めて使う時に1回だけ作って共有する。
+
+    full辞書は読み込みに時間もメモリもかかるので、TokenizerとAthleteNameDetectorで同じものを使い、
+    使わなければ読み込まない。
+    """
+
+    def __init__(self, dict_type: str = "full"):
+        self.dict_type = dict_type
+        self.load_seconds: float | None = None
+        self._tokenizer_obj: sudachi_tokenizer.Tokenizer | None = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._tokenizer_obj is not None
+
+    def get(self) -> sudachi_tokenizer.Tokenizer:
+        if self._tokenizer_obj is None:
+            start = time.perf_counter()
+            self._tokenizer_obj = sudachi_dictionary.Dictionary(
+                dict=self.dict_type
+            ).create()
+            self.load_seconds = time.perf_counter() - start
+        return self._tokenizer_obj
+
+    def summary(self) -> str:
+        if self.load_seconds is None:
+            return f"sudachi dictionary ({self.dict_type}): not loaded"
+        return (
+            f"sudachi dictionary ({self.dict_type}): loaded in {self.load_seconds:.2f}s"
+        )
+
+
+# TokenizerとAthleteNameDetectorで共有する
+SUDACHI_TOKENIZER_PROVIDER = SudachiTokenizerProvider()
+
+
+# Tokenizer.parseの結果を変えたら上げる。TokenizationCacheのキーに含める
+TOKENIZER_VERSION = 1
+
+# Tokenizer.parseで再利用する行の数の上限。align_moraの_analyze_original_wordsと同じにする
+PARSE_CACHE_MAXSIZE = 4096
+
+
+def get_tokenizer_fingerprint(dict_type: str) -> str:
+    """
+    Tokenizer.parseの結果に影響する辞書とライブラリのバージョンをまとめた文字列を返す。
+    辞書を読み込まずに、インストールされているパッケージのバージョンから作る。
+    """
+    versions = [f"tokenizer={TOKENIZER_VERSION}", f"dict={dict_type}"]
+    for package in ["sudachipy", f"sudachidict_{dict_type}", "alkana", "neologdn"]:
+        try:
+            version = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            version = "unknown"
+        versions.append(f"{package}={version}")
+    return ",".join(versions)
+
+
 class Tokenizer:
-    def __init__(self):
-        self.tokenizer_obj = sudachi_dictionary.Dictionary(dict="full").create()
+    def __init__(
+        self,
+        sudachi_provider: SudachiTokenizerProvider | None = None,
+        tokenization_cache_path: str | None = None,
+    ):
+        self.sudachi_provider = sudachi_provider or SUDACHI_TOKENIZER_PROVIDER
+        # 指定すると、parseの結果を実行をまたいでファイルに保存する
+        self.tokenization_cache = None
+        if tokenization_cache_path is not None:
+            self.tokenization_cache = TokenizationCache(
+                tokenization_cache_path,
+                get_tokenizer_fingerprint(self.sudachi_provider.dict_type),
+            )
         self.mode = sudachi_tokenizer.Tokenizer.SplitMode.A
         self.code_regex = re.compile(
             "[!\"#$%&'\\\\()*+,-./:;<=>?@[\\]^_`{|}~「」〔〕"
             "＆＊・（）＄＃＠。、？！｀＋￥％]"
         )
+        # 同じ原曲は何度も替え歌にされるので、整形後の行ごとにparseの結果を再利用する。
+        # 最後に使ってから時間が経った行から捨てる
+        self.parse_cache_maxsize = PARSE_CACHE_MAXSIZE
+        self._parse_cache: OrderedDict[str, list[AnalyzedWordItem]] = OrderedDict()
+        self.parse_cache_hits = 0
+        self.parse_cache_misses = 0
+
+    @property
+    def tokenizer_obj(self) -> sudachi_tokenizer.Tokenizer:
+        return self.sudachi_provider.get()
 
     def format_text(self, text: str) -> str:
         # 単語のスペースを一時的に別の文字に変換。neologdnがスペースを削除するため
@@ -41,7 +133,9 @@ class Tokenizer:
         return text
 
     def tokenize(self, text: str) -> list[sudachipy.Morpheme]:
-        text = self.format_text(text)
+        return self._tokenize_formatted_text(self.format_text(text))
+
+    def _tokenize_formatted_text(self, text: str) -> list[sudachipy.Morpheme]:
         tokens = self.tokenizer_obj.tokenize(text, self.mode)
         tokens = [
             token
@@ -63,7 +157,58 @@ class Tokenizer:
         return reading_form
 
     def parse(self, text: str) -> list[AnalyzedWordItem]:
-        tokens = self.tokenize(text)
+        formatted_text = self.format_text(text)
+        results = self._parse_cache.get(formatted_text)
+        if results is None:
+            self.parse_cache_misses += 1
+            results = self._parse_formatted_text_with_cache(formatted_text)
+            self._parse_cache[formatted_text] = results
+            if len(self._parse_cache) > self.parse_cache_maxsize:
+                self._parse_cache.popitem(last=False)
+        else:
+            self.parse_cache_hits += 1
+            self._parse_cache.move_to_end(formatted_text)
+        # 呼び出し側で書き換えてもキャッシュに影響しないように複製して返す
+        return [copy.copy(word_token) for word_token in results]
+
+    def parse_cache_summary(self) -> str:
+        return (
+            f"tokenizer cache: {self.parse_cache_hits} hits,"
+            f" {self.parse_cache_misses} misses"
+        )
+
+    def _parse_formatted_text_with_cache(self, text: str) -> list[AnalyzedWordItem]:
+        """
+        tokenization_cacheにあれば、Sudachiを使わずに保存した結果を返す。
+        """
+        if self.tokenization_cache is None:
+            return self._parse_formatted_text(text)
+        words = self.tokenization_cache.get(text)
+        if words is not None:
+            return [
+                AnalyzedWordItem.trusted(
+                    surface=surface,
+                    pronunciation=pronunciation,
+                    is_phrase_start=is_phrase_start,
+                )
+                for surface, pronunciation, is_phrase_start in words
+            ]
+        results = self._parse_formatted_text(text)
+        self.tokenization_cache.put(
+            text,
+            [
+                (
+                    word_token.surface,
+                    word_token.pronunciation,
+                    word_token.is_phrase_start,
+                )
+                for word_token in results
+            ],
+        )
+        return results
+
+    def _parse_formatted_text(self, text: str) -> list[AnalyzedWordItem]:
+        tokens = self._tokenize_formatted_text(text)
         results = []
         for i, token in enumerate(tokens):
             surface = token.surface()
@@ -75,7 +220,7 @@ class Tokenizer:
 
             # surfaceからスペースを無くす
             surface = "_".join(surface.split())
-            word_token = AnalyzedWordItem(
+            word_token = AnalyzedWordItem.trusted(
                 surface=surface,
                 pronunciation=pronunciation,
                 is_phrase_start=is_phrase_start,
@@ -110,74 +255,35 @@ class Tokenizer:
 
 
 class AthleteNameDetector:
-    def __init__(self, athlete_table_path: str):
-        self.athlete_table_items = self._load_athlete_table(athlete_table_path)
-        self.surface_to_id_dict = self._create_surface_to_id_dict(
-            self.athlete_table_items
-        )
-        self.id_to_pronunciation_dict = self._create_id_to_pronunciation_dict(
-            self.athlete_table_items
+    def __init__(
+        self,
+        athlete_table_path: str,
+        sudachi_provider: SudachiTokenizerProvider | None = None,
+        use_athlete_table_index: bool = False,
+    ):
+        # use_athlete_table_indexなら、選手の表の横に保存したインデックスを使う
+        athlete_table = load_athlete_table(
+            athlete_table_path, use_index=use_athlete_table_index
         )
-        self.tokenizer_obj = sudachi_dictionary.Dictionary(dict="full").create()
+        self.surface_to_id_dict = athlete_table.surface_to_id_dict
+        self.id_to_pronunciation_dict = athlete_table.id_to_pronunciation_dict
+        # get_ids_from_surfaceの部分一致の検索に使う
+        self.surface_index = athlete_table.surface_index
+        # 辞書はget_pronunciation_by_sudachiを初めて呼んだ時に読み込む
+        self.sudachi_provider = sudachi_provider or SUDACHI_TOKENIZER_PROVIDER
         self.mode = sudachi_tokenizer.Tokenizer.SplitMode.A
 
-    def _load_athlete_table(self, athlete_table_path: str) -> list[AthleteTableItem]:
-        athlete_table_df = pd.read_csv(athlete_table_path)
-        athlete_table_items = []
-        for index, row in athlete_table_df.iterrows():
-            # pronunciationはカタカナのみにする
-            pronunciation = "".join(row["pronunciation"].split()).replace("・", "")
-            athlete_table_items.append(
-                AthleteTableItem(
-                    id=row["id"],
-                    original=row["original"],
-                    surface=row["surface"],
-                    pronunciation=pronunciation,
-                )
-            )
-        return athlete_table_items
-
-    def _create_surface_to_id_dict(
-        self, athlete_table_items: list[AthleteTableItem]
-    ) -> dict[str, set[int]]:
-        surface_to_id_dict = {}
-        for athlete_table_item in athlete_table_items:
-            if athlete_table_item.original not in surface_to_id_dict:
-                surface_to_id_dict[athlete_table_item.original] = set()
-            surface_to_id_dict[athlete_table_item.original].add(athlete_table_item.id)
-
-            if athlete_table_item.surface not in surface_to_id_dict:
-                surface_to_id_dict[athlete_table_item.surface] = set()
-            surface_to_id_dict[athlete_table_item.surface].add(athlete_table_item.id)
-        return surface_to_id_dict
-
-    def _create_id_to_pronunciation_dict(
-        self, athlete_table_items: list[AthleteTableItem]
-    ) -> dict[Hashable, dict[str, set[str]]]:
-        id_to_pronunciation_dict = {}
-        for athlete_table_item in athlete_table_items:
-            if athlete_table_item.id not in id_to_pronunciation_dict:
-                id_to_pronunciation_dict[athlete_table_item.id] = {}
-            if (
-                athlete_table_item.surface
-                not in id_to_pronunciation_dict[athlete_table_item.id]
-            ):
-                id_to_pronunciation_dict[athlete_table_item.id][
-                    athlete_table_item.surface
-                ] = set()
-            id_to_pronunciation_dict[athlete_table_item.id][
-                athlete_table_item.surface
-            ].add(athlete_table_item.pronunciation)
-        return id_to_pronunciation_dict
+    @property
+    def tokenizer_obj(self) -> sudachi_tokenizer.Tokenizer:
+        return self.sudachi_provider.get()
 
     def get_ids_from_surface(self, surface: str) -> set[int]:
         # 完全一致で検索
         ids = self.surface_to_id_dict.get(surface, set())
-        # 完全一致がなければ部分一致で検索
+        # 完全一致がなければ部分一致で検索。surface_to_id_dictの順に集めるのは以前と同じ
         if not ids:
-            for k, v in self.surface_to_id_dict.items():
-                if surface in k:
-                    ids.update(v)
+            for k in self.surface_index.find(surface):
+                ids.update(self.surface_to_id_dict[k])
         return ids
 
     def _format_name(self, name: str) -> str:
@@ -206,6 +312,32 @@ class AthleteNameDetector:
         for name in names:
             formatted_names.append(self._format_name(name))
         self.athlete_names = formatted_names
+        self.athlete_name_pronunciations = self._create_athlete_name_pronunciations(
+            formatted_names
+        )
+        # 曲の中で同じ名前は何度も出てくるので、読みの候補を曲ごとに再利用する
+        self._pronunciation_candidates_cache: dict[
+            tuple[str, str, str, str], tuple[set[str], str]
+        ] = {}
+
+    def _create_athlete_name_pronunciations(
+        self, athlete_names: list[str]
+    ) -> dict[str, list[tuple[str, set[str]]]]:
+        """
+        曲の選手一覧の名前に含まれる選手の表の表層から、(選手一覧の名前, その表層の読み)のリストへの辞書を作る。
+        リストは選手一覧の順に並べるので、選手一覧を走査して読みを集めた時と同じ順に読みを集められる。
+        """
+        athlete_name_pronunciations = {}
+        for athlete_name in athlete_names:
+            for id in self.get_ids_from_surface(athlete_name):
+                for surface, pronunciations in self.id_to_pronunciation_dict[
+                    id
+                ].items():
+                    if surface in athlete_name:
+                        athlete_name_pronunciations.setdefault(surface, []).append(
+                            (athlete_name, pronunciations)
+                        )
+        return athlete_name_pronunciations
 
     def get_pronunciation_candidates(self, name: AthleteName) -> tuple[set[str], str]:
         """
@@ -217,40 +349,42 @@ class AthleteNameDetector:
         Returns:
             set[str]: _description_
         """
+        cache_key = (
+            name.pre_silent_surface,
+            name.pronounced_surface,
+            name.post_silent_surface,
+            name.pronunciation,
+        )
+        cached = self._pronunciation_candidates_cache.get(cache_key)
+        if cached is None:
+            cached = self._get_pronunciation_candidates(name)
+            self._pronunciation_candidates_cache[cache_key] = cached
+        pronunciation_candidates, method = cached
+        if len(pronunciation_candidates) > 1:
+            print(method, name, pronunciation_candidates)
+        return pronunciation_candidates, method
+
+    def _get_pronunciation_candidates(self, name: AthleteName) -> tuple[set[str], str]:
         pronunciation_candidates = set()
         method = "athlete_names_full_surface"
-        for athlete_name in self.athlete_names:
+        # 無音の部分も含めて選手一覧の名前に含まれる場合
+        for athlete_name, pronunciations in self.athlete_name_pronunciations.get(
+            name.pronounced_surface, []
+        ):
             if (
                 name.pre_silent_surface in athlete_name
                 and name.post_silent_surface in athlete_name
-                and name.pronounced_surface in athlete_name
             ):
-                ids = self.get_ids_from_surface(athlete_name)
-                for id in ids:
-                    pronunciation_candidates.update(
-                        self.id_to_pronunciation_dict[id].get(
-                            name.pronounced_surface, set()
-                        )
-                    )
-                # if "哲" in name.pronounced_surface:
-                #    print(name, player_name)
-                #    print(id_candidates)
+                pronunciation_candidates.update(pronunciations)
 
         if (
             not pronunciation_candidates
             and not name.pre_silent_surface
             and not name.post_silent_surface
         ):
+            # 発音する部分だけが選手一覧の名前に含まれる場合。
+            # 無音の部分がなければ上と同じ条件なので、読みの候補は見つからない
             method = "athlete_names_pronounced_surface"
-            for athlete_name in self.athlete_names:
-                if name.pronounced_surface in athlete_name:
-                    ids = self.get_ids_from_surface(athlete_name)
-                    for id in ids:
-                        pronunciation_candidates.update(
-                            self.id_to_pronunciation_dict[id].get(
-                                name.pronounced_surface, set()
-                            )
-                        )
         if not pronunciation_candidates:
             method = "athlete_table"
             ids = self.get_ids_from_surface(name.pronounced_surface)
@@ -274,8 +408,6 @@ class AthleteNameDetector:
             pronunciation_candidates.add(
                 self.get_pronunciation_by_sudachi(name.pronounced_surface)
             )
-        if len(pronunciation_candidates) > 1:
-            print(method, name, pronunciation_candidates)
         return pronunciation_candidates, method
 
     def get_pronunciation_by_sudachi(self, text: str) -> str:
@@ -328,7 +460,7 @@ def parse_lyrics(
             # pronunciation = "".join(pronunciation.split()).replace("・", "")
 
             analyzed_parody_line.append(
-                AnalyzedWordItem(
+                AnalyzedWordItem.trusted(
                     surface=name.pronounced_surface,
                     pronunciation=pronunciation,
                     memo=memo,
@@ -338,7 +470,7 @@ def parse_lyrics(
         original_tokens = tokenizer.parse(original_line)
         for original_token in original_tokens:
             analyzed_original_line.append(
-                AnalyzedWordItem(
+                AnalyzedWordItem.trusted(
                     surface=original_token.surface,
                     pronunciation=original_token.pronunciation,
                     is_phrase_start=original_token.is_phrase_start,
@@ -361,14 +493,19 @@ def summarize_parsed_lyrics(parsed_lyrics: AnalyzedLyrics) -> str:
         parody_word_pronunciations = []
         for word in analyzed_parody_line:
             pronunciation = word.pronunciation
-            if word.memo.get("method") == "sudachi":
-                pronunciation += "/sudachi"
-                print(f"sudachi: {word}")
-            if int(word.memo.get("pronunciation_candidate_num", 0)) > 1:
-                pronunciation += f"/{word.memo.get('pronunciation_candidates')}"
+            if int(word.get_memo("pronunciation_candidate_num", 0)) > 1:
+                # 候補はアラインメントでまとめて扱えるように`候補1|候補2`の形式で書く
+                pronunciation = "|".join(
+                    dict.fromkeys(
+                        [pronunciation] + word.get_memo("pronunciation_candidates")
+                    )
+                )
                 print(
-                    f"{word.memo.get('pronunciation_candidate_num')} candidate: {word}"
+                    f"{word.get_memo('pronunciation_candidate_num')} candidate: {word}"
                 )
+            if word.get_memo("method") == "sudachi":
+                pronunciation += "/sudachi"
+                print(f"sudachi: {word}")
             parody_word_pronunciations.append(pronunciation)
         original_word_surfaces = [word.surface for word in analyzed_original_line]
         # 空白を含んだ表層があるとpronunciationと要素数が合わなくなるので、表層の空白をハイフンに変換
@@ -393,6 +530,321 @@ def summarize_parsed_lyrics(parsed_lyrics: AnalyzedLyrics) -> str:
     return full_text
 
 
+class ErrataReplacer:
+    """
+    誤りを修正する辞書のすべての項目を、テキストを1回走査して置換する。
+
+    キーの文字のトライを正規表現にして探すので、同じ位置から始まるキーは最も長いものを使う。
+    項目を順にreplaceする場合と違い、置換した結果をさらに別の項目で置換することはない。
+    """
+
+    def __init__(self, errata_dict: dict[str, str]):
+        # 空のキーは置換できないので除く
+        self.errata_dict = {k: v for k, v in errata_dict.items() if k}
+        self._pattern = None
+        if self.errata_dict:
+            self._pattern = re.compile(self._build_trie_pattern(self.errata_dict))
+
+    @classmethod
+    def from_file(cls, errata_dict_path: str) -> "ErrataReplacer":
+        with open(errata_dict_path, "r") as f:
+            return cls(json.load(f))
+
+    def replace(self, text: str) -> str:
+        if self._pattern is None:
+            return text
+        return self._pattern.sub(lambda match: self.errata_dict[match[0]], text)
+
+    @classmethod
+    def _build_trie_pattern(cls, keys: Iterable[str]) -> str:
+        trie: dict[str, dict] = {}
+        for key in keys:
+            node = trie
+            for char in key:
+                node = node.setdefault(char, {})
+            # キーの終わりの印
+            node[""] = {}
+        return cls._trie_node_pattern(trie)
+
+    @classmethod
+    def _trie_node_pattern(cls, node: dict[str, dict]) -> str:
+        alternatives = [
+            re.escape(char) + cls._trie_node_pattern(child)
+            for char, child in node.items()
+            if char != ""
+        ]
+        if not alternatives:
+            return ""
+        pattern = "(?:" + "|".join(alternatives) + ")"
+        if "" in node:
+            # ここで終わるキーもある。?は貪欲なので、より長いキーに一致すればそちらを使う
+            pattern += "?"
+        return pattern
+
+
+@dataclass
+class DraftFileOptions:
+    pre_errata_replacer: ErrataReplacer | None = None
+    post_errata_replacer: ErrataReplacer | None = None
+    check_only: bool = False
+    force: bool = False
+    verbose: bool = False
+
+
+@dataclass
+class DraftFileReport:
+    stdout: str
+    stderr: str
+    # "rebuilt", "skipped", "failed", check_onlyなら"checked"。
+    # --incrementalでは、記録がないドラフトを"untracked"、記録したドラフトを"adopted"とする
+    status: str = ""
+    parse_cache_hits: int = 0
+    parse_cache_misses: int = 0
+    tokenization_cache_hits: int = 0
+    tokenization_cache_misses: int = 0
+
+
+def make_draft_file(
+    file_path: str,
+    output_file_path: str,
+    athlete_name_detector: AthleteNameDetector,
+    tokenizer: Tokenizer,
+    options: DraftFileOptions,
+) -> DraftFileReport:
+    """
+    ディレクトリの1つの歌詞ファイルからドラフトを作る。
+
+    並列に処理しても表示が混ざらないように、処理中に表示する内容は
+    ファイルごとにまとめて返し、print_draft_file_reportで表示する。
+    """
+    parse_cache_hits = tokenizer.parse_cache_hits
+    parse_cache_misses = tokenizer.parse_cache_misses
+    tokenization_cache_hits, tokenization_cache_misses = _tokenization_cache_counts(
+        tokenizer
+    )
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    status = "checked"
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        print(file_path, end="")
+        try:
+            with open(file_path, "r") as f:
+                text = f.read()
+            if options.pre_errata_replacer is not None:
+                text = options.pre_errata_replacer.replace(text)
+            lyrics = AthleteParodyLyrics.from_text(text)
+            parsed_lyrics = parse_lyrics(lyrics, athlete_name_detector, tokenizer)
+            summary = summarize_parsed_lyrics(parsed_lyrics)
+            if options.post_errata_replacer is not None:
+                summary = options.post_errata_replacer.replace(summary)
+            if not options.check_only:
+                if os.path.exists(output_file_path) and not options.force:
+                    print(" skip")
+                    status = "skipped"
+                else:
+                    print(" write")
+                    with open(output_file_path, "w") as f:
+                        f.write(summary)
+                    status = "rebuilt"
+            warning_summary = parsed_lyrics.summarize_warnings(file_path)
+            if warning_summary:
+                print(warning_summary)
+        except Exception as e:
+            print(f"Error:{e}")
+            if options.verbose:
+                traceback.print_exc()
+            status = "failed"
+    return DraftFileReport(
+        stdout=stdout.getvalue(),
+        stderr=stderr.getvalue(),
+        status=status,
+        parse_cache_hits=tokenizer.parse_cache_hits - parse_cache_hits,
+        parse_cache_misses=tokenizer.parse_cache_misses - parse_cache_misses,
+        tokenization_cache_hits=_tokenization_cache_counts(tokenizer)[0]
+        - tokenization_cache_hits,
+        tokenization_cache_misses=_tokenization_cache_counts(tokenizer)[1]
+        - tokenization_cache_misses,
+    )
+
+
+def _tokenization_cache_counts(tokenizer: Tokenizer) -> tuple[int, int]:
+    if tokenizer.tokenization_cache is None:
+        return 0, 0
+    return tokenizer.tokenization_cache.hits, tokenizer.tokenization_cache.misses
+
+
+def print_draft_file_report(report: DraftFileReport) -> None:
+    sys.stdout.write(report.stdout)
+    sys.stdout.flush()
+    sys.stderr.write(report.stderr)
+    sys.stderr.flush()
+
+
+def format_draft_status_summary(statuses: list[tuple[str, str]]) -> str:
+    """
+    (入力のファイル, DraftFileReport.status)のリストから、作り直した・飛ばした・失敗したファイルの数と、
+    失敗したファイルと記録がないドラフトの入力の一覧を作る。
+    """
+    counts = {"rebuilt": 0, "skipped": 0, "failed": 0}
+    for _, status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    lines = [
+        "drafts: " + ", ".join(f"{count} {status}" for status, count in counts.items())
+    ]
+    lines.extend(
+        f"  {status}: {file_path}"
+        for file_path, status in statuses
+        if status in ("failed", "untracked")
+    )
+    return "\n".join(lines)
+
+
+# make_draftの出力ディレクトリに置く、入力とドラフトの対応を記録するファイル
+DRAFT_MANIFEST_FILE_NAME = ".make_draft_manifest.json"
+# 形式を変えたら上げる
+DRAFT_MANIFEST_VERSION = 1
+
+
+def _file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def get_draft_dependencies_sha256(
+    word_dict_path: str,
+    pre_errata_dict_path: str | None,
+    post_errata_dict_path: str | None,
+    dict_type: str,
+) -> str:
+    """
+    すべてのドラフトに影響する、選手の表と誤りを修正する辞書の内容、辞書やライブラリのバージョンのハッシュを返す。
+    """
+    sha256 = hashlib.sha256()
+    sha256.update(f"manifest={DRAFT_MANIFEST_VERSION}\n".encode())
+    sha256.update(f"{get_tokenizer_fingerprint(dict_type)}\n".encode())
+    for path in [word_dict_path, pre_errata_dict_path, post_errata_dict_path]:
+        file_sha256 = _file_sha256(path) if path else "none"
+        sha256.update(f"{file_sha256}\n".encode())
+    return sha256.hexdigest()
+
+
+class DraftManifest:
+    """
+    ドラフトごとに、作った時の入力のファイルのハッシュとすべてのドラフトに共通する入力のハッシュ、
+    書き込んだドラフトのハッシュを記録する。
+
+    入力が変わったドラフトだけを作り直すのに使う。
+    記録と違う内容のドラフトは手で修正したものとみなし、上書きしない。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dependencies_sha256: str,
+        entries: dict[str, dict[str, str]] | None = None,
+    ):
+        self.path = path
+        self.dependencies_sha256 = dependencies_sha256
+        # ドラフトのパスから、input_path, input_sha256, dependencies_sha256, output_sha256への辞書
+        self.entries = entries if entries is not None else {}
+        self._input_sha256s: dict[str, str] = {}
+
+    @classmethod
+    def load(cls, path: str, dependencies_sha256: str) -> "DraftManifest":
+        entries = None
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == DRAFT_MANIFEST_VERSION:
+                entries = manifest["entries"]
+        return cls(path, dependencies_sha256, entries)
+
+    def _get_input_sha256(self, input_path: str) -> str:
+        input_sha256 = self._input_sha256s.get(input_path)
+        if input_sha256 is None:
+            input_sha256 = _file_sha256(input_path)
+            self._input_sha256s[input_path] = input_sha256
+        return input_sha256
+
+    def is_untracked(self, output_path: str) -> bool:
+        """
+        ドラフトがあるのに記録がなければTrueを返す。
+        """
+        return os.path.exists(output_path) and output_path not in self.entries
+
+    def get_skip_reason(self, input_path: str, output_path: str) -> str | None:
+        """
+        ドラフトを作り直さなくてよければその理由を、作り直すならNoneを返す。
+        """
+        if not os.path.exists(output_path):
+            return None
+        entry = self.entries.get(output_path)
+        if entry is None:
+            return (
+                "記録がないドラフトなので上書きしません。"
+                "作り直すには--force、今のドラフトを記録するには--adopt_existing"
+            )
+        if _file_sha256(output_path) != entry["output_sha256"]:
+            return "ドラフトが手で修正されているので上書きしません。作り直すには--force"
+        if (
+            entry["input_path"] == input_path
+            and entry["input_sha256"] == self._get_input_sha256(input_path)
+            and entry["dependencies_sha256"] == self.dependencies_sha256
+        ):
+            return "入力が変わっていません"
+        return None
+
+    def record(self, input_path: str, output_path: str) -> None:
+        self.entries[output_path] = {
+            "input_path": input_path,
+            "input_sha256": self._get_input_sha256(input_path),
+            "dependencies_sha256": self.dependencies_sha256,
+            "output_sha256": _file_sha256(output_path),
+        }
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"version": DRAFT_MANIFEST_VERSION, "entries": self.entries},
+                f,
+                ensure_ascii=False,
+                indent=1,
+            )
+        os.replace(tmp_path, self.path)
+
+
+# --workersで使うプロセスごとの状態。_init_draft_workerで1回だけ作る
+_worker_state: dict[str, Any] = {}
+
+
+def _init_draft_worker(
+    word_dict_path: str,
+    options: DraftFileOptions,
+    tokenization_cache_path: str | None = None,
+    use_athlete_table_index: bool = False,
+) -> None:
+    _worker_state["athlete_name_detector"] = AthleteNameDetector(
+        word_dict_path, use_athlete_table_index=use_athlete_table_index
+    )
+    _worker_state["tokenizer"] = Tokenizer(
+        tokenization_cache_path=tokenization_cache_path
+    )
+    _worker_state["options"] = options
+
+
+def _make_draft_file_in_worker(
+    file_path: str, output_file_path: str
+) -> DraftFileReport:
+    return make_draft_file(
+        file_path,
+        output_file_path,
+        _worker_state["athlete_name_detector"],
+        _worker_state["tokenizer"],
+        _worker_state["options"],
+    )
+
+
 def main():
     import argparse
 
@@ -426,6 +878,33 @@ def main():
         action="store_true",
         help="出力ファイルが既に存在しても上書きするフラグ",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="ディレクトリを入力した時に、並列にドラフトを作るプロセス数",
+    )
+    parser.add_argument(
+        "--tokenization_cache_path",
+        type=str,
+        default=None,
+        help="原曲の行の解析結果を保存するキャッシュのファイル。指定しなければ保存しない",
+    )
+    parser.add_argument(
+        "--athlete_table_index",
+        action="store_true",
+        help="選手の表から作ったインデックスを選手の表の横に保存し、次からはCSVを読まずに使うフラグ",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="ディレクトリを入力した時に、入力や選手の表、誤りを修正する辞書が変わったドラフトだけを作り直すフラグ",
+    )
+    parser.add_argument(
+        "--adopt_existing",
+        action="store_true",
+        help="--incrementalで、記録がない既存のドラフトを作り直さずに今の入力から作ったものとして記録するフラグ",
+    )
     args = parser.parse_args()
 
     if not args.output_file:
@@ -434,35 +913,37 @@ def main():
         elif os.path.isdir(args.input_file):
             args.output_file = "output"
 
-    athlete_name_detector = AthleteNameDetector(args.word_dict_path)
-    tokenizer = Tokenizer()
+    # --workersの各プロセスが読む前に、インデックスを作り直しておく
+    athlete_name_detector = AthleteNameDetector(
+        args.word_dict_path, use_athlete_table_index=args.athlete_table_index
+    )
+    tokenizer = Tokenizer(tokenization_cache_path=args.tokenization_cache_path)
 
     if args.pre_errata_dict_path:
-        with open(args.pre_errata_dict_path, "r") as f:
-            pre_errata_dict = json.load(f)
+        pre_errata_replacer = ErrataReplacer.from_file(args.pre_errata_dict_path)
     else:
-        pre_errata_dict = None
+        pre_errata_replacer = None
 
     if args.post_errata_dict_path:
-        with open(args.post_errata_dict_path, "r") as f:
-            post_errata_dict = json.load(f)
+        post_errata_replacer = ErrataReplacer.from_file(args.post_errata_dict_path)
     else:
-        post_errata_dict = None
+        post_errata_replacer = None
 
     if os.path.isfile(args.input_file):
         with open(args.input_file, "r") as f:
             text = f.read()
 
-        if pre_errata_dict:
-            for k, v in pre_errata_dict.items():
-                text = text.replace(k, v)
+        if pre_errata_replacer is not None:
+            text = pre_errata_replacer.replace(text)
         # print(text)
         lyrics = AthleteParodyLyrics.from_text(text)
         parsed_lyrics = parse_lyrics(lyrics, athlete_name_detector, tokenizer)
+        warning_summary = parsed_lyrics.summarize_warnings(args.input_file)
+        if warning_summary:
+            print(warning_summary)
         summary = summarize_parsed_lyrics(parsed_lyrics)
-        if post_errata_dict:
-            for k, v in post_errata_dict.items():
-                summary = summary.replace(k, v)
+        if post_errata_replacer is not None:
+            summary = post_errata_replacer.replace(summary)
         os.makedirs(os.path.dirname(args.output_file), exist_ok=True)
         with open(args.output_file, "w") as f:
             f.write(summary)
@@ -472,35 +953,118 @@ def main():
             os.path.join(args.input_file, "**", "*.txt"), recursive=True
         )
         txt_files.sort()
-        # for file_path in tqdm.tqdm(txt_files):
-        for file_path in txt_files:
-            output_file_path = os.path.join(
-                args.output_file, os.path.basename(file_path)
+        output_file_paths = [
+            os.path.join(args.output_file, os.path.basename(file_path))
+            for file_path in txt_files
+        ]
+        options = DraftFileOptions(
+            pre_errata_replacer=pre_errata_replacer,
+            post_errata_replacer=post_errata_replacer,
+            check_only=args.check_only,
+            force=args.force,
+            verbose=args.verbose,
+        )
+        manifest = None
+        # 入力のファイルから、作り直さないドラフトの(status, 理由)への辞書
+        skip_reasons = {}
+        if args.incremental and not args.check_only:
+            manifest = DraftManifest.load(
+                os.path.join(args.output_file, DRAFT_MANIFEST_FILE_NAME),
+                get_draft_dependencies_sha256(
+                    args.word_dict_path,
+                    args.pre_errata_dict_path,
+                    args.post_errata_dict_path,
+                    tokenizer.sudachi_provider.dict_type,
+                ),
             )
-            print(file_path, end="")
-            try:
-                with open(file_path, "r") as f:
-                    text = f.read()
-                if pre_errata_dict:
-                    for k, v in pre_errata_dict.items():
-                        text = text.replace(k, v)
-                lyrics = AthleteParodyLyrics.from_text(text)
-                parsed_lyrics = parse_lyrics(lyrics, athlete_name_detector, tokenizer)
-                summary = summarize_parsed_lyrics(parsed_lyrics)
-                if post_errata_dict:
-                    for k, v in post_errata_dict.items():
-                        summary = summary.replace(k, v)
-                if not args.check_only:
-                    if os.path.exists(output_file_path) and not args.force:
-                        print(" skip")
+            if not args.force:
+                for file_path, output_file_path in zip(txt_files, output_file_paths):
+                    if args.adopt_existing and manifest.is_untracked(output_file_path):
+                        manifest.record(file_path, output_file_path)
+                        skip_reasons[file_path] = ("adopted", "記録しました")
+                        continue
+                    skip_reason = manifest.get_skip_reason(file_path, output_file_path)
+                    if skip_reason is None:
+                        continue
+                    if manifest.is_untracked(output_file_path):
+                        skip_reasons[file_path] = ("untracked", skip_reason)
                     else:
-                        print(" write")
-                        with open(output_file_path, "w") as f:
-                            f.write(summary)
-            except Exception as e:
-                print(f"Error:{e}")
-                if args.verbose:
-                    traceback.print_exc()
+                        skip_reasons[file_path] = ("skipped", skip_reason)
+            # 作り直すと決めたドラフトは上書きする
+            options.force = True
+        pending_files = [
+            (file_path, output_file_path)
+            for file_path, output_file_path in zip(txt_files, output_file_paths)
+            if file_path not in skip_reasons
+        ]
+
+        statuses = []
+        with contextlib.ExitStack() as stack:
+            if args.workers > 1:
+                executor = stack.enter_context(
+                    concurrent.futures.ProcessPoolExecutor(
+                        max_workers=args.workers,
+                        initializer=_init_draft_worker,
+                        initargs=(
+                            args.word_dict_path,
+                            options,
+                            args.tokenization_cache_path,
+                            args.athlete_table_index,
+                        ),
+                    )
+                )
+                # 表示はファイルの順に、処理し終わったものから出す
+                reports = executor.map(
+                    _make_draft_file_in_worker,
+                    [file_path for file_path, _ in pending_files],
+                    [output_file_path for _, output_file_path in pending_files],
+                )
+            else:
+                # for file_path in tqdm.tqdm(txt_files):
+                reports = (
+                    make_draft_file(
+                        file_path,
+                        output_file_path,
+                        athlete_name_detector,
+                        tokenizer,
+                        options,
+                    )
+                    for file_path, output_file_path in pending_files
+                )
+            try:
+                for file_path, output_file_path in zip(txt_files, output_file_paths):
+                    if file_path in skip_reasons:
+                        status, skip_reason = skip_reasons[file_path]
+                        print(f"{file_path} skip ({skip_reason})")
+                        statuses.append((file_path, status))
+                        continue
+                    report = next(reports)
+                    print_draft_file_report(report)
+                    statuses.append((file_path, report.status))
+                    if manifest is not None and report.status == "rebuilt":
+                        manifest.record(file_path, output_file_path)
+                    if args.workers > 1:
+                        tokenizer.parse_cache_hits += report.parse_cache_hits
+                        tokenizer.parse_cache_misses += report.parse_cache_misses
+                        if tokenizer.tokenization_cache is not None:
+                            tokenizer.tokenization_cache.hits += (
+                                report.tokenization_cache_hits
+                            )
+                            tokenizer.tokenization_cache.misses += (
+                                report.tokenization_cache_misses
+                            )
+            finally:
+                # 途中で止めても、それまでに作ったドラフトは記録しておく
+                if manifest is not None:
+                    manifest.save()
+        print(format_draft_status_summary(statuses))
+    print(tokenizer.parse_cache_summary())
+    if tokenizer.tokenization_cache is not None:
+        tokenizer.tokenization_cache.close()
+        print(tokenizer.tokenization_cache.summary())
+    # --workersでは辞書は各プロセスで読み込むので、このプロセスの状態は表示しない
+    if SUDACHI_TOKENIZER_PROVIDER.is_loaded or args.workers <= 1:
+        print(SUDACHI_TOKENIZER_PROVIDER.summary())
 
 
 if __name__ == "__main__":
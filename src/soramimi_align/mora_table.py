@@ -0,0 +1,71 @@
+from collections.abc import Iterable
+
+import jamorasep
+
+# 促音・撥音・長音などの特殊モウラ
+SPECIAL_MORAS = "ンーッ"
+
+
+class MoraTable:
+    """
+    カタカナのモウラごとに整数IDを割り当て、子音・母音・特殊モウラかどうかを保持する表。
+
+    jamorasepでの子音・母音の分解はモウラごとに一度だけ行い、以降は表を引くだけで済むようにする。
+    ID 0は空文字に割り当てる。表にないモウラは初めて参照された時に追加する。
+    """
+
+    def __init__(self, moras: Iterable[str] = ()):
+        self.moras: list[str] = []
+        self.consonants: list[str] = []
+        self.vowels: list[str] = []
+        self.is_specials: list[bool] = []
+        self._mora_to_id: dict[str, int] = {}
+
+        self.get_id("")
+        for mora in moras:
+            self.get_id(mora)
+
+    def __len__(self) -> int:
+        return len(self.moras)
+
+    def __contains__(self, mora: str) -> bool:
+        return mora in self._mora_to_id
+
+    def get_id(self, mora: str) -> int:
+        mora_id = self._mora_to_id.get(mora)
+        if mora_id is None:
+            consonant, vowel = self._parse_mora(mora)
+            mora_id = len(self.moras)
+            self.moras.append(mora)
+            self.consonants.append(consonant)
+            self.vowels.append(vowel)
+            # 空文字は特殊モウラとして扱わない
+            self.is_specials.append(mora != "" and mora in SPECIAL_MORAS)
+            self._mora_to_id[mora] = mora_id
+        return mora_id
+
+    def encode(self, moras: Iterable[str]) -> list[int]:
+        return [self.get_id(mora) for mora in moras]
+
+    def split_consonant_vowel(self, mora: str) -> tuple[str, str]:
+        mora_id = self.get_id(mora)
+        return self.consonants[mora_id], self.vowels[mora_id]
+
+    def is_special(self, mora: str) -> bool:
+        return self.is_specials[self.get_id(mora)]
+
+    @staticmethod
+    def _parse_mora(mora: str) -> tuple[str, str]:
+        if mora == "":
+            return "", ""
+
+        simpleipa = jamorasep.parse(mora, output_format="simple-ipa")[0]
+        consonant, vowel = "".join(simpleipa[:-1]), simpleipa[-1]
+        if consonant == "":
+            return "sp", vowel
+        else:
+            return consonant, vowel
+
+
+# align_mora, align_word, evaluate_phonetic_search_datasetで共有する表
+MORA_TABLE = MoraTable(jamorasep.Morasep().kanamap.lst_katakana())
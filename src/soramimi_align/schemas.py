@@ -1,12 +1,18 @@
 import re
+from collections.abc import Hashable, Iterable, Iterator
 from dataclasses import dataclass, field
-from typing import Any, Hashable
+from typing import Any, TextIO
 
 import jaconv
 import neologdn
 
+KATAKANA_PATTERN = re.compile(r"[ァ-ヶー]+")
+# 空白区切りの発音の行がすべてカタカナかどうかを1回で調べる
+KATAKANA_LINE_PATTERN = re.compile(r"[ァ-ヶー]+(?: [ァ-ヶー]+)*")
+WHITESPACE_PATTERN = re.compile(r"\s")
 
-@dataclass
+
+@dataclass(slots=True)
 class AthleteTableItem:
     id: Hashable
     original: str
@@ -92,7 +98,7 @@ class AthleteParodyLyrics:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class AthleteName:
     raw: str
     pre_silent_surface: str = ""
@@ -190,26 +196,107 @@ class AthleteName:
         )
 
 
-@dataclass
 class AnalyzedWordItem:
-    surface: str
-    pronunciation: str
-    is_phrase_start: bool = False
-    memo: dict[str, Any] = field(default_factory=dict)
+    """
+    解析済みの単語。
+
+    コーパス全体では単語の数が非常に多くなるので、__slots__で属性を持ち、
+    memoは渡された時か、memoを参照した時にだけ辞書を作る。渡した辞書は空でもそのまま共有する。
+    コンストラクタ、比較、reprはdataclassだった時と同じ。
+    """
+
+    __slots__ = ("_memo", "is_phrase_start", "pronunciation", "surface")
+
+    def __init__(
+        self,
+        surface: str,
+        pronunciation: str,
+        is_phrase_start: bool = False,
+        memo: dict[str, Any] | None = None,
+    ):
+        self.surface = surface
+        self.pronunciation = pronunciation
+        self.is_phrase_start = is_phrase_start
+        self._memo = memo
 
-    def __post_init__(self):
         if self.pronunciation.count("/") > 1:
             self.pronunciation = self.pronunciation.split("/")[0]
 
-        if not re.fullmatch(r"[ァ-ヶー]+", self.pronunciation):
-            print(
+        for warning in self.find_warnings():
+            print(warning)
+
+    @classmethod
+    def trusted(
+        cls,
+        surface: str,
+        pronunciation: str,
+        is_phrase_start: bool = False,
+        memo: dict[str, Any] | None = None,
+    ) -> "AnalyzedWordItem":
+        """
+        検証と警告の表示をせずに作る。ドラフトの読み込みなど、単語をまとめて作る時に使う。
+        警告はAnalyzedLyrics.find_warningsでファイルごとにまとめて調べる。
+        """
+        word = cls.__new__(cls)
+        word.surface = surface
+        if pronunciation.count("/") > 1:
+            pronunciation = pronunciation.split("/")[0]
+        word.pronunciation = pronunciation
+        word.is_phrase_start = is_phrase_start
+        word._memo = memo
+        return word
+
+    def find_warnings(self) -> list[str]:
+        warnings = []
+        if not KATAKANA_PATTERN.fullmatch(self.pronunciation):
+            warnings.append(
                 f"警告 in AnalyzedWordItem: 発音にカタカナ以外の文字が含まれています: {self.surface} {self.pronunciation}"
             )
-
         if len(self.surface) != len("".join(self.surface.split())):
-            print(
+            warnings.append(
                 f"警告: surfaceにスペースが含まれています: {self.surface} {self.pronunciation}"
             )
+        return warnings
+
+    @property
+    def memo(self) -> dict[str, Any]:
+        if self._memo is None:
+            self._memo = {}
+        return self._memo
+
+    @memo.setter
+    def memo(self, memo: dict[str, Any] | None) -> None:
+        self._memo = memo
+
+    def get_memo(self, key: str, default: Any = None) -> Any:
+        """
+        memo.get(key, default)と同じ値を、memoの辞書を作らずに返す。
+        """
+        if self._memo is None:
+            return default
+        return self._memo.get(key, default)
+
+    def _astuple(self) -> tuple:
+        return (
+            self.surface,
+            self.pronunciation,
+            self.is_phrase_start,
+            self._memo or {},
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._astuple() == other._astuple()
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__qualname__}(surface={self.surface!r},"
+            f" pronunciation={self.pronunciation!r},"
+            f" is_phrase_start={self.is_phrase_start!r}, memo={self._memo or {}!r})"
+        )
 
 
 @dataclass
@@ -223,30 +310,82 @@ class AnalyzedLyrics:
 
     @classmethod
     def from_text(cls, text: str) -> "AnalyzedLyrics":
-        lines = text.splitlines()
-        # 空行を削除
-        lines = [line.strip() for line in lines if line.strip()]
+        analyzed_parody_words = []
+        analyzed_original_words = []
+        for parody_words, original_words in cls._iter_line_pairs(text.splitlines()):
+            analyzed_parody_words.append(parody_words)
+            analyzed_original_words.append(original_words)
+        return cls(parody=analyzed_parody_words, original=analyzed_original_words)
 
-        assert len(lines) % 4 == 0
+    @classmethod
+    def iter_from_file(
+        cls, f: TextIO
+    ) -> Iterator[tuple[list[AnalyzedWordItem], list[AnalyzedWordItem]]]:
+        """
+        ドラフトのファイルを4行ずつ読み、(parodyの単語のリスト, originalの単語のリスト)を1組ずつ返す。
+        ファイル全体を読み込まないので、曲を連結した大きなドラフトでもメモリは一定で済む。
+        """
+        yield from cls._iter_line_pairs(f)
 
-        parody_surface_lines = lines[::4]
-        parody_pronunciation_lines = lines[1::4]
-        original_surface_lines = lines[2::4]
-        original_pronunciation_lines = lines[3::4]
+    @classmethod
+    def _iter_line_pairs(
+        cls, lines: Iterable[str]
+    ) -> Iterator[tuple[list[AnalyzedWordItem], list[AnalyzedWordItem]]]:
+        """
+        空行を除いた4行(parodyの表層、発音、originalの表層、発音)ごとに単語のリストの組を返す。
+        形式が正しくない場合は、行番号を含めたValueErrorを送出する。
+        """
+        block = []
+        for line_number, line in enumerate(lines, start=1):
+            # 空行を削除
+            line = line.strip()
+            if not line:
+                continue
+            block.append((line_number, line))
+            if len(block) < 4:
+                continue
 
-        analyzed_parody_words = [
-            cls._parse_parody_line(surface_line, pronunciation_line)
-            for surface_line, pronunciation_line in zip(
-                parody_surface_lines, parody_pronunciation_lines
-            )
-        ]
-        analyzed_original_words = [
-            cls._parse_original_line(surface_line, pronunciation_line)
-            for surface_line, pronunciation_line in zip(
-                original_surface_lines, original_pronunciation_lines
+            (
+                (parody_line_number, parody_surface_line),
+                (_, parody_pronunciation_line),
+                (original_line_number, original_surface_line),
+                (_, original_pronunciation_line),
+            ) = block
+            block = []
+            try:
+                parody_words = cls._parse_parody_line(
+                    parody_surface_line, parody_pronunciation_line
+                )
+            except ValueError as e:
+                raise ValueError(f"{parody_line_number}行目: {e}") from e
+            try:
+                original_words = cls._parse_original_line(
+                    original_surface_line, original_pronunciation_line
+                )
+            except ValueError as e:
+                raise ValueError(f"{original_line_number}行目: {e}") from e
+            yield parody_words, original_words
+
+        if block:
+            raise ValueError(
+                f"{block[0][0]}行目: 空行を除いた行数が4の倍数ではありません"
+                f"(最後の組が{len(block)}行)"
             )
-        ]
-        return cls(parody=analyzed_parody_words, original=analyzed_original_words)
+
+    def find_warnings(self) -> list[str]:
+        """
+        すべての単語の警告を返す。
+        """
+        warnings = []
+        for words in self.parody + self.original:
+            warnings.extend(find_line_warnings(words))
+        return warnings
+
+    def summarize_warnings(self, source: str, max_examples: int = 5) -> str:
+        """
+        警告をsourceごとに1つにまとめた文字列を返す。警告がなければ空文字を返す。
+        """
+        return format_warning_summary(source, self.find_warnings(), max_examples)
 
     @classmethod
     def _parse_parody_line(
@@ -262,8 +401,20 @@ class AnalyzedLyrics:
 
         analyzed_words = []
         for surface, pronunciation in zip(surfaces, pronunciations):
-            analyzed_word = AnalyzedWordItem(
-                surface=surface, pronunciation=pronunciation
+            # 発音候補が複数ある場合は`候補1|候補2`の形式で書かれている
+            pronunciation_tokens = pronunciation.split("/")
+            pronunciation_candidates = pronunciation_tokens[0].split("|")
+            memo = None
+            if len(pronunciation_candidates) > 1:
+                memo = {
+                    "pronunciation_candidate_num": len(pronunciation_candidates),
+                    "pronunciation_candidates": pronunciation_candidates,
+                }
+                pronunciation = "/".join(
+                    [pronunciation_candidates[0]] + pronunciation_tokens[1:]
+                )
+            analyzed_word = AnalyzedWordItem.trusted(
+                surface=surface, pronunciation=pronunciation, memo=memo
             )
             analyzed_words.append(analyzed_word)
 
@@ -289,7 +440,7 @@ class AnalyzedLyrics:
             else:
                 is_phrase_start = False
 
-            analyzed_word = AnalyzedWordItem(
+            analyzed_word = AnalyzedWordItem.trusted(
                 surface=surface,
                 pronunciation=pronunciation_tokens[0],
                 is_phrase_start=is_phrase_start,
@@ -298,7 +449,38 @@ class AnalyzedLyrics:
         return analyzed_words
 
 
-@dataclass
+def find_line_warnings(words: list[AnalyzedWordItem]) -> list[str]:
+    """
+    1行分の単語の警告を返す。発音がすべてカタカナの行は、単語ごとに調べずに飛ばす。
+    """
+    line_pronunciation = " ".join(word.pronunciation for word in words)
+    line_surface = "".join(word.surface for word in words)
+    if KATAKANA_LINE_PATTERN.fullmatch(
+        line_pronunciation
+    ) and not WHITESPACE_PATTERN.search(line_surface):
+        return []
+    warnings = []
+    for word in words:
+        warnings.extend(word.find_warnings())
+    return warnings
+
+
+def format_warning_summary(
+    source: str, warnings: list[str], max_examples: int = 5
+) -> str:
+    """
+    sourceの警告を1つにまとめた文字列を返す。警告がなければ空文字を返す。
+    """
+    if not warnings:
+        return ""
+    summary_lines = [f"{source}: {len(warnings)}件の警告"]
+    summary_lines += [f"  {warning}" for warning in warnings[:max_examples]]
+    if len(warnings) > max_examples:
+        summary_lines.append(f"  ...他{len(warnings) - max_examples}件")
+    return "\n".join(summary_lines)
+
+
+@dataclass(slots=True)
 class AlignedMora:
     parody_mora: str
     is_parody_word_start: bool
@@ -316,6 +498,11 @@ class AlignedMora:
     original_consonant: str = ""
     parody_word_surface: str = ""
     original_word_surface: str = ""
+    # 行のアラインメントで探索した状態数。align_wordでは単語と区間の対応の探索で数える
+    explored_states: int = field(default=0, compare=False)
+    # 行の対応の中での順位(0が最良)と、その対応のコスト
+    alignment_rank: int = 0
+    alignment_cost: float = 0.0
 
 
 @dataclass
@@ -1,13 +1,28 @@
+import itertools
 import os
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from soramimi_align.align_mora import (
+    OPTIONAL_COLUMNS,
     align_analyzed_lyrics,
+    align_files,
+    analyze_original_line,
     eval_vowel_consonant_distance,
+    eval_vowel_consonant_prefix_distances,
+    find_anchors,
     find_correspondance,
+    find_correspondance_linear_memory,
+    find_correspondance_with_reference_candidates,
+    find_correspondance_with_segment_candidates,
+    find_n_best_correspondances,
+    iter_align_files,
+    original_line_cache_info,
     split_consonant_vowel,
+    summarize_original_line_cache,
+    vowel_consonant_distance_lower_bound,
+    write_aligned_moras,
 )
 from soramimi_align.schemas import AlignedMora, AnalyzedLyrics
 
@@ -33,6 +48,20 @@ def test_eval_vowel_consonant_distance():
     assert eval_vowel_consonant_distance(["イ", "ノ"], ["ミ", "リョ"]) == 1.99
 
 
+def test_eval_vowel_consonant_prefix_distances():
+    reference_moras = ["ン", "イ", "ノ", "ア", "ー"]
+    for moras in [["ミ", "リョ"], ["ン"], ["ー", "ア"], []]:
+        for start in range(len(reference_moras) + 1):
+            distances = eval_vowel_consonant_prefix_distances(
+                reference_moras, start, moras, 3
+            )
+            expected = [
+                eval_vowel_consonant_distance(reference_moras[start : start + k], moras)
+                for k in range(min(3, len(reference_moras) - start) + 1)
+            ]
+            assert distances == expected
+
+
 def test_find_correspondance():
     def wrapper(reference_text: str, input_text: str) -> list[tuple[str, str]]:
         import jamorasep
@@ -88,6 +117,283 @@ def test_find_correspondance():
     ]
 
 
+def test_find_correspondance_window_size_and_prune():
+    import jamorasep
+
+    reference_moras = jamorasep.parse("アンネモトレモンリンオンユケニーレイボーン")
+    input_segments = [
+        [mora] for mora in jamorasep.parse("アレモコレモミリョクテキデモ")
+    ]
+
+    stats = {}
+    expected = find_correspondance(
+        reference_moras,
+        input_segments,
+        eval_vowel_consonant_distance,
+        eval_vowel_consonant_prefix_distances,
+        stats=stats,
+    )
+    pruned_stats = {}
+    result = find_correspondance(
+        reference_moras,
+        input_segments,
+        eval_vowel_consonant_distance,
+        eval_vowel_consonant_prefix_distances,
+        lower_bound_func=vowel_consonant_distance_lower_bound,
+        stats=pruned_stats,
+    )
+    # 下界による枝刈りでは結果は変わらず、探索する状態数だけが減る
+    assert result == expected
+    assert 0 < pruned_stats["explored_states"] < stats["explored_states"]
+
+    # window_sizeが0なら各セグメントに同じ長さの区間を割り当てる
+    _, correspondance = find_correspondance(
+        reference_moras, input_segments, eval_vowel_consonant_distance, window_size=0
+    )
+    assert correspondance[:-1] == [(i, i + 1) for i in range(len(input_segments) - 1)]
+    assert correspondance[-1] == (len(input_segments) - 1, len(reference_moras))
+
+
+def test_find_correspondance_linear_memory():
+    import jamorasep
+
+    for reference_text, input_text in [
+        ("アンネモトレモンリンオンユケニーレイボーン", "アレモコレモミリョクテキデモ"),
+        ("ソコ", "トントン"),
+        ("トントン", "ソコ"),
+        ("", "ア"),
+        ("ア", ""),
+    ]:
+        reference_moras = jamorasep.parse(reference_text)
+        input_segments = [[mora] for mora in jamorasep.parse(input_text)]
+        expected = find_correspondance(
+            reference_moras, input_segments, eval_vowel_consonant_distance
+        )
+        result = find_correspondance_linear_memory(
+            reference_moras, input_segments, eval_vowel_consonant_distance
+        )
+        assert abs(result[0] - expected[0]) < 1e-9
+        assert result[1] == expected[1]
+        # 対角線の近くの対応なら、帯で制限しても同じ結果になる
+        banded = find_correspondance_linear_memory(
+            reference_moras,
+            input_segments,
+            eval_vowel_consonant_distance,
+            band_width=8,
+        )
+        assert abs(banded[0] - expected[0]) < 1e-9
+        assert banded[1] == expected[1]
+
+    # 帯の中に終端に至る経路がなければ、制限せずに解き直す
+    reference_moras = list("アイウエオカキクケコサシスセソタチツテト")
+    input_segments = [["ア"], ["ト"]]
+    expected = find_correspondance(
+        reference_moras, input_segments, eval_vowel_consonant_distance
+    )
+    result = find_correspondance_linear_memory(
+        reference_moras, input_segments, eval_vowel_consonant_distance, band_width=1
+    )
+    assert result == expected
+
+
+def test_find_n_best_correspondances():
+    import jamorasep
+
+    reference_moras = jamorasep.parse("アンネモトレモンリンオンユケニーレイボーン")
+    input_segments = [
+        [mora] for mora in jamorasep.parse("アレモコレモミリョクテキデモ")
+    ]
+    best = find_correspondance(
+        reference_moras,
+        input_segments,
+        eval_vowel_consonant_distance,
+        eval_vowel_consonant_prefix_distances,
+    )
+    results = find_n_best_correspondances(
+        reference_moras,
+        input_segments,
+        eval_vowel_consonant_distance,
+        eval_vowel_consonant_prefix_distances,
+        n_best=5,
+    )
+    # 1位はfind_correspondanceと同じで、コストは昇順、対応はすべて異なる
+    assert len(results) == 5
+    assert results[0] == best
+    assert all(a[0] <= b[0] for a, b in itertools.pairwise(results))
+    assert len({tuple(c) for _, c in results}) == 5
+
+    # 対応の候補がn_bestより少なければ、ある分だけ返す
+    results = find_n_best_correspondances(
+        ["ア"], [["ア"]], eval_vowel_consonant_distance, n_best=3
+    )
+    assert len(results) == 1
+    assert results[0][1] == [(0, 1)]
+
+
+def test_find_correspondance_with_candidates():
+    import jamorasep
+
+    reference_moras = jamorasep.parse("アレモコレモミリョクテキデモ")
+    candidates = [
+        [jamorasep.parse("アンネモ")],
+        [
+            jamorasep.parse("トレモン"),
+            jamorasep.parse("コレモ"),
+            jamorasep.parse("コレモン"),
+        ],
+        [jamorasep.parse("ミリョク")],
+    ]
+    input_segments = [[mora] for mora in jamorasep.parse("アレモコレモミリョク")]
+
+    # 候補が1つずつならfind_correspondanceと同じ結果になる
+    single = [word_candidates[:1] for word_candidates in candidates]
+    expected = find_correspondance(
+        [mora for word in single for mora in word[0]],
+        input_segments,
+        eval_vowel_consonant_distance,
+    )
+    dist, correspondance, chosen = find_correspondance_with_reference_candidates(
+        single, input_segments, eval_vowel_consonant_distance
+    )
+    assert (dist, correspondance) == expected
+    assert chosen == [word[0] for word in single]
+
+    # 参照側の候補から、入力に最も近い候補が選ばれる
+    dist, correspondance, chosen = find_correspondance_with_reference_candidates(
+        candidates,
+        input_segments,
+        eval_vowel_consonant_distance,
+        eval_vowel_consonant_prefix_distances,
+    )
+    assert chosen[1] == jamorasep.parse("コレモ")
+    assert (dist, correspondance) == find_correspondance(
+        [mora for word in chosen for mora in word],
+        input_segments,
+        eval_vowel_consonant_distance,
+    )
+
+    # 入力側の候補でも同様
+    dist, correspondance, chosen = find_correspondance_with_segment_candidates(
+        reference_moras,
+        candidates,
+        eval_vowel_consonant_distance,
+        eval_vowel_consonant_prefix_distances,
+    )
+    assert chosen[1] == jamorasep.parse("コレモ")
+    assert (dist, correspondance) == find_correspondance(
+        reference_moras,
+        [[mora] for word in chosen for mora in word],
+        eval_vowel_consonant_distance,
+    )
+
+
+def test_find_anchors():
+    reference_moras = list("アイウエオカキクケコ")
+    input_segments = [["ア"], ["イ", "ウ"], ["エ", "オ"], ["ソ"], ["キ", "ク", "ケ"]]
+    # 一致区間に完全に含まれるセグメントだけがアンカーになる
+    assert find_anchors(reference_moras, input_segments, 2) == [(0, 3, 0), (4, 5, 6)]
+    assert find_anchors(reference_moras, input_segments, 4) == [(0, 3, 0)]
+
+
+def test_find_correspondance_with_anchors():
+    import jamorasep
+
+    reference_moras = jamorasep.parse(
+        "アレモコレモミリョクテキデモ" + "カゼノナカノスバル" + "ナツメタカシフルタソウ"
+    )
+    input_moras = jamorasep.parse(
+        "アレモコレモミリョクテキデモ" + "アンネモトレモン" + "ナツメタカシフルタソウ"
+    )
+    input_segments = [[mora] for mora in input_moras]
+
+    stats = {}
+    expected = find_correspondance(
+        reference_moras,
+        input_segments,
+        eval_vowel_consonant_distance,
+        eval_vowel_consonant_prefix_distances,
+        stats=stats,
+    )
+    anchored_stats = {}
+    result = find_correspondance(
+        reference_moras,
+        input_segments,
+        eval_vowel_consonant_distance,
+        eval_vowel_consonant_prefix_distances,
+        stats=anchored_stats,
+        anchor_min_length=4,
+    )
+    # 前後の一致区間は1モウラずつ対応が固定される
+    assert result[1][:13] == [(i, i + 1) for i in range(13)]
+    assert result[1][-11:] == [(i, i + 1) for i in range(22, 33)]
+    assert len(result[1]) == len(expected[1])
+    assert anchored_stats["explored_states"] < stats["explored_states"]
+
+
+def test_find_correspondance_with_anchors_covers_reference():
+    reference_moras = list("ウエオカコアン")
+    input_segments = [["エ"], ["オ"], ["カ"]]
+    # 先頭と末尾のアンカーの外側の参照も、隣のアンカーの区間に含める
+    dist, correspondance = find_correspondance(
+        reference_moras,
+        input_segments,
+        eval_vowel_consonant_distance,
+        anchor_min_length=3,
+    )
+    assert correspondance == [(0, 2), (2, 3), (3, 7)]
+    assert (
+        dist
+        == find_correspondance(
+            reference_moras, input_segments, eval_vowel_consonant_distance
+        )[0]
+    )
+
+    # 隣り合うアンカーの間の参照も失われない
+    reference_moras = list("アイウエオカキクケコサシスセソ")
+    input_segments = [[mora] for mora in "アイウエオサシスセソ"]
+    _, correspondance = find_correspondance(
+        reference_moras,
+        input_segments,
+        eval_vowel_consonant_distance,
+        anchor_min_length=3,
+    )
+    assert [start for start, _ in correspondance[1:]] == [
+        end for _, end in correspondance[:-1]
+    ]
+    assert correspondance[0][0] == 0
+    assert correspondance[-1][1] == len(reference_moras)
+
+    text = """
+    ウエオカコアン
+    ウエオカコアン
+    エ オ カ
+    エ/p オ カ"""
+    results = align_analyzed_lyrics(AnalyzedLyrics.from_text(text), anchor_min_length=3)
+    assert [r.parody_mora for r in results] == ["ウエ", "オ", "カコアン"]
+    assert "".join(r.parody_mora for r in results) == "ウエオカコアン"
+
+
+def test_find_correspondance_long_line():
+    """再帰の上限を超える長さの行でも対応が取れることを確認する"""
+    import sys
+
+    def eval_func(moras1: list[str], moras2: list[str]) -> float:
+        return abs(len(moras1) - len(moras2)) + int(moras1 != moras2)
+
+    reference_moras = ["ア", "イ", "ウ"] * 50
+    input_segments = [[mora] for mora in reference_moras]
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(100)
+    try:
+        dist, correspondance = find_correspondance(
+            reference_moras, input_segments, eval_func
+        )
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+    assert dist == 0
+    assert correspondance == [(i, i + 1) for i in range(len(reference_moras))]
+
+
 def test_align_analyzed_lyrics():
     text = """
     阿部 クルーン 伊勢 工藤 中野
@@ -96,6 +402,11 @@ def test_align_analyzed_lyrics():
     アレ/p クルウ/p キセツ/p ノ ナカ/p オ"""
     analyzed_lyrics = AnalyzedLyrics.from_text(text)
     results = align_analyzed_lyrics(analyzed_lyrics, parody_as_referrence=False)
+    # 行の中の全てのモウラに、最良の対応の順位とコストが入る
+    alignment_cost = results[0].alignment_cost
+    assert alignment_cost > 0
+    assert all(r.alignment_rank == 0 for r in results)
+    assert all(r.alignment_cost == alignment_cost for r in results)
 
     assert results[0] == AlignedMora(
         parody_mora="ア",
@@ -113,6 +424,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="阿部",
         original_word_surface="荒れ",
+        alignment_cost=alignment_cost,
     )
 
     assert results[1] == AlignedMora(
@@ -131,6 +443,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="",
         original_word_surface="",
+        alignment_cost=alignment_cost,
     )
 
     assert results[2] == AlignedMora(
@@ -149,6 +462,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="クルーン",
         original_word_surface="狂う",
+        alignment_cost=alignment_cost,
     )
 
     assert results[3] == AlignedMora(
@@ -167,6 +481,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="",
         original_word_surface="",
+        alignment_cost=alignment_cost,
     )
 
     assert results[4] == AlignedMora(
@@ -185,6 +500,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="",
         original_word_surface="",
+        alignment_cost=alignment_cost,
     )
 
     assert results[5] == AlignedMora(
@@ -203,6 +519,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="",
         original_word_surface="",
+        alignment_cost=alignment_cost,
     )
 
     assert results[6] == AlignedMora(
@@ -221,6 +538,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="伊勢",
         original_word_surface="季節",
+        alignment_cost=alignment_cost,
     )
 
     assert results[7] == AlignedMora(
@@ -239,6 +557,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="",
         original_word_surface="",
+        alignment_cost=alignment_cost,
     )
 
     assert results[8] == AlignedMora(
@@ -257,6 +576,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="工藤",
         original_word_surface="",
+        alignment_cost=alignment_cost,
     )
 
     assert results[9] == AlignedMora(
@@ -275,6 +595,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="",
         original_word_surface="の",
+        alignment_cost=alignment_cost,
     )
 
     assert results[10] == AlignedMora(
@@ -293,6 +614,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="",
         original_word_surface="",
+        alignment_cost=alignment_cost,
     )
 
     assert results[11] == AlignedMora(
@@ -311,6 +633,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="中野",
         original_word_surface="中",
+        alignment_cost=alignment_cost,
     )
 
     assert results[12] == AlignedMora(
@@ -329,6 +652,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="",
         original_word_surface="",
+        alignment_cost=alignment_cost,
     )
 
     assert results[13] == AlignedMora(
@@ -347,6 +671,7 @@ def test_align_analyzed_lyrics():
         line_id="0",
         parody_word_surface="",
         original_word_surface="を",
+        alignment_cost=alignment_cost,
     )
 
     text = """
@@ -418,6 +743,140 @@ def test_align_analyzed_lyrics():
     assert results[idx].original_mora == "ヨ"
 
 
+def test_align_analyzed_lyrics_whole_song():
+    text = """
+    丼丼 藤
+    ドンドン ト
+    外 夜
+    ソト/p ヨ/p
+
+    阿部 クルーン 伊勢 工藤 中野
+    アベ クルーン イセ クドウ ナカノ
+    荒れ 狂う 季節 の 中 を
+    アレ/p クルウ/p キセツ/p ノ ナカ/p オ"""
+    analyzed_lyrics = AnalyzedLyrics.from_text(text)
+    for parody_as_referrence in [True, False]:
+        expected = align_analyzed_lyrics(analyzed_lyrics, parody_as_referrence)
+        results = align_analyzed_lyrics(
+            analyzed_lyrics, parody_as_referrence, whole_song=True
+        )
+        # 行をまたぐ対応も許すので対応そのものは変わりうるが、行の区切りと各モウラは元の行と一致する
+        assert [r.line_id for r in results] == [r.line_id for r in expected]
+        assert "".join(r.parody_mora for r in results) == "".join(
+            r.parody_mora for r in expected
+        )
+        assert "".join(r.original_mora for r in results) == "".join(
+            r.original_mora for r in expected
+        )
+
+
+def test_align_files_workers(tmp_path):
+    text = """
+    丼丼 藤
+    ドンドン ト
+    外 夜
+    ソト/p ヨ/p
+
+    阿部 クルーン 伊勢 工藤 中野
+    アベ クルーン イセ クドウ ナカノ
+    荒れ 狂う 季節 の 中 を
+    アレ/p クルウ/p キセツ/p ノ ナカ/p オ"""
+    for name in ["a.txt", "b.txt"]:
+        (tmp_path / name).write_text(text)
+
+    # 並列に処理しても行の順序と結果は変わらない
+    for whole_song in [False, True]:
+        expected = align_files(str(tmp_path), whole_song=whole_song)
+        results = align_files(str(tmp_path), whole_song=whole_song, workers=2)
+        assert results == expected
+        assert [(r.input_file_path, r.line_id) for r in results] == [
+            (r.input_file_path, r.line_id) for r in expected
+        ]
+
+
+def test_analyze_original_line():
+    text = """
+    阿部 クルーン
+    アベ クルーン
+    荒れ 狂う 季節 の 中 を
+    アレ/p クルウ/p キセツ/p ノ ナカ/p オ
+
+    伊勢 工藤
+    イセ クドウ
+    荒れ 狂う 季節 の 中 を
+    アレ/p クルウ/p キセツ/p ノ ナカ/p オ"""
+    analyzed_lyrics = AnalyzedLyrics.from_text(text)
+
+    (
+        moras,
+        is_phrase_starts,
+        is_phrase_ends,
+        is_word_starts,
+        is_word_ends,
+        word_surfaces,
+    ) = analyze_original_line(analyzed_lyrics.original[0])
+    assert "".join(moras) == "アレクルウキセツノナカオ"
+    assert is_phrase_starts[:3] == [True, False, True]
+    assert is_phrase_ends[:3] == [False, True, False]
+    assert is_word_starts[8:] == [True, True, False, True]
+    assert is_word_ends[8:] == [True, False, True, True]
+    assert word_surfaces[-1] == "を"
+
+    # 別の曲でも同じ行なら分解の結果を再利用する
+    cache_info = original_line_cache_info()
+    assert analyze_original_line(analyzed_lyrics.original[1])[0] == moras
+    assert original_line_cache_info().hits == cache_info.hits + 1
+    assert (
+        summarize_original_line_cache(cache_info)
+        == "original line cache: 1 hits, 0 misses"
+    )
+
+
+def test_write_aligned_moras(tmp_path):
+    import pandas as pd
+
+    text = """
+    阿部 クルーン 伊勢 工藤 中野
+    アベ クルーン イセ クドウ ナカノ
+    荒れ 狂う 季節 の 中 を
+    アレ/p クルウ/p キセツ/p ノ ナカ/p オ"""
+    (tmp_path / "a.txt").write_text(text)
+
+    # 逐次書き込んだCSVはDataFrameにまとめて書き込んだものと同じになる
+    expected_path = tmp_path / "expected.csv"
+    pd.DataFrame(align_files(str(tmp_path), n_best=2)).to_csv(
+        expected_path, index=False
+    )
+    output_path = tmp_path / "output.csv"
+    write_aligned_moras(
+        str(output_path),
+        iter_align_files(str(tmp_path), n_best=2),
+        OPTIONAL_COLUMNS,
+    )
+    assert output_path.read_text() == expected_path.read_text()
+
+    # 指定しなければ、以前と同じ列だけを書き込む
+    write_aligned_moras(str(output_path), iter_align_files(str(tmp_path)))
+    assert list(pd.read_csv(output_path).columns) == [
+        "parody_mora",
+        "is_parody_word_start",
+        "is_parody_word_end",
+        "original_mora",
+        "is_original_phrase_start",
+        "is_original_phrase_end",
+        "is_original_word_start",
+        "is_original_word_end",
+        "line_id",
+        "input_file_path",
+        "parody_vowel",
+        "original_vowel",
+        "parody_consonant",
+        "original_consonant",
+        "parody_word_surface",
+        "original_word_surface",
+    ]
+
+
 def test_tmp():
     text = """
     安 根元 レモン 林恩宇 ケニー・レイボーン
@@ -434,3 +893,21 @@ def test_tmp():
     for amora in results:
         print(amora.parody_mora, amora.original_mora)
     # assert False
+
+
+def test_align_analyzed_lyrics_candidates_ignore_prune():
+    import pytest
+
+    text = """
+    小塚 辻勇夫 河
+    コヅカ ツジイサム|ツリシカオ カワ
+    コブナ 釣り しか の 川
+    コブナ/p ツリ/p シカ ノ カワ/p"""
+    analyzed_lyrics = AnalyzedLyrics.from_text(text)
+    expected = align_analyzed_lyrics(analyzed_lyrics)
+    assert "".join(r.parody_mora for r in expected) == "コヅカツリシカオカワ"
+    # 発音候補のある行では枝刈りとアンカーを使わないので、指定すると警告する
+    with pytest.warns(UserWarning, match="--prune"):
+        assert align_analyzed_lyrics(analyzed_lyrics, prune=True) == expected
+    with pytest.warns(UserWarning, match="--anchor_min_length"):
+        assert align_analyzed_lyrics(analyzed_lyrics, anchor_min_length=3) == expected
@@ -3,7 +3,11 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from soramimi_align.align_word import align_analyzed_lyrics
+from soramimi_align.align_word import (
+    align_analyzed_lyrics,
+    align_analyzed_lyrics_table,
+    align_files,
+)
 from soramimi_align.schemas import AnalyzedLyrics
 
 
@@ -15,6 +19,7 @@ def test_align_analyzed_lyrics():
     アレ/p クルウ/p キセツ/p ノ ナカ/p オ"""
     analyzed_lyrics = AnalyzedLyrics.from_text(text)
     results = align_analyzed_lyrics(analyzed_lyrics)
+    assert align_analyzed_lyrics_table(analyzed_lyrics).to_rows() == results
 
     idx = 0
     assert results[idx].parody_mora == "アベ"
@@ -65,3 +70,38 @@ def test_align_analyzed_lyrics():
     assert results[idx].is_original_word_end is True
     assert results[idx].parody_word_surface == "中野"
     assert results[idx].original_word_surface == "中を"
+
+
+def test_align_analyzed_lyrics_candidates():
+    text = """
+    小塚 辻勇夫 河
+    コヅカ ツジイサム|ツリシカオ カワ
+    コブナ 釣り しか の 川
+    コブナ/p ツリ/p シカ ノ カワ/p"""
+    analyzed_lyrics = AnalyzedLyrics.from_text(text)
+    # 発音候補の組み合わせから、コストの最も小さいものを選ぶ
+    for prune in [False, True]:
+        results = align_analyzed_lyrics(analyzed_lyrics, prune=prune)
+        assert [(r.parody_mora, r.original_mora) for r in results] == [
+            ("コヅカ", "コブナ"),
+            ("ツリシカオ", "ツリシカノ"),
+            ("カワ", "カワ"),
+        ]
+
+
+def test_align_files_workers(tmp_path):
+    text = """
+    阿部 クルーン 伊勢 工藤 中野
+    アベ クルーン イセ クドウ ナカノ
+    荒れ 狂う 季節 の 中 を
+    アレ/p クルウ/p キセツ/p ノ ナカ/p オ"""
+    for name in ["a.txt", "b.txt"]:
+        (tmp_path / name).write_text(text)
+
+    # 並列に処理しても行の順序と結果は変わらない
+    expected = align_files(str(tmp_path))
+    results = align_files(str(tmp_path), workers=2)
+    assert results == expected
+    assert [(r.input_file_path, r.line_id) for r in results] == [
+        (r.input_file_path, r.line_id) for r in expected
+    ]
@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from soramimi_align.align_mora import align_analyzed_lyrics, align_analyzed_lyrics_table
+from soramimi_align.aligned_mora_table import AlignedMoraTable
+from soramimi_align.schemas import AnalyzedLyrics
+
+
+def test_aligned_mora_table():
+    text = """
+    阿部 クルーン 伊勢 工藤 中野
+    アベ クルーン イセ クドウ ナカノ
+    荒れ 狂う 季節 の 中 を
+    アレ/p クルウ/p キセツ/p ノ ナカ/p オ"""
+    analyzed_lyrics = AnalyzedLyrics.from_text(text)
+    table = align_analyzed_lyrics_table(analyzed_lyrics, n_best=2)
+    assert isinstance(table, AlignedMoraTable)
+    rows = table.to_rows()
+    assert rows == align_analyzed_lyrics(analyzed_lyrics, n_best=2)
+
+    # AlignedMoraのリストと同じように読み出せる
+    assert len(table) == len(rows)
+    assert table[0] == rows[0]
+    assert table[-1] == rows[-1]
+    assert list(table[1:3]) == rows[1:3]
+    assert AlignedMoraTable.from_rows(rows).to_rows() == rows
+    assert list(table.column("parody_mora")) == [row.parody_mora for row in rows]
+
+    # 整数と小数の列は複製せずに渡す
+    assert table.to_numpy()["alignment_rank"] is table.columns["alignment_rank"]
+
+    # 真偽値の列は8個ずつ1バイトに詰めて持つ
+    assert table.columns["is_parody_word_start"].nbytes == (len(table) + 7) // 8
+    assert table.column("is_parody_word_start").tolist() == [
+        row.is_parody_word_start for row in rows
+    ]
+    assert list(table[3:12:2]) == rows[3:12:2]
+    assert table.column("alignment_rank").tolist() == [
+        row.alignment_rank for row in rows
+    ]
+
+    # DataFrameの内容はAlignedMoraのリストから作った場合と同じ
+    assert table.to_pandas().to_csv(index=False) == pd.DataFrame(rows).to_csv(
+        index=False
+    )
+
+    empty = AlignedMoraTable.from_rows([])
+    assert len(empty) == 0
+    assert list(empty.to_pandas().columns) == list(pd.DataFrame(rows).columns)
@@ -0,0 +1,83 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from soramimi_align.athlete_table import (
+    AthleteTable,
+    get_athlete_table_index_path,
+    load_athlete_table,
+)
+
+ATHLETE_TABLE_TEXT = """id,original,surface,pronunciation
+1,イチロー,イチロー,イチロー
+2,大谷翔平,大谷翔平,オオタニ ショウヘイ
+2,大谷翔平,大谷,オオタニ
+3,大谷有,大谷,オオヤ
+3,大谷有,有,タモツ・ユウ
+"""
+
+
+def to_comparable(athlete_table: AthleteTable) -> tuple:
+    # 集合は列挙の順も比べる
+    return (
+        [(key, list(ids)) for key, ids in athlete_table.surface_to_id_dict.items()],
+        [
+            (id, [(surface, list(p)) for surface, p in surfaces.items()])
+            for id, surfaces in athlete_table.id_to_pronunciation_dict.items()
+        ],
+        [athlete_table.surface_index.find(s) for s in ["大", "大谷", "谷翔平", "x"]],
+    )
+
+
+def test_load_athlete_table(tmp_path):
+    athlete_table_path = str(tmp_path / "athlete_table.csv")
+    with open(athlete_table_path, "w") as f:
+        f.write(ATHLETE_TABLE_TEXT)
+    index_path = get_athlete_table_index_path(athlete_table_path)
+
+    athlete_table = load_athlete_table(athlete_table_path, use_index=False)
+    assert not os.path.exists(index_path)
+    assert athlete_table.surface_to_id_dict == {
+        "イチロー": {1},
+        "大谷翔平": {2},
+        "大谷": {2, 3},
+        "大谷有": {3},
+        "有": {3},
+    }
+    assert athlete_table.id_to_pronunciation_dict[2] == {
+        "大谷翔平": {"オオタニショウヘイ"},
+        "大谷": {"オオタニ"},
+    }
+    assert athlete_table.id_to_pronunciation_dict[3]["有"] == {"タモツユウ"}
+    expected = to_comparable(athlete_table)
+
+    # 1回目はCSVを読んでインデックスを書き込み、2回目はインデックスを読む
+    assert to_comparable(load_athlete_table(athlete_table_path)) == expected
+    assert os.path.exists(index_path)
+    indexed = load_athlete_table(athlete_table_path)
+    assert to_comparable(indexed) == expected
+    assert "大谷" in indexed.surface_to_id_dict
+    assert indexed.surface_to_id_dict.get("大") is None
+    assert indexed.surface_to_id_dict["大谷"] is indexed.surface_to_id_dict["大谷"]
+
+    # 選手の表が変わった時は読み直す
+    with open(athlete_table_path, "a") as f:
+        f.write("4,大谷翔,大谷翔,オオタニショウ\n")
+    changed = load_athlete_table(athlete_table_path)
+    assert changed.surface_to_id_dict["大谷翔"] == {4}
+    assert to_comparable(load_athlete_table(athlete_table_path)) == to_comparable(
+        load_athlete_table(athlete_table_path, use_index=False)
+    )
+
+
+def test_load_athlete_table_with_str_ids(tmp_path):
+    athlete_table_path = str(tmp_path / "athlete_table.csv")
+    with open(athlete_table_path, "w") as f:
+        f.write(ATHLETE_TABLE_TEXT.replace("\n1,", "\na1,"))
+
+    expected = to_comparable(load_athlete_table(athlete_table_path, use_index=False))
+    load_athlete_table(athlete_table_path)
+    indexed = load_athlete_table(athlete_table_path)
+    assert to_comparable(indexed) == expected
+    assert indexed.surface_to_id_dict["イチロー"] == {"a1"}
@@ -0,0 +1,104 @@
+import functools
+import os
+import sqlite3
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from soramimi_align.align_mora import align_files, iter_align_files
+from soramimi_align.cache import AlignmentCache, TokenizationCache
+
+
+def test_alignment_cache(tmp_path):
+    text = """
+    丼丼 藤
+    ドンドン ト
+    外 夜
+    ソト/p ヨ/p
+
+    阿部 クルーン 伊勢 工藤 中野
+    アベ クルーン イセ クドウ ナカノ
+    荒れ 狂う 季節 の 中 を
+    アレ/p クルウ/p キセツ/p ノ ナカ/p オ"""
+    input_path = tmp_path / "a.txt"
+    input_path.write_text(text)
+    cache_path = str(tmp_path / "cache.db")
+    expected = align_files(str(input_path))
+
+    with AlignmentCache(cache_path) as cache:
+        assert align_files(str(input_path), cache=cache) == expected
+        assert (cache.hits, cache.misses) == (0, 2)
+
+    # 1行だけ変えると、その行だけアラインメントし直す
+    input_path.write_text(text.replace("ドンドン", "トントン"))
+    with AlignmentCache(cache_path) as cache:
+        results = list(iter_align_files(str(input_path), cache=cache))
+        assert (cache.hits, cache.misses) == (1, 1)
+    assert [r for rows in results[1:] for r in rows] == [
+        r for r in expected if r.line_id == "1"
+    ]
+    assert [r.line_id for r in results[1]] == ["1"] * len(results[1])
+
+    # 引数が変われば別のキーになる
+    with AlignmentCache(cache_path) as cache:
+        align_files(str(input_path), parody_as_referrence=False, cache=cache)
+        assert (cache.hits, cache.misses) == (0, 2)
+
+    # 最大サイズを超えたら古いものから削除する
+    with AlignmentCache(cache_path, max_bytes=0) as cache:
+        pass
+    with AlignmentCache(cache_path) as cache:
+        align_files(str(input_path), cache=cache)
+        assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_alignment_cache_commit(tmp_path):
+    cache_path = str(tmp_path / "cache.db")
+
+    def committed_keys() -> set[str]:
+        # 別の接続から見える、コミットした結果のキー
+        connection = sqlite3.connect(cache_path)
+        keys = {key for (key,) in connection.execute("SELECT key FROM alignments")}
+        connection.close()
+        return keys
+
+    cache = AlignmentCache(cache_path, commit_interval=2)
+    # commit_interval回保存するまではコミットしない
+    cache.put("a", 1)
+    assert committed_keys() == set()
+    cache.put("b", 2)
+    assert committed_keys() == {"a", "b"}
+
+    # mapは呼び出しの最後にコミットする
+    align_func = functools.partial(abs)
+    assert list(cache.map(align_func, [-3])) == [3]
+    assert AlignmentCache.make_key(align_func, -3, 0) in committed_keys()
+    cache.close()
+
+
+def test_alignment_cache_evicts_during_map(tmp_path):
+    cache_path = str(tmp_path / "cache.db")
+    align_func = functools.partial(abs)
+    with AlignmentCache(cache_path) as cache:
+        assert list(cache.map(align_func, [-1])) == [1]
+
+    # 保存するたびに全体を削除しても、キャッシュにあった結果は先に読み込んであるので返せる
+    with AlignmentCache(cache_path, max_bytes=0, commit_interval=1) as cache:
+        assert list(cache.map(align_func, [-2, -1, -3, -1])) == [2, 1, 3, 1]
+        assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_tokenization_cache(tmp_path):
+    cache_path = str(tmp_path / "tokenization.db")
+    words = [("風", "カゼ", True), ("の", "ノ", False)]
+    with TokenizationCache(cache_path, "v1") as cache:
+        assert cache.get("風の") is None
+        cache.put("風の", words)
+        assert cache.get("風の") == words
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    with TokenizationCache(cache_path, "v1") as cache:
+        assert cache.get("風の") == words
+    # 辞書のバージョンが変われば使わない
+    with TokenizationCache(cache_path, "v2") as cache:
+        assert cache.get("風の") is None
@@ -0,0 +1,62 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from soramimi_align.draft_cache import (
+    get_draft_cache_path,
+    iter_line_pairs_from_file,
+    load_analyzed_lyrics,
+)
+from soramimi_align.schemas import AnalyzedLyrics
+
+DRAFT_TEXT = """
+宇佐美 小石博孝
+ウサミ コイシヒロタカ
+うさぎ 追い しか の 山
+ウサギ/p オイ/p シカ ノ ヤマ/p
+
+小塚 辻勇夫 河
+コヅカ ツジイサオ|ツジイサム カワ
+コブナ 釣り しか の 川
+コブナ/p ツリ/p シカ ノ カワ/p
+"""
+
+
+def test_load_analyzed_lyrics(tmp_path):
+    draft_path = str(tmp_path / "draft.txt")
+    with open(draft_path, "w") as f:
+        f.write(DRAFT_TEXT)
+    cache_path = get_draft_cache_path(draft_path)
+
+    expected = AnalyzedLyrics.from_text(DRAFT_TEXT)
+    assert load_analyzed_lyrics(draft_path, use_cache=False) == expected
+    assert not os.path.exists(cache_path)
+
+    # 1回目はテキストを解析してキャッシュを書き込み、2回目はキャッシュを読む
+    assert load_analyzed_lyrics(draft_path) == expected
+    assert os.path.exists(cache_path)
+    cached = load_analyzed_lyrics(draft_path)
+    assert cached == expected
+    assert repr(cached) == repr(expected)
+    assert cached.parody[1][1].memo["pronunciation_candidates"] == [
+        "ツジイサオ",
+        "ツジイサム",
+    ]
+
+    # 途中で読むのをやめても、キャッシュのmmapを閉じられる
+    line_pairs = iter_line_pairs_from_file(draft_path)
+    assert next(line_pairs) == (expected.parody[0], expected.original[0])
+    line_pairs.close()
+
+    # mtimeだけが変わった時は、内容が同じなのでキャッシュを使う
+    cache_mtime = os.stat(cache_path).st_mtime_ns
+    os.utime(draft_path, ns=(cache_mtime + 10**9, cache_mtime + 10**9))
+    assert load_analyzed_lyrics(draft_path) == expected
+
+    # 内容が変わった時は解析し直す
+    changed_text = DRAFT_TEXT.replace("カワ/p", "カワ")
+    with open(draft_path, "w") as f:
+        f.write(changed_text)
+    assert load_analyzed_lyrics(draft_path) == AnalyzedLyrics.from_text(changed_text)
+    assert load_analyzed_lyrics(draft_path) == AnalyzedLyrics.from_text(changed_text)
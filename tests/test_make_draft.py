@@ -7,10 +7,20 @@ import pytest
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from soramimi_align.athlete_table import SubstringIndex
+from soramimi_align.cache import TokenizationCache
 from soramimi_align.make_draft import (
+    AthleteName,
     AthleteNameDetector,
     AthleteParodyLyrics,
+    DraftFileOptions,
+    DraftManifest,
+    ErrataReplacer,
+    SudachiTokenizerProvider,
     Tokenizer,
+    format_draft_status_summary,
+    get_tokenizer_fingerprint,
+    make_draft_file,
     parse_lyrics,
     summarize_parsed_lyrics,
 )
@@ -125,3 +135,193 @@ def test_tokenizer_is_phrase_start(tokenizer):
     assert tokenizer.is_phrase_start(tokens[3], tokens[2]) is True  # 失礼
     assert tokenizer.is_phrase_start(tokens[4], tokens[3]) is True  # し
     assert tokenizer.is_phrase_start(tokens[5], tokens[4]) is False  # ます
+
+
+def test_tokenizer_parse_cache(tokenizer):
+    results = tokenizer.parse("風の中のすばる")
+    # 整形後に同じ行ならparseの結果を再利用する
+    assert tokenizer.format_text("風の中のすばる。") == "風の中のすばる"
+    assert tokenizer.parse("風の中のすばる。") == results
+    assert tokenizer.parse_cache_hits == 1
+    assert tokenizer.parse_cache_misses == 1
+
+
+def test_tokenizer_parse_cache_maxsize(tmp_path):
+    cache_path = str(tmp_path / "tokenization.db")
+    with TokenizationCache(cache_path, get_tokenizer_fingerprint("full")) as cache:
+        cache.put("風", [("風", "カゼ", True)])
+        cache.put("すばる", [("すばる", "スバル", True)])
+        cache.put("星", [("星", "ホシ", True)])
+
+    tokenizer = Tokenizer(
+        SudachiTokenizerProvider(), tokenization_cache_path=cache_path
+    )
+    tokenizer.parse_cache_maxsize = 2
+    for text in ["風", "すばる", "風", "星", "風", "すばる"]:
+        tokenizer.parse(text)
+    # 上限を超えたら最後に使ってから時間が経った行から捨てる
+    assert list(tokenizer._parse_cache) == ["風", "すばる"]
+    assert (tokenizer.parse_cache_hits, tokenizer.parse_cache_misses) == (2, 4)
+    tokenizer.tokenization_cache.close()
+
+
+def test_sudachi_tokenizer_provider_is_lazy(athlete_name_detector):
+    sudachi_provider = SudachiTokenizerProvider()
+    tokenizer = Tokenizer(sudachi_provider)
+    athlete_name_detector.sudachi_provider = sudachi_provider
+    athlete_name_detector.set_athlete_names(["イチロー", "大谷有"])
+
+    # 選手の表で読みが決まる名前や、整形だけでは辞書を読み込まない
+    pronunciation_candidates, _ = athlete_name_detector.get_pronunciation_candidates(
+        AthleteName.from_text("大谷")
+    )
+    assert pronunciation_candidates == {"オオタニ"}
+    assert tokenizer.format_text("大谷 有") == "大谷 有"
+    assert not sudachi_provider.is_loaded
+    assert sudachi_provider.summary() == "sudachi dictionary (full): not loaded"
+
+
+def test_tokenization_cache_skips_sudachi(tmp_path):
+    cache_path = str(tmp_path / "tokenization.db")
+    with TokenizationCache(cache_path, get_tokenizer_fingerprint("full")) as cache:
+        cache.put(
+            "風の中のすばる",
+            [("風", "カゼ", True), ("の中のすばる", "ノナカノスバル", False)],
+        )
+
+    sudachi_provider = SudachiTokenizerProvider()
+    tokenizer = Tokenizer(sudachi_provider, tokenization_cache_path=cache_path)
+    results = tokenizer.parse("風の中のすばる。")
+    assert [(w.surface, w.pronunciation, w.is_phrase_start) for w in results] == [
+        ("風", "カゼ", True),
+        ("の中のすばる", "ノナカノスバル", False),
+    ]
+    assert tokenizer.tokenization_cache.hits == 1
+    # 保存した結果があれば辞書を読み込まない
+    assert not sudachi_provider.is_loaded
+    tokenizer.tokenization_cache.close()
+
+
+def test_make_draft_file(athlete_name_detector, tokenizer, tmp_path):
+    file_path = str(tmp_path / "lyric.txt")
+    output_file_path = str(tmp_path / "draft.txt")
+    with open(file_path, "w") as f:
+        f.write("イチロー 大谷\n風の中のすばる\n\n選手一覧\nイチロー\n大谷有\n")
+
+    report = make_draft_file(
+        file_path,
+        output_file_path,
+        athlete_name_detector,
+        tokenizer,
+        DraftFileOptions(),
+    )
+    assert report.stdout.startswith(f"{file_path} write\n")
+    assert report.status == "rebuilt"
+    assert report.parse_cache_misses == 1
+    with open(output_file_path, "r") as f:
+        assert f.read().split("\n")[:2] == ["イチロー 大谷", "イチロー オオタニ"]
+
+    # 出力が既にあれば上書きせず、同じ行の解析は再利用する
+    report = make_draft_file(
+        file_path,
+        output_file_path,
+        athlete_name_detector,
+        tokenizer,
+        DraftFileOptions(),
+    )
+    assert report.stdout.startswith(f"{file_path} skip\n")
+    assert report.status == "skipped"
+    assert report.parse_cache_hits == 1
+
+
+def test_substring_index():
+    keys = ["鈴木一郎", "鈴木", "一郎", "大谷翔平", "翔", ""]
+    index = SubstringIndex(keys)
+    for substring in ["", "鈴", "木一", "鈴木一郎", "一郎", "谷翔平", "翔太", "x"]:
+        assert index.find(substring) == [key for key in keys if substring in key]
+
+
+def test_get_ids_from_surface(athlete_name_detector):
+    assert athlete_name_detector.get_ids_from_surface("大谷") == {2}
+    # 完全一致がなければ部分一致で検索する
+    assert athlete_name_detector.get_ids_from_surface("ビッシュ") == {3}
+    assert athlete_name_detector.get_ids_from_surface("有") == {2, 3}
+    assert athlete_name_detector.get_ids_from_surface("松井") == set()
+
+
+def test_get_pronunciation_candidates(athlete_name_detector):
+    athlete_name_detector.set_athlete_names(["イチロー", "大谷有", "ダルビッシュ有"])
+    assert athlete_name_detector.athlete_name_pronunciations["有"] == [
+        ("大谷有", {"アル"}),
+        ("ダルビッシュ有", {"ユウ"}),
+    ]
+    assert athlete_name_detector.get_pronunciation_candidates(
+        AthleteName.from_text("有")
+    ) == ({"アル", "ユウ"}, "athlete_names_full_surface")
+    assert athlete_name_detector.get_pronunciation_candidates(
+        AthleteName.from_text("鈴木")
+    ) == ({"スズキ"}, "athlete_table")
+
+    # 曲が変われば選手一覧から作り直す
+    athlete_name_detector.set_athlete_names(["大谷有"])
+    assert athlete_name_detector.get_pronunciation_candidates(
+        AthleteName.from_text("有")
+    ) == ({"アル"}, "athlete_names_full_surface")
+
+
+def test_errata_replacer():
+    errata_replacer = ErrataReplacer(
+        {"わすれ": "忘れ", "わす": "和す", "れがた": "X", "(1)": "", "": "空"}
+    )
+    # 同じ位置から始まるキーは長いものを使い、置換した結果は置換しない
+    assert errata_replacer.replace("わすれがたき わすか (1)") == "忘れがたき 和すか "
+    assert (
+        ErrataReplacer({"忘れ": "わすれ", "わすれ": "忘れ"}).replace("忘れ") == "わすれ"
+    )
+    assert ErrataReplacer({}).replace("わすれ") == "わすれ"
+
+
+def test_draft_manifest(tmp_path):
+    input_path = str(tmp_path / "input.txt")
+    output_path = str(tmp_path / "output.txt")
+    manifest_path = str(tmp_path / "manifest.json")
+    with open(input_path, "w") as f:
+        f.write("歌詞")
+
+    manifest = DraftManifest.load(manifest_path, "dependencies")
+    assert manifest.get_skip_reason(input_path, output_path) is None
+    with open(output_path, "w") as f:
+        f.write("ドラフト")
+    # 記録がないドラフトは上書きしない
+    assert manifest.is_untracked(output_path)
+    assert manifest.get_skip_reason(input_path, output_path) is not None
+    manifest.record(input_path, output_path)
+    assert not manifest.is_untracked(output_path)
+    manifest.save()
+
+    manifest = DraftManifest.load(manifest_path, "dependencies")
+    assert manifest.get_skip_reason(input_path, output_path) == "入力が変わっていません"
+    # 選手の表などが変われば作り直す
+    changed_manifest = DraftManifest.load(manifest_path, "changed dependencies")
+    assert changed_manifest.get_skip_reason(input_path, output_path) is None
+    # 入力が変われば作り直す
+    with open(input_path, "w") as f:
+        f.write("変えた歌詞")
+    manifest = DraftManifest.load(manifest_path, "dependencies")
+    assert manifest.get_skip_reason(input_path, output_path) is None
+    # 手で修正したドラフトは上書きしない
+    with open(output_path, "w") as f:
+        f.write("修正したドラフト")
+    assert "手で修正" in manifest.get_skip_reason(input_path, output_path)
+
+
+def test_format_draft_status_summary():
+    statuses = [("a.txt", "rebuilt"), ("b.txt", "skipped"), ("c.txt", "failed")]
+    assert format_draft_status_summary(statuses) == (
+        "drafts: 1 rebuilt, 1 skipped, 1 failed\n  failed: c.txt"
+    )
+    statuses = [("a.txt", "rebuilt"), ("b.txt", "untracked"), ("c.txt", "adopted")]
+    assert format_draft_status_summary(statuses) == (
+        "drafts: 1 rebuilt, 0 skipped, 0 failed, 1 untracked, 1 adopted\n"
+        "  untracked: b.txt"
+    )
@@ -0,0 +1,35 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from soramimi_align.mora_table import MORA_TABLE, MoraTable
+
+
+def test_mora_table():
+    table = MoraTable(["ア", "リョ"])
+    assert table.get_id("") == 0
+    assert table.get_id("ア") == 1
+    assert table.get_id("リョ") == 2
+    assert len(table) == 3
+
+    # 表にないモウラは参照時に追加される
+    assert "ン" not in table
+    mora_id = table.get_id("ン")
+    assert mora_id == 3
+    assert table.get_id("ン") == mora_id
+    assert table.encode(["ア", "ン", ""]) == [1, 3, 0]
+
+    assert table.split_consonant_vowel("") == ("", "")
+    assert table.split_consonant_vowel("ア") == ("sp", "a")
+    assert table.split_consonant_vowel("リョ") == ("rj", "o")
+    assert table.is_special("ン") is True
+    assert table.is_special("ア") is False
+    assert table.is_special("") is False
+
+
+def test_shared_mora_table():
+    for mora in ["ア", "カ", "シュ", "ン", "ー", "ッ"]:
+        assert mora in MORA_TABLE
+    assert MORA_TABLE.split_consonant_vowel("ー") == ("sp", ":")
+    assert MORA_TABLE.split_consonant_vowel("ッ") == ("sp", "Q")
@@ -1,6 +1,9 @@
+import io
 import os
 import sys
 
+import pytest
+
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from soramimi_align.schemas import (
     AnalyzedLyrics,
@@ -125,3 +128,97 @@ def test_analyzed_lyrics_from_text():
     assert analyzed_lyrics.original[0][4] == AnalyzedWordItem(
         surface="すばる", pronunciation="スバル", is_phrase_start=True, memo={}
     )
+
+
+def test_analyzed_lyrics_from_text_with_pronunciation_candidates():
+    text = """
+    大谷 有
+    オオタニ ユウ|アリ
+    風 の
+    カゼ/p ノ"""
+
+    analyzed_lyrics = AnalyzedLyrics.from_text(text)
+
+    assert analyzed_lyrics.parody[0][1] == AnalyzedWordItem(
+        surface="有",
+        pronunciation="ユウ",
+        is_phrase_start=False,
+        memo={
+            "pronunciation_candidate_num": 2,
+            "pronunciation_candidates": ["ユウ", "アリ"],
+        },
+    )
+
+
+def test_analyzed_word_item_lazy_memo():
+    word = AnalyzedWordItem("山", "ヤマ", True)
+    assert not hasattr(word, "__dict__")
+    assert word.get_memo("method") is None
+    assert word._memo is None
+    assert word == AnalyzedWordItem("山", "ヤマ", True, {})
+    assert (
+        repr(word)
+        == "AnalyzedWordItem(surface='山', pronunciation='ヤマ', is_phrase_start=True, memo={})"
+    )
+
+    word.memo["method"] = "sudachi"
+    assert word.get_memo("method") == "sudachi"
+    assert word == AnalyzedWordItem("山", "ヤマ", True, {"method": "sudachi"})
+
+    # 渡した辞書は空でもそのまま共有する
+    for make_word in [AnalyzedWordItem, AnalyzedWordItem.trusted]:
+        memo = {}
+        word = make_word("山", "ヤマ", True, memo)
+        assert word.memo is memo
+        word.memo["method"] = "sudachi"
+        assert memo == {"method": "sudachi"}
+        word = make_word("山", "ヤマ", True)
+        word.memo = memo
+        assert word.memo is memo
+
+
+def test_analyzed_lyrics_summarize_warnings():
+    text = """
+    宇佐美
+    ウサミ
+    うさぎ 追い
+    ウサギ/p おい/p
+    """
+    lyrics = AnalyzedLyrics.from_text(text)
+    assert lyrics.original[0][1] == AnalyzedWordItem("追い", "おい", True)
+    assert lyrics.original[0][1] == AnalyzedWordItem.trusted("追い", "おい", True)
+    assert len(lyrics.find_warnings()) == 1
+    summary = lyrics.summarize_warnings("draft.txt")
+    assert summary.startswith("draft.txt: 1件の警告")
+    assert "追い おい" in summary
+
+    lyrics = AnalyzedLyrics.from_text(text.replace("おい", "オイ"))
+    assert lyrics.find_warnings() == []
+    assert lyrics.summarize_warnings("draft.txt") == ""
+
+
+def test_analyzed_lyrics_iter_from_file():
+    text = """
+宇佐美 小石博孝
+ウサミ コイシヒロタカ
+うさぎ 追い
+ウサギ/p オイ/p
+
+小塚
+コヅカ
+コブナ 釣り
+コブナ/p ツリ/p
+"""
+    line_pairs = list(AnalyzedLyrics.iter_from_file(io.StringIO(text)))
+    lyrics = AnalyzedLyrics.from_text(text)
+    assert [parody for parody, _ in line_pairs] == lyrics.parody
+    assert [original for _, original in line_pairs] == lyrics.original
+
+    with pytest.raises(ValueError, match="^9行目"):
+        list(
+            AnalyzedLyrics.iter_from_file(
+                io.StringIO(text.replace("コブナ 釣り", "コブナ"))
+            )
+        )
+    with pytest.raises(ValueError, match="^7行目"):
+        list(AnalyzedLyrics.iter_from_file(io.StringIO(text.replace("コヅカ\n", ""))))